@@ -157,3 +157,46 @@ CORS_ALLOWED_ORIGINS = [
 
 CORS_ALLOW_CREDENTIALS = True
 
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# Mémoire locale par défaut. Avec plusieurs workers, utiliser un cache partagé
+# pour que l'invalidation du catalogue soit vue par tous les processus, p. ex.
+#   'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#   'LOCATION': BASE_DIR / 'cache',
+# ou
+#   'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#   'LOCATION': 'redis://127.0.0.1:6379',
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'garde-temps',
+    },
+    # Représentations sérialisées des montres (une entrée par montre et par serializer)
+    'representations': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'garde-temps-representations',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+# Garde-Temps
+WATCHES_CACHE_ALIAS = 'default'
+# Un seul processus (runserver) : le cache en mémoire locale suffit pour les
+# ETag et valeurs dérivées du catalogue. Sinon, cache partagé requis (watches.W001)
+WATCHES_SINGLE_PROCESS = DEBUG
+WATCHES_CACHE_TIMEOUT = 24 * 3600  # secondes
+WATCHES_REPRESENTATION_CACHE_ALIAS = 'representations'
+# Exports PDF : au-delà de ce nombre de montres, rendu en arrière-plan (202 + job)
+WATCHES_EXPORT_QUEUE_THRESHOLD = 200
+WATCHES_EXPORT_WORKERS = 2  # threads de rendu ; 0 = rendu dans le thread appelant
+# manage.py process_exports : reprise des jobs bloqués en cours, conservation des fichiers (secondes)
+WATCHES_EXPORT_STALE_AFTER = 3600
+WATCHES_EXPORT_RETENTION = 24 * 3600
+# Rendu des catalogues PDF : processus de dessin par processus web (1 = pas de pool) et pages par paquet
+WATCHES_PDF_WORKERS = 2
+WATCHES_PDF_SHARD_SIZE = 100
+# Cache disque des certificats et fiches d'une montre (watches/pdf_cache.py)
+WATCHES_PDF_CACHE_DIR = 'pdf-cache'  # sous MEDIA_ROOT
+WATCHES_PDF_CACHE_MAX_BYTES = 256 * 1024 * 1024
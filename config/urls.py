@@ -6,18 +6,32 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework.routers import DefaultRouter
-from watches.views import BrandViewSet, ComplicationViewSet, WatchViewSet
+from watches import async_views
+from watches.images import DERIVATIVES_DIR, image_derivative
+from watches.views import BrandViewSet, CatalogueStatsView, ComplicationViewSet, ExportJobViewSet, WatchViewSet
 
 # Configuration du router DRF
 router = DefaultRouter()
 router.register(r'brands', BrandViewSet, basename='brand')
 router.register(r'complications', ComplicationViewSet, basename='complication')
 router.register(r'watches', WatchViewSet, basename='watch')
+router.register(r'exports', ExportJobViewSet, basename='export-job')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/stats/', CatalogueStatsView.as_view(), name='catalogue-stats'),
+    # Lecture asynchrone (ASGI) : même JSON que les endpoints DRF correspondants
+    path('api/async/watches/', async_views.watch_list, name='async-watch-list'),
+    path('api/async/watches/<int:pk>/', async_views.watch_detail, name='async-watch-detail'),
+    path('api/async/brands/', async_views.brand_list, name='async-brand-list'),
+    path('api/async/complications/', async_views.complication_list, name='async-complication-list'),
     path('api/', include(router.urls)),
     path('api-auth/', include('rest_framework.urls')),  # Interface de login DRF
+    # Déclinaisons d'images pas encore générées (le serveur de fichiers sert les autres)
+    path(
+        f'{settings.MEDIA_URL.lstrip("/")}{DERIVATIVES_DIR}/<path:path>',
+        image_derivative, name='image-derivative'
+    ),
 ]
 
 # Servir les fichiers media en développement
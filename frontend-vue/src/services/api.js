@@ -1,6 +1,7 @@
 import axios from 'axios'
 
 const API_BASE_URL = 'http://localhost:8000/api'
+const BULK_MAX_IDS = 100 // WatchViewSet.bulk_max_ids
 
 const api = axios.create({
     baseURL: API_BASE_URL,
@@ -9,16 +10,61 @@ const api = axios.create({
     }
 })
 
+const EXPORT_POLL_INTERVAL = 1000 // ms
+
+async function downloadExport(url, watchIds) {
+    const response = await api.post(url, { watch_ids: watchIds }, { responseType: 'blob' })
+    if (response.status !== 202) {
+        return response
+    }
+    let job = JSON.parse(await response.data.text())
+    while (job.status === 'PENDING' || job.status === 'RUNNING') {
+        await new Promise(resolve => setTimeout(resolve, EXPORT_POLL_INTERVAL))
+        job = (await api.get(job.status_url)).data
+    }
+    if (job.status !== 'DONE') {
+        throw new Error(job.error || "Échec de l'export")
+    }
+    return api.get(job.download_url, { responseType: 'blob' })
+}
+
 export default {
     // Watches
+    // fast: JSON identique, construit côté serveur sans serializer DRF
     getWatches(params = {}) {
-        return api.get('/watches/', { params })
+        return api.get('/watches/', { params: { fast: 1, ...params } })
+    },
+
+    // Counts per filter option, for the current filters (one request)
+    getFacets(params = {}) {
+        return api.get('/watches/facets/', { params })
     },
 
     getWatch(id) {
         return api.get(`/watches/${id}/`)
     },
 
+    compareWatches(ids) {
+        return api.get('/watches/compare/', { params: { ids: ids.join(',') } })
+    },
+
+    getSimilarWatches(id, limit = 6) {
+        return api.get(`/watches/${id}/similar/`, { params: { limit } })
+    },
+
+    // Fetch specific watches by ID (order preserved), in batches of BULK_MAX_IDS
+    async getWatchesByIds(ids) {
+        const batches = []
+        for (let i = 0; i < ids.length; i += BULK_MAX_IDS) {
+            batches.push(api.post('/watches/bulk/', { ids: ids.slice(i, i + BULK_MAX_IDS) }))
+        }
+        const responses = await Promise.all(batches)
+        return {
+            results: responses.flatMap(r => r.data.results),
+            missing: responses.flatMap(r => r.data.missing)
+        }
+    },
+
     // Brands
     getBrands() {
         return api.get('/brands/')
@@ -30,21 +76,17 @@ export default {
     },
 
     // PDF Export
-    exportPDF(watchIds) {
-        return api.post('/watches/export-pdf/', { watch_ids: watchIds }, {
-            responseType: 'blob'
-        })
+    // Au-delà d'un certain nombre de montres, le serveur répond 202 avec un job
+    // d'export : on attend qu'il soit terminé puis on télécharge le fichier.
+    async exportPDF(watchIds) {
+        return downloadExport('/watches/export-pdf/', watchIds)
     },
 
-    exportWishlistPDF(watchIds) {
-        return api.post('/watches/export-wishlist/', { watch_ids: watchIds }, {
-            responseType: 'blob'
-        })
+    async exportWishlistPDF(watchIds) {
+        return downloadExport('/watches/export-wishlist/', watchIds)
     },
 
-    exportComparisonPDF(watchIds) {
-        return api.post('/watches/export-comparison/', { watch_ids: watchIds }, {
-            responseType: 'blob'
-        })
+    async exportComparisonPDF(watchIds) {
+        return downloadExport('/watches/export-comparison/', watchIds)
     }
 }
@@ -1,19 +1,16 @@
 from django.contrib import admin
-from django.http import HttpResponse, JsonResponse
-from django.urls import path
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.urls import path, reverse
 from django.utils.html import format_html
-from .models import Brand, Complication, Watch
-import json
+from .cache import cached_for_version
+from .dump import dump_database, dump_filename
+from .exports import get_export_queue_threshold, submit_export
+from .models import Brand, Complication, ExportJob, Watch
+from .pdf_cache import open_cached_pdf
+from .rendering import pdf, pyplot
+from .stats import get_catalogue_stats
 from io import BytesIO
 import base64
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-plt.style.use('dark_background') # Base style for all charts
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import cm
-from django.core.serializers import serialize
 
 
 @admin.register(Brand)
@@ -37,6 +34,13 @@ class ComplicationAdmin(admin.ModelAdmin):
     watch_count.short_description = "Nombre de montres"
 
 
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'status', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status']
+    readonly_fields = ['kind', 'watch_ids', 'status', 'file', 'filename', 'error', 'created_at', 'started_at', 'finished_at']
+
+
 @admin.register(Watch)
 class WatchAdmin(admin.ModelAdmin):
     list_display = [
@@ -48,75 +52,22 @@ class WatchAdmin(admin.ModelAdmin):
     filter_horizontal = ['complications']
     readonly_fields = ['serial_number', 'created_at', 'updated_at']
     
-    actions = ['export_database_json', 'export_pdf_catalog', 'show_movement_chart', 'show_price_chart']
+    actions = ['export_database_json', 'export_database_ndjson', 'export_pdf_catalog', 'show_movement_chart', 'show_price_chart']
     
     def export_pdf_catalog(self, request, queryset):
         """Génère un catalogue PDF pour les montres sélectionnées"""
+        watch_ids = list(queryset.values_list('id', flat=True))
+        if len(watch_ids) > get_export_queue_threshold():
+            job = submit_export('admin_catalogue', watch_ids)
+            self.message_user(request, format_html(
+                'Catalogue de {} montres en cours de génération : <a href="{}">télécharger</a> '
+                '(disponible dans quelques instants).',
+                len(watch_ids), reverse('export-job-download', args=[job.pk]),
+            ))
+            return None
+
         buffer = BytesIO()
-        p = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-        
-        for i, watch in enumerate(queryset):
-            if i > 0:
-                p.showPage()
-            
-            # En-tête
-            p.setFont("Helvetica-Bold", 24)
-            p.drawCentredString(width/2, height - 2*cm, "FICHE TECHNIQUE")
-            
-            # Logo/Marque
-            p.setFont("Helvetica-Bold", 18)
-            p.drawCentredString(width/2, height - 3*cm, f"{watch.brand.name} - {watch.model_name}")
-            
-            p.setStrokeColorRGB(0.8, 0.6, 0.2)
-            p.line(2*cm, height - 3.5*cm, width - 2*cm, height - 3.5*cm)
-            
-            # Contenu
-            p.setFont("Helvetica-Bold", 12)
-            y = height - 5*cm
-            
-            data = [
-                ("Référence:", watch.reference_number),
-                ("Prix:", f"{watch.price} €"),
-                ("Mouvement:", watch.get_movement_type_display()),
-                ("Matériau:", watch.get_case_material_display()),
-                ("Diamètre:", f"{watch.case_diameter} mm"),
-                ("Étanchéité:", f"{watch.water_resistance} m"),
-                ("Description:", watch.description[:500] + "..." if len(watch.description) > 500 else watch.description),
-            ]
-            
-            for label, value in data:
-                p.setFont("Helvetica-Bold", 11)
-                p.drawString(2*cm, y, label)
-                p.setFont("Helvetica", 11)
-                
-                # Gestion du texte long (description)
-                if label == "Description:":
-                    y -= 0.6*cm
-                    text_obj = p.beginText(2*cm, y)
-                    text_obj.setFont("Helvetica", 10)
-                    text_obj.setTextOrigin(2*cm, y)
-                    # Simple wrap
-                    words = value.split()
-                    line = ""
-                    for word in words:
-                        if len(line + word) < 90:
-                            line += word + " "
-                        else:
-                            text_obj.textLine(line)
-                            line = word + " "
-                            y -= 0.4*cm
-                    text_obj.textLine(line)
-                    p.drawText(text_obj)
-                else:
-                    p.drawString(6*cm, y, str(value))
-                    y -= 0.8*cm
-            
-            # Footer de page
-            p.setFont("Helvetica-Oblique", 8)
-            p.drawCentredString(width/2, 1*cm, f"Page {i+1} | Chrono-Collections • 2026")
-            
-        p.save()
+        pdf().write_admin_catalogue_pdf(buffer, watch_ids)
         buffer.seek(0)
         
         response = HttpResponse(buffer, content_type='application/pdf')
@@ -145,121 +96,57 @@ class WatchAdmin(admin.ModelAdmin):
         return custom_urls + urls
     
     def generate_certificate(self, request, watch_id):
-        """Génère un PDF certificat d'authenticité avec ReportLab"""
+        """Certificat d'authenticité PDF (rendu une fois, puis servi depuis le cache disque)"""
         try:
             watch = Watch.objects.get(pk=watch_id)
+            file = open_cached_pdf('certificate', watch.pk)
         except Watch.DoesNotExist:
             return HttpResponse("Montre non trouvée", status=404)
         
-        buffer = BytesIO()
-        p = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-        
-        # En-tête élégant
-        p.setFont("Helvetica-Bold", 28)
-        p.drawCentredString(width/2, height - 3*cm, "CERTIFICAT D'AUTHENTICITÉ")
-        
-        # Sous-titre
-        p.setFont("Helvetica-Oblique", 12)
-        p.drawCentredString(width/2, height - 3.8*cm, "Garde-Temps de Prestige")
-        
-        # Ligne décorative dorée
-        p.setStrokeColorRGB(0.8, 0.6, 0.2)
-        p.setLineWidth(2)
-        p.line(4*cm, height - 4.5*cm, width - 4*cm, height - 4.5*cm)
-        
-        # Informations de la montre
-        p.setFont("Helvetica-Bold", 14)
-        p.setFillColorRGB(0, 0, 0)
-        y = height - 6.5*cm
-        
-        # Titre de section
-        p.drawString(4*cm, y, "INFORMATIONS DU GARDE-TEMPS")
-        y -= 1.2*cm
-        
-        # Détails
-        p.setFont("Helvetica", 11)
-        details = [
-            ("Marque:", watch.brand.name),
-            ("Modèle:", watch.model_name),
-            ("Référence:", watch.reference_number),
-            ("Numéro de série:", watch.serial_number or 'N/A'),
-            ("", ""),  # Espace
-            ("Mouvement:", watch.get_movement_type_display()),
-            ("Matériau:", watch.get_case_material_display()),
-            ("Diamètre du boîtier:", f"{watch.case_diameter} mm"),
-            ("Étanchéité:", f"{watch.water_resistance} mètres"),
-            ("", ""),  # Espace
-            ("Prix catalogue:", f"{watch.price} €"),
-        ]
-        
-        for label, value in details:
-            if label:  # Si ce n'est pas un espace
-                p.setFont("Helvetica-Bold", 11)
-                p.drawString(4*cm, y, label)
-                p.setFont("Helvetica", 11)
-                p.drawString(9*cm, y, str(value))
-            y -= 0.7*cm
-        
-        # Complications si présentes
-        complications = watch.complications.all()
-        if complications:
-            y -= 0.5*cm
-            p.setFont("Helvetica-Bold", 11)
-            p.drawString(4*cm, y, "Complications:")
-            y -= 0.7*cm
-            p.setFont("Helvetica", 11)
-            for comp in complications:
-                p.drawString(5*cm, y, f"• {comp.name}")
-                y -= 0.6*cm
-        
-        # Cadre décoratif
-        p.setStrokeColorRGB(0.8, 0.6, 0.2)
-        p.setLineWidth(1)
-        p.rect(3*cm, 2*cm, width - 6*cm, height - 5*cm, stroke=1, fill=0)
-        
-        # Pied de page
-        p.setFont("Helvetica-Oblique", 9)
-        p.setFillColorRGB(0.5, 0.5, 0.5)
-        p.drawCentredString(width/2, 1.5*cm, "Ce certificat atteste de l'authenticité du garde-temps décrit ci-dessus.")
-        p.drawCentredString(width/2, 1*cm, "Chrono-Collections • 2026")
-        
-        p.showPage()
-        p.save()
-        
-        buffer.seek(0)
-        response = HttpResponse(buffer, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="certificat_{watch.reference_number}.pdf"'
-        return response
+        return FileResponse(
+            file, as_attachment=True,
+            filename=f'certificat_{watch.reference_number}.pdf', content_type='application/pdf',
+        )
     
     def export_database_json(self, request, queryset):
-        """Exporte toute la base de données en JSON"""
-        data = {
-            'brands': json.loads(serialize('json', Brand.objects.all())),
-            'complications': json.loads(serialize('json', Complication.objects.all())),
-            'watches': json.loads(serialize('json', Watch.objects.all())),
-        }
-        
-        response = JsonResponse(data, safe=False, json_dumps_params={'indent': 2})
-        response['Content-Disposition'] = 'attachment; filename="database_export.json"'
-        return response
+        """Exporte toute la base de données en JSON (en flux)"""
+        return self._database_dump_response('json')
     export_database_json.short_description = "📦 Exporter la BDD en JSON"
 
+    def export_database_ndjson(self, request, queryset):
+        """Exporte toute la base en NDJSON compressé (rechargeable avec loaddata)"""
+        return self._database_dump_response('ndjson', compress=True)
+    export_database_ndjson.short_description = "🗜️ Exporter la BDD en NDJSON (gzip)"
+
+    def _database_dump_response(self, format, compress=False):
+        response = StreamingHttpResponse(
+            dump_database(format, compress),
+            content_type='application/gzip' if compress else 'application/json',
+        )
+        response['Content-Disposition'] = f'attachment; filename="{dump_filename(format, compress)}"'
+        return response
+
     def _get_movement_chart_base64(self):
+        """Graphique mouvement en base64, mis en cache jusqu'à la prochaine écriture"""
+        return cached_for_version('chart:movement', self._render_movement_chart)
+
+    def _get_price_chart_base64(self):
+        """Graphique prix moyen en base64, mis en cache jusqu'à la prochaine écriture"""
+        return cached_for_version('chart:price', self._render_price_chart)
+
+    def _render_movement_chart(self):
         """Helper pour générer le graphique mouvement en base64"""
-        movements = Watch.objects.values_list('movement_type', flat=True)
-        movement_counts = {}
-        for m in movements:
-            movement_counts[m] = movement_counts.get(m, 0) + 1
+        movement_counts = [m for m in get_catalogue_stats()['movements'] if m['count']]
         
         if not movement_counts:
             return None
         
-        labels = [dict(Watch.MOVEMENT_CHOICES).get(k, k) for k in movement_counts.keys()]
-        sizes = list(movement_counts.values())
+        labels = [m['label'] for m in movement_counts]
+        sizes = [m['count'] for m in movement_counts]
         # Palette Luxe: Or, Argent, Platine, Bronze
         colors = ['#c5a059', '#a6a6a6', '#e5e4e2', '#cd7f32']
         
+        plt = pyplot()
         fig, ax = plt.subplots(figsize=(5, 5))
         fig.patch.set_facecolor('none') # Fond transparent
         ax.set_facecolor('none')
@@ -284,19 +171,20 @@ class WatchAdmin(admin.ModelAdmin):
         plt.close(fig)
         return base64.b64encode(buffer.getvalue()).decode()
 
-    def _get_price_chart_base64(self):
+    def _render_price_chart(self):
         """Helper pour générer le graphique prix moyen en base64"""
-        from django.db.models import Avg
-        brand_prices = Brand.objects.annotate(
-            avg_price=Avg('watches__price')
-        ).filter(avg_price__isnull=False).order_by('-avg_price')[:5] # Top 5
+        brand_prices = sorted(
+            (b for b in get_catalogue_stats()['brands'] if b['avg_price'] is not None),
+            key=lambda b: b['avg_price'], reverse=True
+        )[:5] # Top 5
         
         if not brand_prices:
             return None
         
-        brands = [b.name for b in brand_prices]
-        prices = [float(b.avg_price) for b in brand_prices]
+        brands = [b['name'] for b in brand_prices]
+        prices = [float(b['avg_price']) for b in brand_prices]
         
+        plt = pyplot()
         fig, ax = plt.subplots(figsize=(6, 4))
         fig.patch.set_facecolor('none')
         ax.set_facecolor('none')
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class WatchesConfig(AppConfig):
     name = 'watches'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401 (enregistrement des vérifications et receivers)
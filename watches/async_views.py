@@ -0,0 +1,254 @@
+"""
+Lecture du catalogue en vues asynchrones (``/api/async/...``).
+
+Sous ASGI, les viewsets DRF (synchrones) passent chacun par un thread du
+pool : une génération de PDF ou une recherche lente retarde les requêtes
+légères qui attendent un thread. Ces vues sont des coroutines Django,
+servies nativement par la boucle d'événements, qui n'utilisent que l'ORM
+asynchrone (``acount``, ``aiterator``, ``aget``).
+
+Le JSON est identique à celui des endpoints DRF correspondants (mêmes
+serializers, même pagination, mêmes filtres, même recherche et ETag). La
+pagination par curseur est déléguée au viewset synchrone. Le cache est lu
+par son API asynchrone, le détail assemblé sans appel synchrone
+(``arepresent_many``). Les filtres (``WatchFilter``) sont validés dans la
+boucle d'événements, sauf ceux qui interrogent la base (marque,
+complications, recherche FTS) : ceux-là passent par ``sync_to_async``. Le
+queryset obtenu (filtres, tri, recherche) reste paresseux et n'est évalué
+que par l'ORM asynchrone.
+
+Les appels synchrones ``thread_sensitive`` (ORM et cache asynchrones
+compris) partagent un même thread hors contexte dédié : chaque vue ouvre le
+sien (``ThreadSensitiveContext``, comme ``ASGIHandler`` par requête) pour ne
+pas attendre derrière les vues synchrones, exports PDF compris.
+"""
+import asyncio
+from functools import wraps
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.db import connections
+from django.db.models import Prefetch, Q
+from django.http import JsonResponse
+from django.views.decorators.http import require_safe
+from django_filters.rest_framework import ModelChoiceFilter, ModelMultipleChoiceFilter
+from django_filters.utils import translate_validation
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .cache import aget_catalogue_validators, catalogue_cache_is_shared
+from .conditional import add_validators, catalogue_etag, not_modified_response
+from .filters import ComplicationMaskFilter, WatchFilter
+from .models import Watch
+from .pagination import WatchPagination
+from .search import WatchSearchFilter
+from .serializers import BrandSerializer, ComplicationSerializer, WatchDetailSerializer, WatchListValues
+from .views import (
+    BrandViewSet, ComplicationViewSet, WatchViewSet,
+    brands_with_counts, complications_with_counts, watches_with_counts,
+)
+
+
+MEDIA_TYPE = 'application/json'
+
+# Paramètres traités par le viewset synchrone
+SYNC_ONLY_PARAMS = ['cursor', 'pagination']
+
+# Paramètres dont la validation ou le filtre interroge la base : sans eux,
+# les filtres sont validés dans la boucle d'événements
+DATABASE_PARAMS = [api_settings.SEARCH_PARAM] + [
+    name for name, filter_ in WatchFilter.base_filters.items()
+    if isinstance(filter_, (ModelChoiceFilter, ModelMultipleChoiceFilter, ComplicationMaskFilter))
+]
+
+sync_watch_list = sync_to_async(WatchViewSet.as_view({'get': 'list'}))
+
+
+def json_response(data, status=200):
+    return JsonResponse(data, status=status, safe=False, json_dumps_params={'ensure_ascii': False})
+
+
+def error_response(detail, status):
+    return json_response({'detail': str(detail)}, status=status)
+
+
+def ordered(queryset, request, view):
+    """Équivalent de ``OrderingFilter`` pour les ``ordering_fields`` de la vue"""
+    fields = [
+        term.strip() for term in request.GET.get(api_settings.ORDERING_PARAM, '').split(',')
+        if term.strip().lstrip('-') in (getattr(view, 'ordering_fields', None) or [])
+    ]
+    ordering = fields or getattr(view, 'ordering', None)
+    return queryset.order_by(*ordering) if ordering else queryset
+
+
+def searched(queryset, request, view):
+    """Équivalent de ``SearchFilter`` (icontains sur chaque terme)"""
+    for term in request.GET.get(api_settings.SEARCH_PARAM, '').replace(',', ' ').split():
+        condition = Q()
+        for field in view.search_fields:
+            condition |= Q(**{f'{field}__icontains': term})
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+async def paginate(request, queryset, page_size_query_param=None, max_page_size=None):
+    """
+    Même enveloppe que ``PageNumberPagination`` (count, next, previous,
+    results). Renvoie ``(enveloppe, lignes)`` ou lève ``NotFound``.
+    """
+    page_size = api_settings.PAGE_SIZE
+    if page_size_query_param:
+        try:
+            page_size = min(max(int(request.GET[page_size_query_param]), 1), max_page_size)
+        except (KeyError, ValueError):
+            pass
+    try:
+        page = int(request.GET.get('page', 1))
+    except ValueError:
+        raise NotFound(PageNumberPagination.invalid_page_message)
+
+    if page < 1:
+        raise NotFound(PageNumberPagination.invalid_page_message)
+    start = (page - 1) * page_size
+
+    async def fetch_rows():
+        return [row async for row in queryset[start:start + page_size].aiterator()]
+
+    # Comptage et page soumis ensemble : enchaînés sur le thread de la requête
+    # sans repasser par la boucle d'événements entre les deux
+    count, rows = await asyncio.gather(queryset.acount(), fetch_rows())
+    pages = max((count + page_size - 1) // page_size, 1)
+    if page > pages:
+        raise NotFound(PageNumberPagination.invalid_page_message)
+
+    url = request.build_absolute_uri()
+    envelope = {
+        'count': count,
+        'next': replace_query_param(url, 'page', page + 1) if page < pages else None,
+        'previous': None,
+    }
+    if page > 1:
+        envelope['previous'] = (
+            remove_query_param(url, 'page') if page == 2 else replace_query_param(url, 'page', page - 1)
+        )
+    return envelope, rows
+
+
+def filtered_watches(request):
+    """
+    Montres filtrées, triées et recherchées comme par le viewset :
+    ``(queryset, erreurs)``. Le queryset n'est pas évalué.
+    """
+    queryset = watches_with_counts()
+    if any(name in request.GET for name in WatchFilter.base_filters):
+        filterset = WatchFilter(request.GET, queryset=queryset, request=request)
+        if not filterset.is_valid():
+            return None, filterset.errors
+        queryset = filterset.qs
+    queryset = ordered(queryset, request, WatchViewSet)
+    return WatchSearchFilter().filter_queryset(Request(request), queryset, WatchViewSet), None
+
+
+def _close_connections():
+    # Connexions ouvertes par le thread de la vue (pas celle d'une transaction
+    # englobante, quand ce thread est celui de l'appelant)
+    for connection in connections.all(initialized_only=True):
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+def own_thread(view):
+    """Appels ``thread_sensitive`` de la vue sur un thread dédié, fermé avec elle"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        async with ThreadSensitiveContext():
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                await sync_to_async(_close_connections)()
+    return wrapper
+
+
+def conditional(view):
+    """ETag / Last-Modified sur la version du catalogue, comme ``ConditionalGetMixin``"""
+    async def wrapper(request, *args, **kwargs):
+        if not catalogue_cache_is_shared():
+            return await view(request, *args, **kwargs)
+        version, last_modified = await aget_catalogue_validators()
+        etag = catalogue_etag(request, MEDIA_TYPE, version=version)
+        response = not_modified_response(request, etag, last_modified)
+        if response is not None:
+            return response
+        response = await view(request, *args, **kwargs)
+        return add_validators(response, etag, last_modified) if response.status_code == 200 else response
+    return wrapper
+
+
+@require_safe
+@own_thread
+@conditional
+async def watch_list(request):
+    if any(param in request.GET for param in SYNC_ONLY_PARAMS):
+        return await sync_watch_list(request)
+
+    if any(param in request.GET for param in DATABASE_PARAMS):
+        queryset, errors = await sync_to_async(filtered_watches)(request)
+    else:
+        queryset, errors = filtered_watches(request)
+    if errors:
+        return json_response(translate_validation(errors).detail, status=400)
+
+    values = WatchListValues({'request': request})
+    try:
+        envelope, rows = await paginate(
+            request, values.values(queryset),
+            WatchPagination.page_size_query_param, WatchPagination.max_page_size,
+        )
+    except NotFound as exc:
+        return error_response(exc.detail, 404)
+    envelope['results'] = values.to_representation(rows)
+    return json_response(envelope)
+
+
+@require_safe
+@own_thread
+@conditional
+async def watch_detail(request, pk):
+    queryset = Watch.objects.select_related('brand').prefetch_related(
+        Prefetch('complications', queryset=complications_with_counts())
+    )
+    try:
+        watch = await queryset.aget(pk=pk)
+    except Watch.DoesNotExist:
+        return error_response('No %s matches the given query.' % Watch._meta.object_name, 404)
+    # Compteur lu par ``BrandSerializer`` (pas de COUNT synchrone à la sérialisation)
+    watch.brand.watch_count = await Watch.objects.filter(brand_id=watch.brand_id).acount()
+    serializer = WatchDetailSerializer(context={'request': request})
+    return json_response((await serializer.arepresent_many([watch]))[0])
+
+
+async def _model_list(request, queryset, view, serializer_class):
+    queryset = ordered(searched(queryset, request, view), request, view)
+    try:
+        envelope, rows = await paginate(request, queryset)
+    except NotFound as exc:
+        return error_response(exc.detail, 404)
+    envelope['results'] = serializer_class(rows, many=True, context={'request': request}).data
+    return json_response(envelope)
+
+
+@require_safe
+@own_thread
+@conditional
+async def brand_list(request):
+    return await _model_list(request, brands_with_counts(), BrandViewSet, BrandSerializer)
+
+
+@require_safe
+@own_thread
+@conditional
+async def complication_list(request):
+    return await _model_list(request, complications_with_counts(), ComplicationViewSet, ComplicationSerializer)
@@ -0,0 +1,121 @@
+"""
+Cache applicatif du catalogue.
+
+Les valeurs dérivées de tout le catalogue (graphiques, statistiques...) sont
+rangées sous une clé qui contient la *version du catalogue*. Cette version
+est incrémentée par les signaux de ``watches.signals`` à chaque écriture :
+les anciennes entrées ne sont plus jamais lues et expirent d'elles-mêmes.
+
+Le backend est celui de l'alias ``WATCHES_CACHE_ALIAS`` (``default`` par
+défaut). Avec plusieurs processus, il doit être partagé (fichier, Redis...)
+pour que tous voient la même version : avec un cache propre à chaque
+processus (``LocMemCache``), un worker ne voit pas les écritures reçues par
+les autres. Sauf ``WATCHES_SINGLE_PROCESS = True`` (serveur de
+développement), un tel cache est alors signalé par ``manage.py check``
+(``watches.W001``) et ``catalogue_cache_is_shared()`` est faux : pas d'ETag
+ni de 304, et ``cached_for_version`` recalcule à chaque appel plutôt que de
+servir une valeur périmée.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+VERSION_KEY = 'watches:catalogue-version'
+MODIFIED_KEY = 'watches:catalogue-modified'
+
+_MISSING = object()
+
+
+def get_cache_alias():
+    return getattr(settings, 'WATCHES_CACHE_ALIAS', 'default')
+
+
+def get_cache():
+    return caches[get_cache_alias()]
+
+
+def catalogue_cache_is_shared():
+    """Vrai si tous les processus voient la même version du catalogue"""
+    if getattr(settings, 'WATCHES_SINGLE_PROCESS', False):
+        return True
+    return not isinstance(get_cache(), (LocMemCache, DummyCache))
+
+
+def get_cache_timeout():
+    return getattr(settings, 'WATCHES_CACHE_TIMEOUT', 24 * 3600)
+
+
+def get_catalogue_version():
+    """Version courante du catalogue (créée à la volée si absente du cache)"""
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Partir de l'horodatage : une version perdue (redémarrage, éviction)
+        # ne retombe jamais sur une valeur déjà utilisée.
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        cache.set(MODIFIED_KEY, time.time(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def get_catalogue_last_modified():
+    """Date (timestamp) de la dernière écriture connue, au plus tard celle de la version courante"""
+    get_catalogue_version()
+    modified = get_cache().get(MODIFIED_KEY)
+    return time.time() if modified is None else modified
+
+
+async def aget_catalogue_version():
+    """``get_catalogue_version`` pour les vues asynchrones (API asynchrone du cache)"""
+    cache = get_cache()
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, time.time_ns(), timeout=None)
+        await cache.aset(MODIFIED_KEY, time.time(), timeout=None)
+        version = await cache.aget(VERSION_KEY)
+    return version
+
+
+async def aget_catalogue_last_modified():
+    await aget_catalogue_version()
+    modified = await get_cache().aget(MODIFIED_KEY)
+    return time.time() if modified is None else modified
+
+
+async def aget_catalogue_validators():
+    """Version et date de dernière écriture, en une seule lecture du cache si possible"""
+    values = await get_cache().aget_many([VERSION_KEY, MODIFIED_KEY])
+    if VERSION_KEY not in values:
+        return await aget_catalogue_version(), await aget_catalogue_last_modified()
+    return values[VERSION_KEY], values.get(MODIFIED_KEY, time.time())
+
+
+def bump_catalogue_version():
+    """Invalide toutes les valeurs mises en cache pour la version courante"""
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+    cache.set(MODIFIED_KEY, time.time(), timeout=None)
+
+
+def cached_for_version(name, build):
+    """
+    Renvoie ``build()`` mis en cache pour la version courante du catalogue.
+    ``None`` est une valeur valide (graphique sans données par exemple).
+    Sans cache partagé, ``build()`` est appelé à chaque fois.
+    """
+    if not catalogue_cache_is_shared():
+        return build()
+    cache = get_cache()
+    key = f'watches:{name}:{get_catalogue_version()}'
+    value = cache.get(key, _MISSING)
+    if value is _MISSING:
+        value = build()
+        cache.set(key, value, get_cache_timeout())
+    return value
@@ -0,0 +1,22 @@
+"""Vérifications de la configuration (``manage.py check``, démarrage du serveur)"""
+from django.core import checks
+
+from .cache import catalogue_cache_is_shared, get_cache, get_cache_alias
+
+
+@checks.register(checks.Tags.caches)
+def check_catalogue_cache(app_configs, **kwargs):
+    if catalogue_cache_is_shared():
+        return []
+    backend = type(get_cache())
+    return [checks.Warning(
+        f"Le cache '{get_cache_alias()}' ({backend.__module__}.{backend.__name__}) "
+        "est propre à chaque processus : les workers ne partagent pas la version du catalogue.",
+        hint=(
+            "Configurer un cache partagé (Redis, fichier...) pour WATCHES_CACHE_ALIAS, ou "
+            "WATCHES_SINGLE_PROCESS = True si un seul processus sert l'application. D'ici là, "
+            "l'API n'envoie ni ETag ni Last-Modified et les statistiques, facettes, bits des "
+            "complications et comparatifs sont recalculés à chaque requête."
+        ),
+        id='watches.W001',
+    )]
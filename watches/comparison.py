@@ -0,0 +1,182 @@
+"""
+Comparatif de montres (``/api/watches/compare/`` et export PDF).
+
+La matrice est calculée une fois côté serveur : une ligne par
+caractéristique, une colonne par montre, avec pour chaque ligne l'indication
+que les valeurs diffèrent et les colonnes qui ont la meilleure valeur (prix
+le plus bas, étanchéité la plus haute...). Les complications sont données
+en ensembles : communes à toutes les montres, puis, par montre, celles
+qu'elle est seule à avoir et celles qui lui manquent.
+
+Les montres sont lues en une requête (marque jointe, complications
+préchargées). La matrice est mise en cache par ensemble d'identifiants trié
+et ``updated_at`` de chaque montre : une montre modifiée change la clé, une
+écriture ailleurs dans le catalogue ne la change pas. Marques, complications
+et liens montre-complication n'ont pas d'horodatage ; les signaux de
+``watches.signals`` changent alors la *génération* des comparatifs
+(``invalidate_comparisons``). Une matrice sert tous les ordres de colonnes
+(``reorder``).
+"""
+import hashlib
+import time
+from collections import Counter
+
+from .cache import catalogue_cache_is_shared, get_cache, get_cache_timeout
+from .models import Watch
+
+
+GENERATION_KEY = 'watches:comparison-generation'
+
+# (champ, libellé, meilleure valeur : min, max ou None si affaire de goût)
+ROWS = [
+    ('brand', 'Marque', None),
+    ('country', 'Origine', None),
+    ('price', 'Prix', min),
+    ('movement_type', 'Mouvement', None),
+    ('case_material', 'Matériau', None),
+    ('case_diameter', 'Diamètre', None),
+    ('water_resistance', 'Étanchéité', max),
+    ('complication_count', 'Complications', max),
+    ('reference_number', 'Référence', None),
+]
+
+
+def _cell(watch, field):
+    """Valeur brute (JSON) et valeur affichée d'une caractéristique"""
+    if field == 'brand':
+        return watch.brand.name, watch.brand.name
+    if field == 'country':
+        return watch.brand.country, watch.brand.country
+    if field == 'price':
+        return str(watch.price), f"{watch.price} €"
+    if field == 'movement_type':
+        return watch.movement_type, watch.get_movement_type_display()
+    if field == 'case_material':
+        return watch.case_material, watch.get_case_material_display()
+    if field == 'case_diameter':
+        return watch.case_diameter, f"{watch.case_diameter} mm"
+    if field == 'water_resistance':
+        return watch.water_resistance, f"{watch.water_resistance} m"
+    if field == 'complication_count':
+        count = len(watch.complications.all())
+        return count, str(count)
+    return getattr(watch, field), str(getattr(watch, field))
+
+
+def _sort_key(watch, field):
+    return watch.price if field == 'price' else _cell(watch, field)[0]
+
+
+def build_matrix(watches):
+    """Matrice comparative de ``watches`` (marque et complications déjà chargées), dans leur ordre"""
+    rows = []
+    for field, label, best in ROWS:
+        cells = [_cell(watch, field) for watch in watches]
+        values = [value for value, _ in cells]
+        differs = len(set(values)) > 1
+        if best is not None and differs:
+            target = best(_sort_key(watch, field) for watch in watches)
+            best_columns = [_sort_key(watch, field) == target for watch in watches]
+        else:
+            best_columns = [False] * len(watches)
+        rows.append({
+            'field': field,
+            'label': label,
+            'values': values,
+            'display': [display for _, display in cells],
+            'differs': differs,
+            'best': best_columns,
+        })
+
+    sets = [{c.pk: c.name for c in watch.complications.all()} for watch in watches]
+    union = {pk: name for complications in sets for pk, name in complications.items()}
+    common = set(union).intersection(*sets) if sets else set()
+    owners = Counter(pk for complications in sets for pk in complications)
+
+    def named(pks):
+        return [{'id': pk, 'name': union[pk]} for pk in sorted(pks, key=lambda pk: (union[pk], pk))]
+
+    return {
+        'watches': [
+            {
+                'id': watch.pk,
+                'model_name': watch.model_name,
+                'brand_name': watch.brand.name,
+                'reference_number': watch.reference_number,
+            }
+            for watch in watches
+        ],
+        'rows': rows,
+        'complications': {
+            'common': named(common),
+            'only': [named(pk for pk in complications if owners[pk] == 1) for complications in sets],
+            'lacks': [named(set(union) - set(complications)) for complications in sets],
+        },
+    }
+
+
+def reorder(matrix, ids):
+    """La même matrice, colonnes dans l'ordre de ``ids`` (identifiants absents ignorés)"""
+    position = {watch['id']: index for index, watch in enumerate(matrix['watches'])}
+    order = [position[pk] for pk in ids if pk in position]
+    if order == list(range(len(matrix['watches']))):
+        return matrix
+
+    def pick(values):
+        return [values[index] for index in order]
+
+    return {
+        'watches': pick(matrix['watches']),
+        'rows': [
+            {**row, 'values': pick(row['values']), 'display': pick(row['display']), 'best': pick(row['best'])}
+            for row in matrix['rows']
+        ],
+        'complications': {
+            'common': matrix['complications']['common'],
+            'only': pick(matrix['complications']['only']),
+            'lacks': pick(matrix['complications']['lacks']),
+        },
+    }
+
+
+def get_generation():
+    cache = get_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def invalidate_comparisons():
+    """Écarte toutes les matrices en cache (marque, complication ou lien modifié)"""
+    cache = get_cache()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, time.time_ns(), timeout=None)
+
+
+def comparison_key(stamps):
+    """Clé de cache d'après les couples ``(id, updated_at)`` des montres comparées"""
+    digest = hashlib.md5(repr(sorted(stamps)).encode()).hexdigest()
+    return f'watches:comparison:{get_generation()}:{digest}'
+
+
+def get_comparison(watch_ids):
+    """
+    Matrice comparative des montres ``watch_ids`` (entiers), colonnes dans
+    cet ordre. Une requête si elle est en cache, deux de plus sinon.
+    """
+    watches = Watch.objects.filter(id__in=watch_ids).select_related('brand').prefetch_related('complications')
+    if not catalogue_cache_is_shared():
+        # Génération propre au processus : marques et complications pourraient être périmées
+        return reorder(build_matrix(list(watches.order_by('id'))), watch_ids)
+    stamps = list(Watch.objects.filter(id__in=watch_ids).values_list('id', 'updated_at'))
+    key = comparison_key(stamps)
+    cache = get_cache()
+    matrix = cache.get(key)
+    if matrix is None:
+        matrix = build_matrix(list(watches.order_by('id')))
+        cache.set(key, matrix, get_cache_timeout())
+    return reorder(matrix, watch_ids)
@@ -0,0 +1,83 @@
+"""
+Masque des complications de chaque montre (``Watch.complication_mask``).
+
+Chaque complication a un bit (``Complication.bit``) ; le masque d'une montre
+est le OU de ceux de ses complications. Les filtres
+``complications__all``, ``__any`` et ``__none`` (filters.py) deviennent une
+seule opération bit à bit sur la ligne de la montre, au lieu d'une jointure
+(et d'un ``DISTINCT``) par complication demandée.
+
+Le masque est tenu à jour par les signaux de ``watches.signals`` (liens
+ajoutés ou retirés, complication supprimée). Les écritures qui passent à
+côté des signaux (``bulk_create`` de la table de liaison, SQL brut) doivent
+le calculer elles-mêmes (``mask_of``) ou appeler ``refresh_masks``.
+
+Les mises à jour du masque passent par ``update()``, qui ne touche pas
+``updated_at`` (``auto_now``) : elles l'écrivent elles-mêmes, pour que les
+représentations en cache, les comparatifs et l'index de similarité voient
+la montre modifiée.
+"""
+from django.db.models import F, Q
+from django.db.models.lookups import Exact
+from django.utils import timezone
+
+from .cache import cached_for_version
+from .models import Complication, Watch
+
+
+def mask_of(bits):
+    """Masque des bits ``bits``"""
+    mask = 0
+    for bit in bits:
+        mask |= 1 << bit
+    return mask
+
+
+def complication_bits():
+    """``{id de complication: bit}``, en cache jusqu'à la prochaine écriture du catalogue"""
+    return cached_for_version('complication-bits', lambda: dict(Complication.objects.values_list('pk', 'bit')))
+
+
+def mask_for(complication_ids):
+    """Masque des complications ``complication_ids`` et identifiants inconnus"""
+    bits = complication_bits()
+    unknown = [pk for pk in complication_ids if bits.get(pk) is None]
+    return mask_of(bits[pk] for pk in complication_ids if bits.get(pk) is not None), unknown
+
+
+def refresh_masks(watch_ids):
+    """Recalcule le masque des montres ``watch_ids`` depuis la table de liaison"""
+    masks = dict.fromkeys(watch_ids, 0)
+    through = Watch.complications.through.objects.filter(watch_id__in=watch_ids)
+    for watch_id, bit in through.values_list('watch_id', 'complication__bit'):
+        masks[watch_id] |= 1 << bit
+    now = timezone.now()
+    for watch_id, mask in masks.items():
+        Watch.objects.filter(pk=watch_id).update(complication_mask=mask, updated_at=now)
+    return masks
+
+
+def set_bit(bit, watch_ids):
+    Watch.objects.filter(pk__in=watch_ids).update(
+        complication_mask=F('complication_mask').bitor(1 << bit), updated_at=timezone.now()
+    )
+
+
+def clear_bit(bit, watch_ids=None):
+    """Retire ``bit`` du masque des montres ``watch_ids`` (de toutes les montres par défaut)"""
+    watches = Watch.objects.filter(has_any(1 << bit))
+    if watch_ids is not None:
+        watches = watches.filter(pk__in=watch_ids)
+    watches.update(complication_mask=F('complication_mask').bitand(~(1 << bit)), updated_at=timezone.now())
+
+
+def has_all(mask):
+    return Exact(F('complication_mask').bitand(mask), mask)
+
+
+def has_any(mask):
+    return ~Q(Exact(F('complication_mask').bitand(mask), 0))
+
+
+def has_none(mask):
+    return Exact(F('complication_mask').bitand(mask), 0)
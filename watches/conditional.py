@@ -0,0 +1,74 @@
+"""
+Requêtes conditionnelles (ETag / Last-Modified) pour l'API du catalogue.
+
+Le validateur est dérivé de la version du catalogue (``watches.cache``),
+incrémentée à chaque écriture : le vérifier ne coûte aucune requête SQL.
+Tant que le catalogue n'a pas changé, une page déjà reçue par le client est
+servie en ``304 Not Modified``, sans requête ni sérialisation. Sans cache
+partagé entre les processus (``catalogue_cache_is_shared``), la version d'un
+worker ignore les écritures reçues par les autres : aucun validateur n'est
+alors envoyé. Les vues asynchrones lisent version et date par l'API
+asynchrone du cache et les passent en paramètre (``version``,
+``last_modified``).
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .cache import catalogue_cache_is_shared, get_catalogue_last_modified, get_catalogue_version
+
+
+def catalogue_etag(request, media_type='', version=None):
+    """
+    La réponse dépend de la version du catalogue, mais aussi de l'URL complète,
+    de l'hôte (URLs absolues des images) et du format négocié.
+    """
+    raw = '|'.join([
+        str(get_catalogue_version() if version is None else version),
+        request.get_full_path(),
+        request.get_host(),
+        media_type or '',
+    ])
+    return '"%s"' % hashlib.md5(raw.encode()).hexdigest()
+
+
+def not_modified_response(request, etag, last_modified=None):
+    """``304 Not Modified`` si le client a déjà cette version, sinon ``None``"""
+    if last_modified is None:
+        last_modified = get_catalogue_last_modified()
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    return None if response is None else add_validators(response, etag, last_modified)
+
+
+def add_validators(response, etag, last_modified=None):
+    if last_modified is None:
+        last_modified = get_catalogue_last_modified()
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(int(last_modified))
+    # Toujours revalider : le navigateur ne doit pas deviner une durée de fraîcheur
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+class ConditionalGetMixin:
+    """À combiner avec un ``ReadOnlyModelViewSet`` (actions list et retrieve)"""
+
+    def get_etag(self, request):
+        return catalogue_etag(request, getattr(request, 'accepted_media_type', ''))
+
+    def conditional_response(self, request, render, *args, **kwargs):
+        if not catalogue_cache_is_shared():
+            return render(request, *args, **kwargs)
+        etag = self.get_etag(request)
+        response = not_modified_response(request, etag)
+        if response is not None:
+            return response
+        response = render(request, *args, **kwargs)
+        return add_validators(response, etag) if response.status_code == 200 else response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().retrieve, *args, **kwargs)
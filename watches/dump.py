@@ -0,0 +1,120 @@
+"""
+Export complet de la base en flux (action d'administration et
+``manage.py dump_catalogue``).
+
+Les tables sont lues par paquets (``iterator(chunk_size=...)``, complications
+des montres préchargées paquet par paquet) et chaque objet est encodé dès
+qu'il est lu, au format des serializers Django (``model``, ``pk``,
+``fields``). La mémoire reste constante quelle que soit la taille de la base.
+
+Deux formats :
+
+* ``json`` : le document de l'ancien export,
+  ``{"brands": [...], "complications": [...], "watches": [...],
+  "sequences": [...]}`` indenté ;
+* ``ndjson`` : un objet par ligne, marques puis complications puis montres
+  puis compteurs (format ``jsonl`` de Django, rechargeable avec ``loaddata``).
+
+Les compteurs (``Sequence``) sont lus après les montres : une base
+rechargée reprend les numéros de série après ceux qu'elle contient.
+
+La sortie peut être compressée en gzip à la volée.
+"""
+import json
+import textwrap
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.serializers.python import Serializer
+from django.db.models import Prefetch
+
+from .models import Brand, Complication, Sequence, Watch
+
+
+# Objets lus par requête SQL
+DUMP_CHUNK_SIZE = 500
+
+# Taille des morceaux envoyés au client (avant compression)
+DUMP_BUFFER_SIZE = 64 * 1024
+
+FORMATS = ('json', 'ndjson')
+
+
+def dump_querysets():
+    """Tables exportées, dans l'ordre de rechargement"""
+    return [
+        ('brands', Brand.objects.all()),
+        ('complications', Complication.objects.all()),
+        ('watches', Watch.objects.prefetch_related(
+            Prefetch('complications', queryset=Complication.objects.only('pk'))
+        )),
+        ('sequences', Sequence.objects.all()),
+    ]
+
+
+def dump_filename(format, compress=False):
+    name = 'database_export.json' if format == 'json' else 'database_export.jsonl'
+    return name + '.gz' if compress else name
+
+
+def serialized_objects(queryset, chunk_size=DUMP_CHUNK_SIZE):
+    """Dictionnaires ``{"model", "pk", "fields"}`` de ``queryset``, paquet par paquet"""
+    serializer = Serializer()
+    batch = []
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        batch.append(obj)
+        if len(batch) == chunk_size:
+            yield from serializer.serialize(batch)
+            batch = []
+    if batch:
+        yield from serializer.serialize(batch)
+
+
+def _json_pieces():
+    # Même texte que ``json.dumps(document, indent=2)``, objet par objet
+    yield '{'
+    for index, (key, queryset) in enumerate(dump_querysets()):
+        yield f'{"," if index else ""}\n  {json.dumps(key)}: ['
+        empty = True
+        for obj in serialized_objects(queryset):
+            text = json.dumps(obj, cls=DjangoJSONEncoder, indent=2)
+            yield ('\n' if empty else ',\n') + textwrap.indent(text, '    ')
+            empty = False
+        yield ']' if empty else '\n  ]'
+    yield '\n}'
+
+
+def _ndjson_pieces():
+    for _, queryset in dump_querysets():
+        for obj in serialized_objects(queryset):
+            yield json.dumps(obj, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def _buffered(pieces, size=DUMP_BUFFER_SIZE):
+    buffer, length = [], 0
+    for piece in pieces:
+        data = piece.encode()
+        buffer.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def dump_database(format='json', compress=False):
+    """Octets de l'export, en flux (``format`` parmi ``FORMATS``)"""
+    if format not in FORMATS:
+        raise ValueError(f"Format d'export inconnu : {format}")
+    chunks = _buffered(_json_pieces() if format == 'json' else _ndjson_pieces())
+    return _gzipped(chunks) if compress else chunks
@@ -0,0 +1,161 @@
+"""
+File d'attente des exports PDF.
+
+Un export volumineux rendu dans la requête HTTP occupe un worker web pendant
+toute sa durée et peut dépasser le délai du proxy. Au-delà de
+``WATCHES_EXPORT_QUEUE_THRESHOLD`` montres, les endpoints d'export
+enregistrent un ``ExportJob`` et répondent immédiatement ``202`` avec son
+identifiant. Un pool de threads local (``WATCHES_EXPORT_WORKERS``) rend
+ensuite le PDF dans ``MEDIA_ROOT/exports/`` ; l'état est suivi par la table
+des jobs, sans broker externe. ``manage.py process_exports`` reprend les
+jobs restés en attente (redémarrage du serveur par exemple), remet en
+attente ceux restés ``RUNNING`` plus de ``WATCHES_EXPORT_STALE_AFTER``
+secondes (worker tué pendant le rendu) et supprime les jobs terminés depuis
+plus de ``WATCHES_EXPORT_RETENTION`` secondes, avec leur fichier.
+
+Les types ``ADMIN_KINDS`` (catalogue d'administration, certificat) sont
+réservés aux membres du staff sur ``/api/exports/``.
+
+Avec ``WATCHES_EXPORT_WORKERS = 0``, les jobs sont rendus dans le thread qui
+les soumet (tests, scripts).
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from tempfile import SpooledTemporaryFile
+from threading import Lock
+
+from django.conf import settings
+from django.core.files.base import File
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import ExportJob
+
+
+logger = logging.getLogger(__name__)
+
+# Fonction ``write(output, watch_ids)`` de chaque type d'export
+WRITERS = {
+    'catalogue': 'watches.pdf.write_catalogue_pdf',
+    'wishlist': 'watches.pdf.write_wishlist_pdf',
+    'comparison': 'watches.pdf.write_comparison_pdf',
+    'admin_catalogue': 'watches.pdf.write_admin_catalogue_pdf',
+    'certificate': 'watches.pdf.write_certificate_pdf',
+}
+
+# Nom du fichier téléchargé, par type d'export
+FILENAMES = {
+    'catalogue': 'catalogue_garde_temps.pdf',
+    'wishlist': 'ma_selection.pdf',
+    'comparison': 'comparatif.pdf',
+    'admin_catalogue': 'catalogue_montres.pdf',
+    'certificate': 'certificat.pdf',
+}
+
+# Soumis depuis l'administration seulement
+ADMIN_KINDS = {'admin_catalogue', 'certificate'}
+
+_executor = None
+_executor_lock = Lock()
+
+
+def get_export_queue_threshold():
+    return getattr(settings, 'WATCHES_EXPORT_QUEUE_THRESHOLD', 200)
+
+
+def get_export_workers():
+    return getattr(settings, 'WATCHES_EXPORT_WORKERS', 2)
+
+
+def get_export_stale_after():
+    return getattr(settings, 'WATCHES_EXPORT_STALE_AFTER', 3600)
+
+
+def get_export_retention():
+    return getattr(settings, 'WATCHES_EXPORT_RETENTION', 24 * 3600)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=get_export_workers(), thread_name_prefix='export')
+        return _executor
+
+
+def submit_export(kind, watch_ids, filename=None):
+    """Enregistre un job et le confie au pool dès la fin de la transaction"""
+    job = ExportJob.objects.create(
+        kind=kind, watch_ids=list(watch_ids), filename=filename or FILENAMES[kind]
+    )
+    if get_export_workers() > 0:
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, job.pk))
+    else:
+        transaction.on_commit(lambda: run_export(job.pk))
+    return job
+
+
+def _run_in_thread(job_id):
+    try:
+        run_export(job_id)
+    finally:
+        # Connexion propre au thread du pool
+        close_old_connections()
+
+
+def run_export(job_id):
+    """
+    Rend le PDF d'un job en attente. Renvoie ``False`` si un autre worker l'a
+    déjà pris.
+    """
+    claimed = ExportJob.objects.filter(pk=job_id, status='PENDING').update(
+        status='RUNNING', started_at=timezone.now()
+    )
+    if not claimed:
+        return False
+
+    job = ExportJob.objects.get(pk=job_id)
+    try:
+        write = import_string(WRITERS[job.kind])
+        with SpooledTemporaryFile(max_size=8 * 1024 * 1024) as output:
+            write(output, job.watch_ids)
+            output.seek(0)
+            job.file.save(f'{job.pk}.pdf', File(output), save=False)
+        job.status = 'DONE'
+    except Exception as exc:
+        logger.exception("Échec de l'export %s", job.pk)
+        job.status = 'FAILED'
+        job.error = str(exc) or exc.__class__.__name__
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'file', 'error', 'finished_at'])
+    return True
+
+
+def process_pending_exports():
+    """Rend les jobs en attente dans le thread courant, du plus ancien au plus récent"""
+    done = 0
+    for job_id in ExportJob.objects.filter(status='PENDING').order_by('created_at').values_list('pk', flat=True):
+        done += run_export(job_id)
+    return done
+
+
+def reap_stale_exports():
+    """Remet en attente les jobs ``RUNNING`` depuis trop longtemps (worker interrompu)"""
+    limit = timezone.now() - timedelta(seconds=get_export_stale_after())
+    return ExportJob.objects.filter(status='RUNNING', started_at__lt=limit).update(
+        status='PENDING', started_at=None
+    )
+
+
+def purge_expired_exports():
+    """Supprime les jobs terminés (et leur fichier) au-delà de la durée de conservation"""
+    limit = timezone.now() - timedelta(seconds=get_export_retention())
+    purged = 0
+    for job in ExportJob.objects.filter(status__in=['DONE', 'FAILED'], finished_at__lt=limit):
+        if job.file:
+            job.file.delete(save=False)
+        job.delete()
+        purged += 1
+    return purged
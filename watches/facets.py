@@ -0,0 +1,124 @@
+"""
+Compteurs des filtres du catalogue (``/api/watches/facets/``).
+
+Pour chaque filtre (*facette*), nombre de montres par valeur possible, avec
+tous les autres filtres et la recherche appliqués, mais pas le sien (facettes
+disjonctives) : une fois « Automatique » choisi, les autres mouvements
+gardent le nombre de montres qu'ils donneraient à la place.
+
+Une requête ``GROUP BY`` par facette de choix (marques et complications à
+zéro comprises) ; les facettes d'intervalles (prix, diamètre, étanchéité) qui
+partagent le même jeu de filtres sont comptées ensemble, avec le total, en
+une requête d'agrégats conditionnels. Le résultat est
+mis en cache par jeu de filtres normalisé (ordre et valeurs vides sans
+effet), jusqu'à la prochaine écriture du catalogue.
+"""
+import hashlib
+
+from django.db.models import Count, Q
+
+from .cache import cached_for_version
+from .models import Brand, Complication, Watch
+
+
+# Paramètres de filtre propres à chaque facette (ignorés pour la compter)
+FACET_PARAMS = {
+    'movement_type': ['movement_type'],
+    'case_material': ['case_material'],
+    'brand': ['brand'],
+    'complications': ['complications', 'complications__all', 'complications__any', 'complications__none'],
+    'price': ['price', 'price__lte', 'price__gte'],
+    'case_diameter': ['case_diameter', 'case_diameter__lte', 'case_diameter__gte'],
+    'water_resistance': ['water_resistance', 'water_resistance__lte', 'water_resistance__gte'],
+}
+
+# Bornes des intervalles [min, max[ ; le dernier est ouvert
+RANGE_BUCKETS = {
+    'price': [0, 5000, 10000, 20000, 50000, 100000],
+    'case_diameter': [0, 38, 40, 42, 44],
+    'water_resistance': [0, 50, 100, 200, 300],
+}
+
+
+def normalized_params(query_params, names):
+    """Paramètres ``names`` non vides, triés : même clé pour un même jeu de filtres"""
+    params = []
+    for name in sorted(names):
+        values = sorted({value for value in query_params.getlist(name) if value != ''})
+        if values:
+            params.append((name, values))
+    return params
+
+
+def params_key(params):
+    return hashlib.md5(repr(params).encode()).hexdigest()
+
+
+def _choices(counts, choices):
+    return [{'value': code, 'label': str(label), 'count': counts.get(code, 0)} for code, label in choices]
+
+
+def _grouped_counts(queryset, field):
+    rows = queryset.order_by().values_list(field).annotate(count=Count('id'))
+    return {value: count for value, count in rows if value is not None}
+
+
+def _buckets(edges):
+    return list(zip(edges, edges[1:] + [None]))
+
+
+def _range_aggregates(field):
+    return {
+        f'{field}__{index}': Count('id', filter=Q(**{f'{field}__gte': low}) & (
+            Q(**{f'{field}__lt': high}) if high is not None else Q()
+        ))
+        for index, (low, high) in enumerate(_buckets(RANGE_BUCKETS[field]))
+    }
+
+
+def compute_facets(filtered, params):
+    """
+    ``filtered(params)`` renvoie les montres filtrées par ``params`` (liste de
+    couples nom / valeurs, voir ``normalized_params``).
+    """
+    def without(facet):
+        own = FACET_PARAMS[facet]
+        return [(name, values) for name, values in params if name not in own]
+
+    result = {}
+    for facet, choices in [('movement_type', Watch.MOVEMENT_CHOICES), ('case_material', Watch.MATERIAL_CHOICES)]:
+        result[facet] = _choices(_grouped_counts(filtered(without(facet)), facet), choices)
+    for facet, model in [('brand', Brand), ('complications', Complication)]:
+        # Toutes les valeurs, y compris celles à zéro, en une requête (jointure externe)
+        ids = filtered(without(facet)).order_by().values('id')
+        rows = model.objects.order_by('name').annotate(
+            count=Count('watches', filter=Q(watches__in=ids))
+        ).values_list('id', 'name', 'count')
+        result[facet] = [{'value': pk, 'label': name, 'count': count} for pk, name, count in rows]
+
+    # Facettes d'intervalles regroupées par jeu de filtres effectif ; le total
+    # est compté avec le groupe qui applique tous les filtres, s'il existe
+    groups = {}
+    for facet in RANGE_BUCKETS:
+        groups.setdefault(repr(without(facet)), (without(facet), []))[1].append(facet)
+    total = None
+    for facet_params, facets in groups.values():
+        aggregates = {}
+        for facet in facets:
+            aggregates.update(_range_aggregates(facet))
+        if facet_params == params:
+            aggregates['total'] = Count('id')
+        counts = filtered(facet_params).order_by().aggregate(**aggregates)
+        total = counts.get('total', total)
+        for facet in facets:
+            result[facet] = [
+                {'min': low, 'max': high, 'count': counts[f'{facet}__{index}']}
+                for index, (low, high) in enumerate(_buckets(RANGE_BUCKETS[facet]))
+            ]
+    result['total'] = filtered(params).count() if total is None else total
+    return result
+
+
+def get_facets(params, make_filtered):
+    """Facettes en cache ; ``make_filtered()`` (validation des filtres) n'est appelé qu'en cas d'absence"""
+    return cached_for_version(f'facets:{params_key(params)}', lambda: compute_facets(make_filtered(), params))
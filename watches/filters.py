@@ -0,0 +1,52 @@
+"""
+Filtres de ``/api/watches/``.
+
+En plus des filtres de champ (``WatchViewSet.filterset_fields``),
+``complications__all``, ``complications__any`` et ``complications__none``
+prennent une liste d'identifiants (``?complications__all=1,4,7``) : montres
+qui ont toutes ces complications, au moins l'une, ou aucune. Chacun est un
+seul prédicat bit à bit sur ``Watch.complication_mask``
+(complication_masks.py), sans jointure ni ``DISTINCT``.
+"""
+from django_filters import rest_framework as filters
+
+from .complication_masks import has_all, has_any, has_none, mask_for
+from .models import Watch
+
+
+class ComplicationMaskFilter(filters.BaseInFilter, filters.NumberFilter):
+    predicates = {'all': has_all, 'any': has_any, 'none': has_none}
+
+    def __init__(self, *args, match, **kwargs):
+        self.match = match
+        super().__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        if not value:
+            return qs
+        mask, unknown = mask_for([int(pk) for pk in value])
+        if unknown and self.match == 'all':
+            # Complication inexistante : aucune montre ne les a toutes
+            return qs.none()
+        if not mask:
+            return qs.none() if self.match == 'any' else qs
+        return qs.filter(self.predicates[self.match](mask))
+
+
+class WatchFilter(filters.FilterSet):
+    complications__all = ComplicationMaskFilter(match='all', label="Toutes ces complications")
+    complications__any = ComplicationMaskFilter(match='any', label="Au moins une de ces complications")
+    complications__none = ComplicationMaskFilter(match='none', label="Aucune de ces complications")
+
+    class Meta:
+        model = Watch
+        fields = {
+            'movement_type': ['exact'],
+            'case_material': ['exact'],
+            'brand': ['exact'],
+            'brand__country': ['exact', 'icontains'],
+            'complications': ['exact'],
+            'case_diameter': ['exact', 'lte', 'gte'],
+            'price': ['exact', 'lte', 'gte'],
+            'water_resistance': ['exact', 'lte', 'gte'],
+        }
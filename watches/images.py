@@ -0,0 +1,120 @@
+"""
+Déclinaisons des images du catalogue (``Watch.image``, ``Brand.logo``).
+
+Chaque original est décliné en largeurs fixes (``DERIVATIVE_WIDTHS``), en
+WebP et en JPEG, sous ``derivatives/<nom de l'original>.<largeur>w.<ext>``
+dans le même stockage : ``watches/a.png`` donne par exemple
+``derivatives/watches/a.png.640w.webp``. Le nom d'une déclinaison se déduit
+de celui de l'original, sans requête ni accès disque : les serializers
+exposent ``thumbnail_url`` et ``srcset`` directement.
+
+Les déclinaisons sont générées à l'enregistrement (signaux), par
+``manage.py generate_derivatives`` pour les images existantes, et à défaut
+à la première demande par ``image_derivative`` (vue montée sur
+``MEDIA_URL/derivatives/``, à placer derrière le serveur de fichiers :
+``try_files`` puis Django). Une image n'est jamais agrandie.
+"""
+import re
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404
+from PIL import Image, ImageOps
+
+
+DERIVATIVES_DIR = 'derivatives'
+DERIVATIVE_WIDTHS = (320, 640, 1280)
+
+# Extension -> (format Pillow, options d'enregistrement, type MIME)
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}, 'image/webp'),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}, 'image/jpeg'),
+}
+
+# Déclinaison servie dans la grille du catalogue
+THUMBNAIL = (640, 'webp')
+
+# Dossiers d'upload dont les images sont déclinées
+SOURCE_DIRS = ('watches/', 'brands/')
+
+DERIVATIVE_NAME = re.compile(
+    rf'^{DERIVATIVES_DIR}/(?P<name>.+)\.(?P<width>\d+)w\.(?P<ext>{"|".join(DERIVATIVE_FORMATS)})$'
+)
+
+
+def derivative_name(name, width, ext):
+    return f'{DERIVATIVES_DIR}/{name}.{width}w.{ext}'
+
+
+def thumbnail_url(name, url):
+    """URL de la vignette de l'original ``name`` (``url`` : ``storage.url``)"""
+    return url(derivative_name(name, *THUMBNAIL)) if name else None
+
+
+def srcsets(name, url):
+    """Attributs ``srcset`` de l'original ``name``, par format"""
+    if not name:
+        return None
+    return {
+        ext: ', '.join(f'{url(derivative_name(name, width, ext))} {width}w' for width in DERIVATIVE_WIDTHS)
+        for ext in DERIVATIVE_FORMATS
+    }
+
+
+def _encode(image, width, ext):
+    image_format, options, _ = DERIVATIVE_FORMATS[ext]
+    if image.width > width:
+        image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        background = Image.new('RGB', image.size, 'white')
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    output = BytesIO()
+    image.save(output, image_format, **options)
+    return output.getvalue()
+
+
+def generate_derivatives(name, storage=default_storage, force=False):
+    """
+    Crée les déclinaisons manquantes de l'original ``name`` (toutes si
+    ``force``). Renvoie le nombre de fichiers écrits.
+    """
+    missing = [
+        (width, ext) for width in DERIVATIVE_WIDTHS for ext in DERIVATIVE_FORMATS
+        if force or not storage.exists(derivative_name(name, width, ext))
+    ]
+    if not missing:
+        return 0
+    with storage.open(name, 'rb') as f:
+        image = ImageOps.exif_transpose(Image.open(f))
+        image.load()
+    for width, ext in missing:
+        target = derivative_name(name, width, ext)
+        if storage.exists(target):
+            storage.delete(target)
+        storage.save(target, ContentFile(_encode(image, width, ext)))
+    return len(missing)
+
+
+def image_derivative(request, path):
+    """Déclinaison demandée avant d'avoir été générée : générée puis servie"""
+    match = DERIVATIVE_NAME.match(f'{DERIVATIVES_DIR}/{path}')
+    if (
+        match is None
+        or int(match['width']) not in DERIVATIVE_WIDTHS
+        or not match['name'].startswith(SOURCE_DIRS)
+        or '..' in match['name'].split('/')
+        or not default_storage.exists(match['name'])
+    ):
+        raise Http404
+    name = f'{DERIVATIVES_DIR}/{path}'
+    if not default_storage.exists(name):
+        try:
+            generate_derivatives(match['name'])
+        except (OSError, Image.DecompressionBombError):
+            raise Http404
+    return FileResponse(default_storage.open(name, 'rb'), content_type=DERIVATIVE_FORMATS[match['ext']][2])
@@ -0,0 +1,324 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+from multiprocessing import get_context
+from watches.models import Watch
+from watches.pagination import WatchPagination
+from io import BytesIO
+from watches import pdf
+from watches.pdf_stream import stream_pdf, stream_pdf_parallel
+from watches.representations import get_representation_cache
+from watches.similar import SimilarityIndex
+import asyncio
+import django
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+
+# Démarrage d'un worker : chargement des URLs (admin, vues), puis des bibliothèques de rendu si demandé
+STARTUP_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+from watches import rendering
+get_resolver().url_patterns
+if sys.argv[1] == 'rendu':
+    rendering.pyplot()
+    rendering.pdf()
+elapsed = time.perf_counter() - start
+rss = next(int(line.split()[1]) for line in open('/proc/self/status') if line.startswith('VmRSS:'))
+print(elapsed, rss, ','.join(name for name in rendering.HEAVY_MODULES if name in sys.modules) or '-')
+'''
+
+# Objets page d'un PDF (hors nœud /Pages)
+PAGE_OBJECT = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+
+# Cache des représentations désactivé (mesure du serializer seul)
+NO_REPRESENTATION_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'},
+    'representations': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
+
+
+class Command(BaseCommand):
+    help = 'Mesure les performances des chemins critiques sur la base courante'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'target',
+            choices=['list', 'async', 'pdf', 'pages', 'startup', 'similar'],
+            help=(
+                'list: requêtes/s de /api/watches/ selon le mode de sérialisation ; '
+                'async: latence des lectures sync/async pendant des exports PDF ; '
+                'pdf: durée du catalogue PDF selon le nombre de processus de dessin ; '
+                'pages: millisecondes par page de chaque document PDF ; '
+                'startup: durée de démarrage et mémoire résidente d\'un worker ; '
+                'similar: construction et latence de l\'index des montres similaires'
+            )
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=3.0,
+            help='Durée de chaque mesure en secondes (défaut: 3)'
+        )
+        parser.add_argument(
+            '--sizes',
+            default='12,100,1000',
+            help='Tailles de page mesurées, séparées par des virgules (défaut: 12,100,1000)'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='async: nombre de clients lents et de clients rapides simultanés (défaut: 8)'
+        )
+        parser.add_argument(
+            '--count',
+            type=int,
+            default=5000,
+            help='pdf: nombre de fiches du catalogue (défaut: 5000)'
+        )
+        parser.add_argument(
+            '--workers',
+            default='1,2,4,8',
+            help='pdf: nombres de processus mesurés, séparés par des virgules (défaut: 1,2,4,8)'
+        )
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=500000,
+            help='similar: nombre de montres de l\'index synthétique (défaut: 500000)'
+        )
+
+    def handle(self, *args, **options):
+        self.duration = options['duration']
+        # Pas de journal SQL (DEBUG) pendant les mesures
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=['*']):
+            getattr(self, f'bench_{options["target"]}')(options)
+
+    def measure(self, call):
+        """Nombre d'appels par seconde de ``call`` (après un appel d'échauffement)"""
+        call()
+        calls = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < self.duration:
+            call()
+            calls += 1
+        return calls / (time.perf_counter() - start)
+
+    def bench_list(self, options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--sizes doit être une liste d\'entiers')
+        total = Watch.objects.count()
+        if total < max(sizes):
+            self.stdout.write(self.style.WARNING(
+                f'Seulement {total} montres en base (generate_watches pour en créer)'
+            ))
+
+        client = Client()
+
+        def get(url):
+            def call():
+                response = client.get(url)
+                if response.status_code != 200:
+                    raise CommandError(f'{url} : HTTP {response.status_code}')
+            return call
+
+        self.stdout.write(f'{"page_size":>9} {"serializer":>12} {"+ fragments":>12} {"fast=1":>12}  (req/s)')
+        # Pages plus grandes que la limite de l'API, le temps de la mesure seulement
+        with mock.patch.object(WatchPagination, 'max_page_size', max(sizes)):
+            for size in sizes:
+                url = f'/api/watches/?page_size={size}'
+                with override_settings(CACHES=NO_REPRESENTATION_CACHE):
+                    serializer = self.measure(get(url))
+                get_representation_cache().clear()
+                fragments = self.measure(get(url))
+                fast = self.measure(get(url + '&fast=1'))
+                self.stdout.write(f'{size:>9} {serializer:>12.1f} {fragments:>12.1f} {fast:>12.1f}')
+
+    def bench_async(self, options):
+        """
+        Sous ASGI (``AsyncClient``), des clients lents enchaînent des exports
+        PDF pendant que des clients rapides lisent la première page du
+        catalogue, par le viewset synchrone puis par la vue asynchrone.
+        """
+        ids = list(Watch.objects.values_list('id', flat=True)[:100])
+        if not ids:
+            raise CommandError('Catalogue vide (generate_watches pour en créer)')
+        concurrency = options['concurrency']
+        slow_calls = [0]
+
+        async def slow(client, stop):
+            while not stop.is_set():
+                await client.post(
+                    '/api/watches/export-wishlist/', {'watch_ids': ids}, content_type='application/json'
+                )
+                slow_calls[0] += 1
+
+        async def fast(client, url, stop, latencies):
+            while not stop.is_set():
+                start = time.perf_counter()
+                response = await client.get(url)
+                if response.status_code != 200:
+                    raise CommandError(f'{url} : HTTP {response.status_code}')
+                latencies.append(time.perf_counter() - start)
+
+        async def run(url):
+            stop, latencies = asyncio.Event(), []
+            tasks = [asyncio.create_task(slow(AsyncClient(), stop)) for _ in range(concurrency)]
+            tasks += [asyncio.create_task(fast(AsyncClient(), url, stop, latencies)) for _ in range(concurrency)]
+            await asyncio.sleep(self.duration)
+            stop.set()
+            await asyncio.gather(*tasks)
+            return latencies
+
+        self.stdout.write(
+            f'{concurrency} clients lents (export-wishlist) + {concurrency} clients rapides, '
+            f'{self.duration:g} s par mesure'
+        )
+        self.stdout.write(f'{"endpoint":<22} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"exports":>8}')
+        for label, url in [('sync /api/', '/api/watches/'), ('async /api/async/', '/api/async/watches/')]:
+            slow_calls[0] = 0
+            latencies = asyncio.run(run(url))
+            if not latencies:
+                self.stdout.write(f'{label:<22} aucune réponse')
+                continue
+            latencies.sort()
+            p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+            self.stdout.write(
+                f'{label:<22} {len(latencies) / self.duration:>8.1f} '
+                f'{statistics.median(latencies) * 1000:>8.1f} {p95 * 1000:>8.1f} {slow_calls[0]:>8}'
+            )
+
+    def bench_pdf(self, options):
+        """Catalogue « une fiche par montre » rendu en flux, séquentiel puis parallèle"""
+        try:
+            worker_counts = [int(n) for n in options['workers'].split(',')]
+        except ValueError:
+            raise CommandError('--workers doit être une liste d\'entiers')
+        watches = list(Watch.objects.select_related('brand')[:options['count']])
+        if not watches:
+            raise CommandError('Catalogue vide (generate_watches pour en créer)')
+        self.stdout.write(f'{len(watches)} fiches, {os.cpu_count()} cœur(s) disponibles')
+        self.stdout.write(f'{"processus":>9} {"durée s":>9} {"pages/s":>9} {"accélération":>13}')
+
+        reference = None
+        for workers in worker_counts:
+            if workers <= 1:
+                pages = stream_pdf(watches, pdf.FICHE.draw_page, forms=pdf.FICHE.forms)
+                elapsed = self.render_time(pages)
+            else:
+                with ProcessPoolExecutor(
+                    workers, mp_context=get_context('spawn'), initializer=django.setup
+                ) as pool:
+                    # Démarrage des processus hors mesure
+                    list(pool.map(abs, range(workers * 4)))
+                    elapsed = self.render_time(stream_pdf_parallel(
+                        watches, pdf.FICHE.draw_page, forms=pdf.FICHE.forms, workers=workers, pool=pool
+                    ))
+            reference = reference or elapsed
+            self.stdout.write(
+                f'{workers:>9} {elapsed:>9.2f} {len(watches) / elapsed:>9.0f} {reference / elapsed:>12.2f}x'
+            )
+
+    def render_time(self, chunks):
+        start = time.perf_counter()
+        for _ in chunks:
+            pass
+        return time.perf_counter() - start
+
+    def bench_pages(self, options):
+        """Millisecondes par page des cinq documents de ``watches.pdf`` (données chargées comprises)"""
+        ids = list(Watch.objects.values_list('id', flat=True)[:min(options['count'], 500)])
+        if not ids:
+            raise CommandError('Catalogue vide (generate_watches pour en créer)')
+        documents = [
+            ('catalogue', lambda out: pdf.write_catalogue_pdf(out, ids)),
+            ('catalogue admin', lambda out: pdf.write_admin_catalogue_pdf(out, ids)),
+            ('wishlist', lambda out: pdf.write_wishlist_pdf(out, ids)),
+            ('comparatif (4)', lambda out: pdf.write_comparison_pdf(out, ids[:4])),
+            ('certificat', lambda out: pdf.write_certificate_pdf(out, ids[:1])),
+        ]
+        self.stdout.write(f'{len(ids)} montres')
+        self.stdout.write(f'{"document":<18} {"pages":>6} {"ms/page":>9} {"octets/page":>12}')
+        for label, write in documents:
+            with override_settings(WATCHES_PDF_WORKERS=1):
+                output = BytesIO()
+                write(output)  # échauffement (polices, imports)
+                runs, start = 0, time.perf_counter()
+                while runs == 0 or time.perf_counter() - start < self.duration:
+                    output = BytesIO()
+                    write(output)
+                    runs += 1
+                elapsed = (time.perf_counter() - start) / runs
+            pages = len(PAGE_OBJECT.findall(output.getvalue()))
+            self.stdout.write(
+                f'{label:<18} {pages:>6} {elapsed * 1000 / pages:>9.3f} {len(output.getvalue()) // pages:>12}'
+            )
+
+    def bench_startup(self, options):
+        """
+        Processus neufs : ``django.setup()`` et chargement des URLs, comme un
+        worker au démarrage, avec ou sans les bibliothèques de rendu.
+        """
+        runs = 5
+        self.stdout.write(f'Médiane sur {runs} démarrages')
+        self.stdout.write(f'{"worker":<10} {"démarrage ms":>13} {"RSS Mo":>8}  modules lourds chargés')
+        for label in ['api', 'rendu']:
+            results = []
+            for _ in range(runs):
+                output = subprocess.run(
+                    [sys.executable, '-c', STARTUP_SCRIPT, label],
+                    capture_output=True, text=True, check=True, cwd=settings.BASE_DIR,
+                ).stdout.split()
+                results.append((float(output[0]), int(output[1]), output[2]))
+            self.stdout.write(
+                f'{label:<10} {statistics.median(r[0] for r in results) * 1000:>13.0f} '
+                f'{statistics.median(r[1] for r in results) / 1024:>8.1f}  {results[0][2]}'
+            )
+
+    def bench_similar(self, options):
+        """
+        Index synthétique de ``--rows`` montres (valeurs tirées au hasard, sans
+        base) : durée de construction, puis latence de ``nearest`` sur des
+        montres prises au hasard.
+        """
+        rng = random.Random(0)
+        movements = [code for code, _ in Watch.MOVEMENT_CHOICES]
+        materials = [code for code, _ in Watch.MATERIAL_CHOICES]
+        rows = [
+            (
+                pk, rng.randint(2000, 150000), rng.randint(34, 46), rng.choice([30, 50, 100, 200, 300, 1000]),
+                rng.choice(movements), rng.choice(materials), rng.randint(1, 60),
+                rng.sample(range(40), rng.choice([0, 0, 1, 1, 1, 2, 2, 3, 4])),
+            )
+            for pk in range(1, options['rows'] + 1)
+        ]
+        start = time.perf_counter()
+        index = SimilarityIndex(rows)
+        self.stdout.write(f'{len(rows)} montres, construction {time.perf_counter() - start:.2f} s')
+
+        latencies = []
+        start = time.perf_counter()
+        while len(latencies) < 20 or time.perf_counter() - start < self.duration:
+            pk = rng.randint(1, len(rows))
+            call_start = time.perf_counter()
+            index.nearest(pk, 6)
+            latencies.append(time.perf_counter() - call_start)
+        quantiles = statistics.quantiles(latencies, n=20)
+        self.stdout.write(
+            f'nearest(k=6) : p50 {statistics.median(latencies) * 1000:.2f} ms, '
+            f'p95 {quantiles[18] * 1000:.2f} ms ({len(latencies)} requêtes)'
+        )
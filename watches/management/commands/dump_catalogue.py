@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from watches.dump import FORMATS, dump_database
+import os
+
+
+class Command(BaseCommand):
+    help = 'Exporte toute la base en flux (sauvegardes planifiées) ; mémoire constante'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            default='ndjson',
+            help='ndjson: un objet par ligne, rechargeable avec loaddata ; json: document de l\'export admin (défaut: ndjson)'
+        )
+        parser.add_argument(
+            '--gzip',
+            action='store_true',
+            help='Compresse la sortie en gzip'
+        )
+        parser.add_argument(
+            '-o', '--output',
+            default='-',
+            help='Fichier de destination, écrit atomiquement (défaut: sortie standard)'
+        )
+
+    def handle(self, *args, **options):
+        chunks = dump_database(options['format'], options['gzip'])
+        output = options['output']
+        if output == '-':
+            stream = getattr(self.stdout._out, 'buffer', None)
+            if stream is None:
+                raise CommandError('Sortie standard non binaire : utiliser --output')
+            for chunk in chunks:
+                stream.write(chunk)
+            stream.flush()
+            return
+
+        # Fichier temporaire puis renommage : une sauvegarde interrompue n'écrase pas la précédente
+        temporary = f'{output}.tmp'
+        try:
+            with open(temporary, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(temporary, output)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            raise
+        self.stderr.write(self.style.SUCCESS(f'✓ Export écrit dans {output} ({os.path.getsize(output)} octets)'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from watches.images import generate_derivatives
+from watches.models import Brand, Watch
+
+
+class Command(BaseCommand):
+    help = 'Génère les déclinaisons (largeurs fixes, WebP et JPEG) des photos et logos existants'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Régénère aussi les déclinaisons existantes (après un changement de réglages)'
+        )
+
+    def handle(self, *args, **options):
+        created = failed = 0
+        for model, field in [(Watch, 'image'), (Brand, 'logo')]:
+            storage = model._meta.get_field(field).storage
+            names = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+            for name in names.values_list(field, flat=True).distinct().iterator():
+                try:
+                    created += generate_derivatives(name, storage, force=options['force'])
+                except OSError as exc:
+                    failed += 1
+                    self.stderr.write(self.style.WARNING(f'{name} : {exc}'))
+
+        self.stdout.write(self.style.SUCCESS(f'✓ {created} déclinaison(s) générée(s)'))
+        if failed:
+            self.stdout.write(self.style.WARNING(f'{failed} image(s) illisible(s)'))
@@ -1,9 +1,172 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from faker import Faker
+from multiprocessing import Pool
+from watches.cache import bump_catalogue_version
+from watches.complication_masks import mask_of
 from watches.models import Brand, Complication, Watch
+from watches.representations import invalidate_representations
+from watches.serials import with_serial_retry
+import django
 import random
 
 
+# Marques de luxe réalistes
+BRANDS_DATA = [
+    {'name': 'Rolex', 'country': 'Suisse', 'year': 1905, 
+     'desc': 'Manufacture horlogère suisse de prestige fondée à Londres puis établie à Genève.'},
+    {'name': 'Omega', 'country': 'Suisse', 'year': 1848,
+     'desc': 'Marque horlogère suisse de luxe, célèbre pour ses montres de plongée et spatiales.'},
+    {'name': 'Patek Philippe', 'country': 'Suisse', 'year': 1839,
+     'desc': 'Manufacture horlogère de haute horlogerie, considérée comme l\'une des plus prestigieuses.'},
+    {'name': 'Audemars Piguet', 'country': 'Suisse', 'year': 1875,
+     'desc': 'Manufacture horlogère suisse de luxe, créatrice de la Royal Oak.'},
+    {'name': 'Seiko', 'country': 'Japon', 'year': 1881,
+     'desc': 'Manufacture horlogère japonaise, pionnière du quartz et de la technologie Spring Drive.'},
+    {'name': 'Grand Seiko', 'country': 'Japon', 'year': 1960,
+     'desc': 'Division haute horlogerie de Seiko, reconnue pour sa précision exceptionnelle.'},
+    {'name': 'Cartier', 'country': 'France', 'year': 1847,
+     'desc': 'Maison de joaillerie et horlogerie française, créatrice de montres iconiques.'},
+    {'name': 'IWC Schaffhausen', 'country': 'Suisse', 'year': 1868,
+     'desc': 'Manufacture horlogère suisse spécialisée dans les montres d\'aviation et de plongée.'},
+    {'name': 'Breitling', 'country': 'Suisse', 'year': 1884,
+     'desc': 'Manufacture suisse spécialisée dans les chronographes et montres d\'aviation.'},
+    {'name': 'TAG Heuer', 'country': 'Suisse', 'year': 1860,
+     'desc': 'Marque horlogère suisse de luxe, pionnière du chronographe sportif.'},
+    {'name': 'Jaeger-LeCoultre', 'country': 'Suisse', 'year': 1833,
+     'desc': 'Manufacture horlogère suisse de haute horlogerie, créatrice de la Reverso.'},
+    {'name': 'Vacheron Constantin', 'country': 'Suisse', 'year': 1755,
+     'desc': 'Plus ancienne manufacture horlogère en activité continue.'},
+]
+
+# Complications horlogères
+COMPLICATIONS_DATA = [
+    {'name': 'Chronographe', 'desc': 'Fonction de chronométrage permettant de mesurer des intervalles de temps.'},
+    {'name': 'Date', 'desc': 'Affichage de la date du jour, généralement par guichet.'},
+    {'name': 'Phase de Lune', 'desc': 'Indication des phases lunaires sur un cadran dédié.'},
+    {'name': 'GMT / Dual Time', 'desc': 'Affichage d\'un second fuseau horaire.'},
+    {'name': 'Tourbillon', 'desc': 'Mécanisme de haute précision compensant les effets de la gravité.'},
+    {'name': 'Répétition Minutes', 'desc': 'Sonnerie indiquant les heures, quarts et minutes à la demande.'},
+    {'name': 'Calendrier Perpétuel', 'desc': 'Calendrier automatique tenant compte des années bissextiles.'},
+    {'name': 'Réserve de Marche', 'desc': 'Indication de l\'autonomie restante du mouvement.'},
+    {'name': 'Jour de la Semaine', 'desc': 'Affichage du jour de la semaine.'},
+    {'name': 'Équation du Temps', 'desc': 'Indication de la différence entre temps solaire et temps civil.'},
+]
+
+# Noms de modèles réalistes
+MODEL_PREFIXES = [
+    'Submariner', 'Speedmaster', 'Royal Oak', 'Nautilus', 'Daytona',
+    'Seamaster', 'Datejust', 'Aquanaut', 'Navitimer', 'Carrera',
+    'Reverso', 'Patrimony', 'Overseas', 'Aqua Terra', 'Planet Ocean',
+    'Chronomat', 'Avenger', 'Pilot', 'Portugieser', 'Ingenieur',
+    'Santos', 'Tank', 'Ballon Bleu', 'Calibre', 'Pasha'
+]
+
+MODEL_SUFFIXES = [
+    'Professional', 'Classic', 'Chronograph', 'GMT', 'Diver',
+    'Heritage', 'Limited Edition', 'Automatic', 'Perpetual', 'Master',
+    'Ultra Thin', 'Moonphase', 'Tourbillon', 'Skeleton', 'Complications'
+]
+
+
+REFERENCE_FORMAT = '??-####-??'
+
+
+def build_watch(rng, brand_name, complication_total):
+    """
+    Tire les caractéristiques d'une montre réaliste.
+
+    ``rng`` est le module ``random`` ou une instance ``random.Random`` ;
+    renvoie les champs du modèle (hors marque et référence) et les indices
+    des complications à associer.
+    """
+    # Nom de modèle réaliste
+    if rng.random() < 0.7:  # 70% avec suffixe
+        model_name = f"{rng.choice(MODEL_PREFIXES)} {rng.choice(MODEL_SUFFIXES)}"
+    else:
+        model_name = rng.choice(MODEL_PREFIXES)
+    
+    # Prix cohérent selon le matériau
+    material = rng.choice(['STEEL', 'GOLD', 'TITANIUM', 'CERAMIC', 'PLATINUM', 'BRONZE'])
+    
+    if material == 'STEEL':
+        price = rng.randint(3000, 15000)
+    elif material == 'TITANIUM':
+        price = rng.randint(8000, 25000)
+    elif material == 'CERAMIC':
+        price = rng.randint(10000, 30000)
+    elif material == 'BRONZE':
+        price = rng.randint(5000, 18000)
+    elif material == 'GOLD':
+        price = rng.randint(20000, 80000)
+    else:  # PLATINUM
+        price = rng.randint(40000, 120000)
+    
+    # Mouvement cohérent avec le prix
+    if price > 50000:
+        movement = rng.choice(['AUTO', 'MANUAL'])  # Luxe = mécanique
+    elif price > 20000:
+        movement = rng.choice(['AUTO', 'AUTO', 'MANUAL', 'QUARTZ'])
+    else:
+        movement = rng.choice(['AUTO', 'QUARTZ', 'SOLAR'])
+    
+    # Description réaliste
+    descriptions = [
+        f"Garde-temps d'exception alliant tradition horlogère et innovation technique. "
+        f"Ce modèle incarne l'excellence de {brand_name} avec son mouvement {dict(Watch.MOVEMENT_CHOICES)[movement].lower()}.",
+        
+        f"Montre de prestige conçue pour les amateurs d'horlogerie fine. "
+        f"Boîtier en {dict(Watch.MATERIAL_CHOICES)[material].lower()} de {rng.choice([36, 38, 40, 42, 44])} mm.",
+        
+        f"Création horlogère emblématique de la maison {brand_name}. "
+        f"Design intemporel et finitions exceptionnelles pour ce modèle {model_name}.",
+        
+        f"Instrument de précision développé selon les standards les plus exigeants. "
+        f"Étanche jusqu'à {rng.choice([30, 50, 100, 200, 300])} mètres.",
+    ]
+    
+    fields = {
+        'model_name': model_name,
+        'price': price,
+        'case_diameter': rng.choice([36, 38, 39, 40, 41, 42, 43, 44, 45]),
+        'movement_type': movement,
+        'case_material': material,
+        'water_resistance': rng.choice([30, 50, 100, 200, 300, 500]),
+        'description': rng.choice(descriptions),
+    }
+    
+    # Ajouter 0-4 complications aléatoires
+    num_complications = rng.choices([0, 1, 2, 3, 4], weights=[20, 40, 25, 10, 5])[0]
+    complication_indexes = rng.sample(range(complication_total), min(num_complications, complication_total))
+    return fields, complication_indexes
+
+
+_worker_fake = None
+
+
+def generate_batch(task):
+    """
+    Génère un lot de montres en mémoire (exécuté dans un processus du pool).
+
+    Chaque lot a sa propre graine dérivée de ``(seed, index)`` : le jeu de
+    données ne dépend donc pas du nombre de processus.
+    """
+    global _worker_fake
+    seed, index, size, brands, complication_total = task
+    if _worker_fake is None:
+        _worker_fake = Faker('fr_FR')
+    _worker_fake.seed_instance(f'{seed}:{index}')
+    rng = random.Random(f'{seed}:{index}')
+    
+    rows = []
+    for _ in range(size):
+        brand_id, brand_name = rng.choice(brands)
+        fields, complication_indexes = build_watch(rng, brand_name, complication_total)
+        fields['brand_id'] = brand_id
+        fields['reference_number'] = _worker_fake.bothify(text=REFERENCE_FORMAT).upper()
+        rows.append((fields, complication_indexes))
+    return rows
+
+
 class Command(BaseCommand):
     help = 'Génère des montres de luxe réalistes avec Faker'
     
@@ -18,48 +181,51 @@ class Command(BaseCommand):
             action='store_true',
             help='Supprime toutes les données existantes avant de générer'
         )
+        parser.add_argument(
+            '--bulk',
+            action='store_true',
+            help='Insertion en masse (bulk_create) sans requête par montre'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Nombre de montres par lot en mode --bulk (défaut: 5000)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Nombre de processus de génération en mode --bulk (défaut: 1)'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            help='Graine aléatoire pour un jeu de données reproductible'
+        )
     
     def handle(self, *args, **options):
         fake = Faker('fr_FR')
         count = options['count']
         
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers et --batch-size doivent être positifs')
+        if options['workers'] > 1 and not options['bulk']:
+            raise CommandError('--workers nécessite le mode --bulk')
+        
+        if options['seed'] is not None:
+            random.seed(options['seed'])
+            fake.seed_instance(options['seed'])
+        
         if options['clear']:
             self.stdout.write(self.style.WARNING('Suppression des données existantes...'))
             Watch.objects.all().delete()
             Brand.objects.all().delete()
             Complication.objects.all().delete()
         
-        # Marques de luxe réalistes
-        brands_data = [
-            {'name': 'Rolex', 'country': 'Suisse', 'year': 1905, 
-             'desc': 'Manufacture horlogère suisse de prestige fondée à Londres puis établie à Genève.'},
-            {'name': 'Omega', 'country': 'Suisse', 'year': 1848,
-             'desc': 'Marque horlogère suisse de luxe, célèbre pour ses montres de plongée et spatiales.'},
-            {'name': 'Patek Philippe', 'country': 'Suisse', 'year': 1839,
-             'desc': 'Manufacture horlogère de haute horlogerie, considérée comme l\'une des plus prestigieuses.'},
-            {'name': 'Audemars Piguet', 'country': 'Suisse', 'year': 1875,
-             'desc': 'Manufacture horlogère suisse de luxe, créatrice de la Royal Oak.'},
-            {'name': 'Seiko', 'country': 'Japon', 'year': 1881,
-             'desc': 'Manufacture horlogère japonaise, pionnière du quartz et de la technologie Spring Drive.'},
-            {'name': 'Grand Seiko', 'country': 'Japon', 'year': 1960,
-             'desc': 'Division haute horlogerie de Seiko, reconnue pour sa précision exceptionnelle.'},
-            {'name': 'Cartier', 'country': 'France', 'year': 1847,
-             'desc': 'Maison de joaillerie et horlogerie française, créatrice de montres iconiques.'},
-            {'name': 'IWC Schaffhausen', 'country': 'Suisse', 'year': 1868,
-             'desc': 'Manufacture horlogère suisse spécialisée dans les montres d\'aviation et de plongée.'},
-            {'name': 'Breitling', 'country': 'Suisse', 'year': 1884,
-             'desc': 'Manufacture suisse spécialisée dans les chronographes et montres d\'aviation.'},
-            {'name': 'TAG Heuer', 'country': 'Suisse', 'year': 1860,
-             'desc': 'Marque horlogère suisse de luxe, pionnière du chronographe sportif.'},
-            {'name': 'Jaeger-LeCoultre', 'country': 'Suisse', 'year': 1833,
-             'desc': 'Manufacture horlogère suisse de haute horlogerie, créatrice de la Reverso.'},
-            {'name': 'Vacheron Constantin', 'country': 'Suisse', 'year': 1755,
-             'desc': 'Plus ancienne manufacture horlogère en activité continue.'},
-        ]
-        
         self.stdout.write('Création des marques...')
         brands = []
-        for data in brands_data:
+        for data in BRANDS_DATA:
             brand, created = Brand.objects.get_or_create(
                 name=data['name'],
                 defaults={
@@ -72,23 +238,9 @@ class Command(BaseCommand):
             if created:
                 self.stdout.write(self.style.SUCCESS(f'  ✓ {brand.name}'))
         
-        # Complications horlogères
-        complications_data = [
-            {'name': 'Chronographe', 'desc': 'Fonction de chronométrage permettant de mesurer des intervalles de temps.'},
-            {'name': 'Date', 'desc': 'Affichage de la date du jour, généralement par guichet.'},
-            {'name': 'Phase de Lune', 'desc': 'Indication des phases lunaires sur un cadran dédié.'},
-            {'name': 'GMT / Dual Time', 'desc': 'Affichage d\'un second fuseau horaire.'},
-            {'name': 'Tourbillon', 'desc': 'Mécanisme de haute précision compensant les effets de la gravité.'},
-            {'name': 'Répétition Minutes', 'desc': 'Sonnerie indiquant les heures, quarts et minutes à la demande.'},
-            {'name': 'Calendrier Perpétuel', 'desc': 'Calendrier automatique tenant compte des années bissextiles.'},
-            {'name': 'Réserve de Marche', 'desc': 'Indication de l\'autonomie restante du mouvement.'},
-            {'name': 'Jour de la Semaine', 'desc': 'Affichage du jour de la semaine.'},
-            {'name': 'Équation du Temps', 'desc': 'Indication de la différence entre temps solaire et temps civil.'},
-        ]
-        
         self.stdout.write('Création des complications...')
         complications = []
-        for data in complications_data:
+        for data in COMPLICATIONS_DATA:
             comp, created = Complication.objects.get_or_create(
                 name=data['name'],
                 defaults={'description': data['desc']}
@@ -97,92 +249,32 @@ class Command(BaseCommand):
             if created:
                 self.stdout.write(self.style.SUCCESS(f'  ✓ {comp.name}'))
         
-        # Noms de modèles réalistes
-        model_prefixes = [
-            'Submariner', 'Speedmaster', 'Royal Oak', 'Nautilus', 'Daytona',
-            'Seamaster', 'Datejust', 'Aquanaut', 'Navitimer', 'Carrera',
-            'Reverso', 'Patrimony', 'Overseas', 'Aqua Terra', 'Planet Ocean',
-            'Chronomat', 'Avenger', 'Pilot', 'Portugieser', 'Ingenieur',
-            'Santos', 'Tank', 'Ballon Bleu', 'Calibre', 'Pasha'
-        ]
-        
-        model_suffixes = [
-            'Professional', 'Classic', 'Chronograph', 'GMT', 'Diver',
-            'Heritage', 'Limited Edition', 'Automatic', 'Perpetual', 'Master',
-            'Ultra Thin', 'Moonphase', 'Tourbillon', 'Skeleton', 'Complications'
-        ]
-        
         self.stdout.write(f'\nGénération de {count} montres...')
+        if options['bulk']:
+            created_count = self.generate_bulk(count, brands, complications, options)
+        else:
+            created_count = self.generate(count, brands, complications, fake)
+        
+        self.stdout.write(self.style.SUCCESS(f'\n✓ {created_count} montres générées avec succès!'))
+        self.stdout.write(self.style.SUCCESS(f'✓ {len(brands)} marques'))
+        self.stdout.write(self.style.SUCCESS(f'✓ {len(complications)} complications'))
+    
+    def generate(self, count, brands, complications, fake):
+        """Mode historique : une création (et ses requêtes) par montre"""
         created_count = 0
         
         for i in range(count):
             try:
                 brand = random.choice(brands)
-                
-                # Nom de modèle réaliste
-                if random.random() < 0.7:  # 70% avec suffixe
-                    model_name = f"{random.choice(model_prefixes)} {random.choice(model_suffixes)}"
-                else:
-                    model_name = random.choice(model_prefixes)
+                fields, complication_indexes = build_watch(random, brand.name, len(complications))
                 
                 # Référence unique
-                ref = f"{fake.bothify(text='??-####-??').upper()}"
+                ref = f"{fake.bothify(text=REFERENCE_FORMAT).upper()}"
                 
-                # Prix cohérent selon le matériau
-                material = random.choice(['STEEL', 'GOLD', 'TITANIUM', 'CERAMIC', 'PLATINUM', 'BRONZE'])
+                watch = Watch.objects.create(reference_number=ref, brand=brand, **fields)
                 
-                if material == 'STEEL':
-                    price = random.randint(3000, 15000)
-                elif material == 'TITANIUM':
-                    price = random.randint(8000, 25000)
-                elif material == 'CERAMIC':
-                    price = random.randint(10000, 30000)
-                elif material == 'BRONZE':
-                    price = random.randint(5000, 18000)
-                elif material == 'GOLD':
-                    price = random.randint(20000, 80000)
-                else:  # PLATINUM
-                    price = random.randint(40000, 120000)
-                
-                # Mouvement cohérent avec le prix
-                if price > 50000:
-                    movement = random.choice(['AUTO', 'MANUAL'])  # Luxe = mécanique
-                elif price > 20000:
-                    movement = random.choice(['AUTO', 'AUTO', 'MANUAL', 'QUARTZ'])
-                else:
-                    movement = random.choice(['AUTO', 'QUARTZ', 'SOLAR'])
-                
-                # Description réaliste
-                descriptions = [
-                    f"Garde-temps d'exception alliant tradition horlogère et innovation technique. "
-                    f"Ce modèle incarne l'excellence de {brand.name} avec son mouvement {dict(Watch.MOVEMENT_CHOICES)[movement].lower()}.",
-                    
-                    f"Montre de prestige conçue pour les amateurs d'horlogerie fine. "
-                    f"Boîtier en {dict(Watch.MATERIAL_CHOICES)[material].lower()} de {random.choice([36, 38, 40, 42, 44])} mm.",
-                    
-                    f"Création horlogère emblématique de la maison {brand.name}. "
-                    f"Design intemporel et finitions exceptionnelles pour ce modèle {model_name}.",
-                    
-                    f"Instrument de précision développé selon les standards les plus exigeants. "
-                    f"Étanche jusqu'à {random.choice([30, 50, 100, 200, 300])} mètres.",
-                ]
-                
-                watch = Watch.objects.create(
-                    model_name=model_name,
-                    reference_number=ref,
-                    price=price,
-                    case_diameter=random.choice([36, 38, 39, 40, 41, 42, 43, 44, 45]),
-                    movement_type=movement,
-                    case_material=material,
-                    water_resistance=random.choice([30, 50, 100, 200, 300, 500]),
-                    description=random.choice(descriptions),
-                    brand=brand,
-                )
-                
-                # Ajouter 0-4 complications aléatoires
-                num_complications = random.choices([0, 1, 2, 3, 4], weights=[20, 40, 25, 10, 5])[0]
-                if num_complications > 0:
-                    watch.complications.set(random.sample(complications, num_complications))
+                if complication_indexes:
+                    watch.complications.set([complications[i] for i in complication_indexes])
                 
                 created_count += 1
                 
@@ -192,6 +284,79 @@ class Command(BaseCommand):
             except Exception as e:
                 self.stdout.write(self.style.ERROR(f'  ✗ Erreur: {str(e)}'))
         
-        self.stdout.write(self.style.SUCCESS(f'\n✓ {created_count} montres générées avec succès!'))
-        self.stdout.write(self.style.SUCCESS(f'✓ {len(brands)} marques'))
-        self.stdout.write(self.style.SUCCESS(f'✓ {len(complications)} complications'))
+        return created_count
+    
+    def generate_bulk(self, count, brands, complications, options):
+        """
+        Mode --bulk : les lots sont générés en mémoire (éventuellement en
+        parallèle) puis insérés avec ``bulk_create``, table de liaison des
+        complications comprise. Les références sont dédoublonnées en mémoire
+        et les numéros de série réservés par blocs : aucune requête par montre.
+        """
+        seed = options['seed']
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.stdout.write(f'  Graine: {seed} (--seed {seed} pour reproduire ce jeu de données)')
+        
+        batch_size = options['batch_size']
+        brand_refs = [(brand.pk, brand.name) for brand in brands]
+        tasks = [
+            (seed, index, min(batch_size, count - start), brand_refs, len(complications))
+            for index, start in enumerate(range(0, count, batch_size))
+        ]
+        
+        # Références déjà prises : chargées une seule fois
+        used_refs = set(Watch.objects.values_list('reference_number', flat=True))
+        # Les collisions sont retirées avec un générateur dédié, lui aussi déterministe
+        collision_fake = Faker('fr_FR')
+        collision_fake.seed_instance(f'{seed}:collisions')
+        
+        through = Watch.complications.through
+        created_count = 0
+        pool = None
+        if options['workers'] > 1:
+            pool = Pool(options['workers'], initializer=django.setup)
+            batches = pool.imap(generate_batch, tasks)
+        else:
+            batches = map(generate_batch, tasks)
+        
+        try:
+            for rows in batches:
+                watches = []
+                for fields, complication_indexes in rows:
+                    while fields['reference_number'] in used_refs:
+                        fields['reference_number'] = collision_fake.bothify(text=REFERENCE_FORMAT).upper()
+                    used_refs.add(fields['reference_number'])
+                    # La table de liaison est écrite sans m2m_changed : masque calculé ici
+                    mask = mask_of(complications[i].bit for i in complication_indexes)
+                    watches.append(Watch(**fields, complication_mask=mask))
+                
+                def write_batch():
+                    Watch.objects.bulk_create(watches)
+                    if watches and watches[0].pk is None:
+                        # Base sans RETURNING sur les insertions multiples
+                        ids = dict(Watch.objects.filter(
+                            reference_number__in=[w.reference_number for w in watches]
+                        ).values_list('reference_number', 'id'))
+                        for watch in watches:
+                            watch.pk = ids[watch.reference_number]
+                    through.objects.bulk_create([
+                        through(watch_id=watch.pk, complication_id=complications[i].pk)
+                        for watch, (_, complication_indexes) in zip(watches, rows)
+                        for i in complication_indexes
+                    ])
+                
+                with_serial_retry(watches, write_batch)
+                # Sans post_save : fragments d'identifiants déjà servis (séquence réinitialisée, base restaurée)
+                invalidate_representations([watch.pk for watch in watches])
+                
+                created_count += len(watches)
+                self.stdout.write(f'  {created_count}/{count} montres créées...')
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            # bulk_create n'émet aucun signal : invalider les caches explicitement
+            bump_catalogue_version()
+        
+        return created_count
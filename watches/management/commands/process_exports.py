@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from watches.exports import process_pending_exports, purge_expired_exports, reap_stale_exports
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Rend les exports PDF en attente (jobs non traités, par exemple après un redémarrage), '
+        'reprend les jobs interrompus et supprime les exports expirés'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Continue à interroger la table des jobs (worker autonome)'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2.0,
+            help='Intervalle entre deux interrogations en mode --loop (défaut: 2 s)'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            reaped = reap_stale_exports()
+            if reaped:
+                self.stdout.write(self.style.WARNING(f'{reaped} export(s) interrompu(s) remis en attente'))
+            purged = purge_expired_exports()
+            if purged:
+                self.stdout.write(f'{purged} export(s) expiré(s) supprimé(s)')
+            done = process_pending_exports()
+            if done:
+                self.stdout.write(self.style.SUCCESS(f'✓ {done} export(s) rendu(s)'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,91 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+
+FTS_TABLE = 'watches_watch_fts'
+
+CREATE_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        model_name, reference_number, brand_name, description,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3 4'
+    )
+    """,
+    f"""
+    INSERT INTO {FTS_TABLE} (rowid, model_name, reference_number, brand_name, description)
+    SELECT w.id, w.model_name, w.reference_number, b.name, w.description
+    FROM watches_watch w JOIN watches_brand b ON b.id = w.brand_id
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON watches_watch BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, model_name, reference_number, brand_name, description)
+        SELECT new.id, new.model_name, new.reference_number, b.name, new.description
+        FROM watches_brand b WHERE b.id = new.brand_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_update
+    AFTER UPDATE OF model_name, reference_number, description, brand_id ON watches_watch BEGIN
+        UPDATE {FTS_TABLE} SET
+            model_name = new.model_name,
+            reference_number = new.reference_number,
+            description = new.description,
+            brand_name = (SELECT name FROM watches_brand WHERE id = new.brand_id)
+        WHERE rowid = new.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON watches_watch BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_brand_update AFTER UPDATE OF name ON watches_brand BEGIN
+        UPDATE {FTS_TABLE} SET brand_name = new.name
+        WHERE rowid IN (SELECT id FROM watches_watch WHERE brand_id = new.id);
+    END
+    """,
+]
+
+DROP_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_brand_update",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_update",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def create_search_index(apps, schema_editor):
+    """Index FTS5 (SQLite uniquement, sinon la recherche reste en icontains)"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)")
+            cursor.execute("DROP TABLE temp.fts5_probe")
+        except OperationalError:
+            # SQLite compilé sans FTS5
+            return
+        for sql in CREATE_SQL:
+            cursor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for sql in DROP_SQL:
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watches', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-17 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watches', '0003_sequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='watch',
+            index=models.Index(fields=['price', 'id'], name='watch_price_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='watch',
+            index=models.Index(fields=['case_diameter', 'id'], name='watch_diameter_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='watch',
+            index=models.Index(fields=['created_at', 'id'], name='watch_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='watch',
+            index=models.Index(fields=['model_name', 'id'], name='watch_model_name_id_idx'),
+        ),
+    ]
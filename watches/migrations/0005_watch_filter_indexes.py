@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-17 18:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watches', '0004_watch_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='watch',
+            index=models.Index(fields=['movement_type', 'created_at'], name='watch_movement_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='watch',
+            index=models.Index(fields=['case_material', 'created_at'], name='watch_material_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='watch',
+            index=models.Index(fields=['brand', 'created_at'], name='watch_brand_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='watch',
+            index=models.Index(fields=['water_resistance'], name='watch_water_idx'),
+        ),
+    ]
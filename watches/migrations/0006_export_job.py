@@ -0,0 +1,35 @@
+# Generated by Django 6.0.1 on 2026-10-17 19:20
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watches', '0005_watch_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('catalogue', 'Catalogue (fiches techniques)'), ('wishlist', 'Wishlist'), ('comparison', 'Comparatif'), ('admin_catalogue', 'Catalogue (administration)'), ('certificate', "Certificat d'authenticité")], max_length=20, verbose_name="Type d'export")),
+                ('watch_ids', models.JSONField(default=list, verbose_name='Montres')),
+                ('status', models.CharField(choices=[('PENDING', 'En attente'), ('RUNNING', 'En cours'), ('DONE', 'Terminé'), ('FAILED', 'Échec')], default='PENDING', max_length=10, verbose_name='Statut')),
+                ('file', models.FileField(blank=True, upload_to='exports/', verbose_name='Fichier')),
+                ('filename', models.CharField(max_length=100, verbose_name='Nom du fichier téléchargé')),
+                ('error', models.TextField(blank=True, verbose_name='Erreur')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Export PDF',
+                'verbose_name_plural': 'Exports PDF',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='exportjob_status_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 6.0.1 on 2026-10-17 20:40
+
+from importlib import import_module
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+search_index = import_module('watches.migrations.0002_watch_search_index')
+TRIGGER_NAMES = ['insert', 'update', 'delete', 'brand_update']
+
+
+def has_search_index(schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [search_index.FTS_TABLE])
+        return cursor.fetchone() is not None
+
+
+def drop_search_triggers(apps, schema_editor):
+    """
+    SQLite reconstruit watches_watch pour y ajouter une colonne, ce que les
+    triggers FTS (0002) empêchent : retirés pendant ce temps.
+    """
+    if has_search_index(schema_editor):
+        with schema_editor.connection.cursor() as cursor:
+            for name in TRIGGER_NAMES:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {search_index.FTS_TABLE}_{name}")
+
+
+def create_search_triggers(apps, schema_editor):
+    if has_search_index(schema_editor):
+        with schema_editor.connection.cursor() as cursor:
+            for sql in search_index.CREATE_SQL:
+                if sql.strip().startswith('CREATE TRIGGER'):
+                    cursor.execute(sql)
+
+
+def backfill(apps, schema_editor):
+    """Bits des complications existantes (par id) puis masque de chaque montre"""
+    Complication = apps.get_model('watches', 'Complication')
+    Watch = apps.get_model('watches', 'Watch')
+    complications = list(Complication.objects.order_by('pk'))
+    if len(complications) > 63:
+        raise RuntimeError("Plus de 63 complications : Watch.complication_mask est plein")
+    for bit, complication in enumerate(complications):
+        complication.bit = bit
+        complication.save(update_fields=['bit'])
+        Watch.objects.filter(complications=complication).update(
+            complication_mask=F('complication_mask').bitor(1 << bit)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('watches', '0006_export_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_search_triggers, create_search_triggers),
+        migrations.AddField(
+            model_name='complication',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, unique=True, verbose_name='Bit'),
+        ),
+        migrations.AddField(
+            model_name='watch',
+            name='complication_mask',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='watch',
+            index=models.Index(fields=['complication_mask'], name='watch_complication_mask_idx'),
+        ),
+        migrations.RunPython(create_search_triggers, drop_search_triggers),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
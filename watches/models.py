@@ -1,11 +1,31 @@
+import uuid
+
 from django.db import models
 from django.core.validators import MinValueValidator
-import random
-import string
+from .serials import serial_allocator, with_serial_retry
+
+
+class LoadedFilesMixin:
+    """
+    Garde le nom des fichiers ``file_fields`` tels que lus en base
+    (``_loaded_files``) : ``signals.image_saved`` ne relance les déclinaisons
+    que si l'image a changé.
+    """
+    file_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_files = {
+            name: value for name, value in zip(field_names, values) if name in cls.file_fields
+        }
+        return instance
 
 
-class Brand(models.Model):
+class Brand(LoadedFilesMixin, models.Model):
     """Marque de montres - Relation 1-N avec Watch"""
+    file_fields = ('logo',)
+
     name = models.CharField(max_length=100, unique=True, verbose_name="Nom de la marque")
     country = models.CharField(max_length=100, verbose_name="Pays d'origine")
     founded_year = models.IntegerField(verbose_name="Année de fondation")
@@ -23,8 +43,13 @@ class Brand(models.Model):
 
 class Complication(models.Model):
     """Complications horlogères - Relation N-N avec Watch"""
+    # Bits utilisables de Watch.complication_mask (entier signé sur 64 bits)
+    MAX_BITS = 63
+
     name = models.CharField(max_length=100, unique=True, verbose_name="Nom")
     description = models.TextField(verbose_name="Description technique")
+    # Position dans Watch.complication_mask, attribuée à la création
+    bit = models.PositiveSmallIntegerField(unique=True, null=True, editable=False, verbose_name="Bit")
     
     class Meta:
         verbose_name = "Complication"
@@ -33,10 +58,20 @@ class Complication(models.Model):
     
     def __str__(self):
         return self.name
+    
+    def save(self, *args, **kwargs):
+        if self.bit is None:
+            used = set(Complication.objects.exclude(bit=None).values_list('bit', flat=True))
+            free = [bit for bit in range(self.MAX_BITS) if bit not in used]
+            if not free:
+                raise ValueError(f"Plus de {self.MAX_BITS} complications : Watch.complication_mask est plein")
+            self.bit = free[0]
+        super().save(*args, **kwargs)
 
 
-class Watch(models.Model):
+class Watch(LoadedFilesMixin, models.Model):
     """Modèle principal : Montre (7+ champs requis)"""
+    file_fields = ('image',)
     
     MOVEMENT_CHOICES = [
         ('AUTO', 'Automatique'),
@@ -108,25 +143,90 @@ class Watch(models.Model):
         related_name='watches', 
         verbose_name="Complications"
     )
+    # Bits (Complication.bit) des complications de la montre, tenu à jour par
+    # watches.signals : filtres complications__all/any/none sans jointure
+    complication_mask = models.BigIntegerField(default=0, editable=False)
     
     class Meta:
         verbose_name = "Montre"
         verbose_name_plural = "Montres"
         ordering = ['-created_at']
+        indexes = [
+            # Pagination par curseur : un index (champ de tri, id) par ordering_fields
+            models.Index(fields=['price', 'id'], name='watch_price_id_idx'),
+            models.Index(fields=['case_diameter', 'id'], name='watch_diameter_id_idx'),
+            models.Index(fields=['created_at', 'id'], name='watch_created_id_idx'),
+            models.Index(fields=['model_name', 'id'], name='watch_model_name_id_idx'),
+            # Filtres d'égalité de WatchViewSet combinés au tri par défaut (-created_at)
+            models.Index(fields=['movement_type', 'created_at'], name='watch_movement_created_idx'),
+            models.Index(fields=['case_material', 'created_at'], name='watch_material_created_idx'),
+            models.Index(fields=['brand', 'created_at'], name='watch_brand_created_idx'),
+            # Filtre par plage (prix et diamètre sont couverts par les index ci-dessus)
+            models.Index(fields=['water_resistance'], name='watch_water_idx'),
+            # Filtres de complications : parcours de cet index étroit plutôt que de la table
+            models.Index(fields=['complication_mask'], name='watch_complication_mask_idx'),
+        ]
     
     def __str__(self):
         return f"{self.brand.name} {self.model_name} ({self.reference_number})"
     
     def save(self, *args, **kwargs):
         # Générer un numéro de série automatiquement si non fourni
-        if not self.serial_number:
-            self.serial_number = self.generate_serial_number()
-        super().save(*args, **kwargs)
+        if self.serial_number:
+            return super().save(*args, **kwargs)
+        with_serial_retry([self], lambda: super(Watch, self).save(*args, **kwargs))
     
     @staticmethod
     def generate_serial_number():
-        """Génère un numéro de série unique"""
-        while True:
-            serial = 'SN-' + ''.join(random.choices(string.digits, k=8))
-            if not Watch.objects.filter(serial_number=serial).exists():
-                return serial
+        """Génère un numéro de série unique (voir ``watches.serials``)"""
+        return serial_allocator.allocate()
+
+
+class Sequence(models.Model):
+    """Compteur réservé par blocs (numéros de série)"""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
+class ExportJob(models.Model):
+    """Export PDF rendu en arrière-plan (voir ``watches.exports``)"""
+    
+    KIND_CHOICES = [
+        ('catalogue', 'Catalogue (fiches techniques)'),
+        ('wishlist', 'Wishlist'),
+        ('comparison', 'Comparatif'),
+        ('admin_catalogue', 'Catalogue (administration)'),
+        ('certificate', "Certificat d'authenticité"),
+    ]
+    
+    STATUS_CHOICES = [
+        ('PENDING', 'En attente'),
+        ('RUNNING', 'En cours'),
+        ('DONE', 'Terminé'),
+        ('FAILED', 'Échec'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name="Type d'export")
+    watch_ids = models.JSONField(default=list, verbose_name="Montres")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING', verbose_name="Statut")
+    file = models.FileField(upload_to='exports/', blank=True, verbose_name="Fichier")
+    filename = models.CharField(max_length=100, verbose_name="Nom du fichier téléchargé")
+    error = models.TextField(blank=True, verbose_name="Erreur")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        verbose_name = "Export PDF"
+        verbose_name_plural = "Exports PDF"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='exportjob_status_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} ({self.get_status_display()})"
@@ -0,0 +1,157 @@
+"""
+Pagination du catalogue.
+
+Par défaut, pagination par numéro de page (compatible avec Home.vue). Avec
+``?cursor=...`` ou ``?pagination=cursor``, pagination par clé (keyset) :
+chaque page est lue à partir de la dernière ligne de la précédente
+(``WHERE (champ, id) > (valeur, id)``) grâce aux index composites
+``(champ, id)`` de ``Watch``, sans ``OFFSET`` ni ``COUNT(*)`` : la page N
+coûte autant que la page 1.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pagination par curseur sur l'un des ``ordering_fields`` de la vue, avec
+    l'``id`` comme départage stable.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 12
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = "Curseur invalide"
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        """Premier critère de tri validé par ``OrderingFilter`` (ex. ``-price``)"""
+        ordering = OrderingFilter().get_ordering(request, queryset, view) or ['-id']
+        return ordering[0]
+
+    def encode_cursor(self, ordering, value, pk, reverse=False):
+        payload = json.dumps({'o': ordering, 'v': value, 'id': pk, 'r': reverse}, default=str)
+        return urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, encoded, ordering):
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            cursor = json.loads(urlsafe_b64decode(padded.encode()))
+            if cursor['o'] != ordering:
+                raise ValueError(cursor['o'])
+            return cursor['v'], int(cursor['id']), bool(cursor['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size_value = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        descending = self.ordering.startswith('-')
+        self.field = self.ordering.lstrip('-')
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        reverse = False
+        if encoded:
+            value, pk, reverse = self.decode_cursor(encoded, self.ordering)
+            # Page précédente : on parcourt l'index dans l'autre sens
+            before = descending != reverse
+            bound, strict, tiebreak = (
+                ('lte', 'lt', 'id__lt') if before else ('gte', 'gt', 'id__gt')
+            )
+            queryset = queryset.filter(**{f'{self.field}__{bound}': value}).filter(
+                Q(**{f'{self.field}__{strict}': value}) | Q(**{tiebreak: pk})
+            )
+
+        prefix = '-' if descending != reverse else ''
+        queryset = queryset.order_by(f'{prefix}{self.field}', f'{prefix}id')
+        rows = list(queryset[:self.page_size_value + 1])
+        has_more = len(rows) > self.page_size_value
+        rows = rows[:self.page_size_value]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = bool(encoded) if not reverse else has_more
+        self.first = rows[0] if rows else None
+        self.last = rows[-1] if rows else None
+        return rows
+
+    def _cursor_link(self, row, reverse):
+        url = self.request.build_absolute_uri()
+        if isinstance(row, dict):  # liste rapide (``.values()``)
+            value, pk = row[self.field], row['id']
+        else:
+            value, pk = getattr(row, self.field), row.pk
+        cursor = self.encode_cursor(self.ordering, value, pk, reverse)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if not self.has_next or self.last is None:
+            return None
+        return self._cursor_link(self.last, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first is None:
+            return None
+        return self._cursor_link(self.first, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class WatchPagination(PageNumberPagination):
+    """
+    Numéro de page par défaut, keyset si la requête porte un curseur ou
+    ``?pagination=cursor``.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    mode_query_param = 'pagination'
+    keyset_class = KeysetPagination
+
+    def use_keyset(self, request):
+        return (
+            self.keyset_class.cursor_query_param in request.query_params
+            or request.query_params.get(self.mode_query_param) == 'cursor'
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.keyset_class() if self.use_keyset(request) else None
+        if self.keyset is not None:
+            self.keyset.max_page_size = self.max_page_size
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,331 @@
+"""
+Rendu PDF du catalogue.
+
+Les cinq documents (catalogue, catalogue d'administration, wishlist,
+comparatif, certificat) sont décrits ici, une fois chacun. Leurs parties
+fixes (titres, filets, cadres) sont des *formes* : elles sont dessinées une
+seule fois par document, en XObject, puis placées sur chaque page avec
+``doForm`` au lieu d'être redessinées.
+
+Les montres sont toujours lues par ``load_watches`` (marque jointe,
+complications préchargées si besoin) : pas de requête par page.
+
+Les catalogues (une fiche par montre) passent par l'écrivain incrémental de
+``pdf_stream`` ; les autres documents, courts, par le canvas ReportLab. Les
+deux exposent la même API de dessin, si bien qu'une mise en page s'écrit
+une seule fois pour les deux.
+"""
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Table, TableStyle
+
+from .comparison import get_comparison
+from .models import Watch
+from .pdf_stream import stream_pdf, stream_pdf_parallel
+
+
+# À incrémenter à chaque changement de mise en page : invalide les PDF en cache (pdf_cache.py)
+LAYOUT_VERSION = 1
+
+WIDTH, HEIGHT = A4
+GOLD = (0.77, 0.63, 0.35)
+
+# Nombre de montres lues par requête SQL lors des exports en flux
+PDF_CHUNK_SIZE = 200
+
+
+def load_watches(watch_ids, complications=False):
+    """Montres demandées avec leur marque (et leurs complications) sans requête par page"""
+    queryset = Watch.objects.filter(id__in=watch_ids).select_related('brand')
+    if complications:
+        queryset = queryset.prefetch_related('complications')
+    return queryset
+
+
+def truncate(text, limit):
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def wrap_words(text, width=90):
+    """Découpe ``text`` en lignes d'environ ``width`` caractères"""
+    lines, line = [], ""
+    for word in text.split():
+        if len(line + word) < width:
+            line += word + " "
+        else:
+            lines.append(line)
+            line = word + " "
+    lines.append(line)
+    return lines
+
+
+def reportlab_canvas(output, forms):
+    """Canvas ReportLab dont les formes ``forms`` sont déjà définies"""
+    p = canvas.Canvas(output, pagesize=A4)
+    for name, draw in forms.items():
+        p.beginForm(name)
+        draw(p)
+        p.endForm()
+    return p
+
+
+class FicheLayout:
+    """Fiche technique : une montre par page, pied de page numéroté si ``numbered``"""
+    description_limit = 800
+
+    def __init__(self, numbered=False):
+        self.numbered = numbered
+
+    @property
+    def forms(self):
+        return {'fiche': self.draw_static}
+
+    def draw_static(self, p):
+        p.setFont("Helvetica-Bold", 20)
+        p.drawCentredString(WIDTH/2, HEIGHT - 2*cm, "FICHE TECHNIQUE")
+        p.setStrokeColorRGB(*GOLD)
+        p.line(2*cm, HEIGHT - 4*cm, WIDTH - 2*cm, HEIGHT - 4*cm)
+
+    def draw_page(self, p, watch, index):
+        p.doForm('fiche')
+        p.setFont("Helvetica-Bold", 16)
+        p.drawCentredString(WIDTH/2, HEIGHT - 3.5*cm, f"{watch.brand.name} - {watch.model_name}")
+
+        y = HEIGHT - 5.5*cm
+        for label, value in [
+            ("Référence", watch.reference_number),
+            ("Prix", f"{watch.price} €"),
+            ("Mouvement", watch.get_movement_type_display()),
+            ("Matériau", watch.get_case_material_display()),
+            ("Diamètre", f"{watch.case_diameter} mm"),
+            ("Étanchéité", f"{watch.water_resistance} m"),
+        ]:
+            p.setFont("Helvetica-Bold", 11)
+            p.drawString(2*cm, y, label)
+            p.setFont("Helvetica", 11)
+            p.drawString(6*cm, y, str(value))
+            y -= 0.8*cm
+
+        p.setFont("Helvetica-Bold", 11)
+        p.drawString(2*cm, y, "Description")
+        text_obj = p.beginText(2*cm, y - 0.6*cm)
+        text_obj.setFont("Helvetica", 10)
+        for line in wrap_words(truncate(watch.description, self.description_limit)):
+            text_obj.textLine(line)
+        p.drawText(text_obj)
+
+        if self.numbered:
+            p.setFont("Helvetica-Oblique", 8)
+            p.drawCentredString(WIDTH/2, 1*cm, f"Page {index + 1} | Chrono-Collections • 2026")
+
+
+class WishlistLayout:
+    """Liste condensée : bandeau récapitulatif puis une carte par montre"""
+    card_height = 3*cm
+
+    @property
+    def forms(self):
+        return {'wishlist_header': self.draw_header, 'wishlist_card': self.draw_card}
+
+    def draw_header(self, p):
+        p.setFont("Helvetica-Bold", 22)
+        p.drawCentredString(WIDTH/2, HEIGHT - 2*cm, "MA SÉLECTION EXCLUSIVE")
+        p.setFont("Helvetica", 10)
+        p.drawCentredString(WIDTH/2, HEIGHT - 3*cm, "Catalogue personnalisé de garde-temps de prestige")
+        p.setStrokeColorRGB(*GOLD)
+        p.setFillColorRGB(0.98, 0.96, 0.92)
+        p.rect(2*cm, HEIGHT - 4.5*cm, WIDTH - 4*cm, 1*cm, fill=1)
+
+    def draw_card(self, p):
+        p.setStrokeColorRGB(*GOLD)
+        p.rect(2*cm, 0, WIDTH - 4*cm, self.card_height)
+
+    def draw(self, p, watches):
+        total_price = sum(w.price for w in watches)
+        p.doForm('wishlist_header')
+        p.setFillColorRGB(0.2, 0.2, 0.2)
+        p.setFont("Helvetica-Bold", 11)
+        p.drawString(2.5*cm, HEIGHT - 4*cm, f"COLLECTION : {len(watches)} pièces")
+        p.drawRightString(WIDTH - 2.5*cm, HEIGHT - 4*cm, f"VALEUR TOTALE : {total_price} €")
+
+        y = HEIGHT - 6*cm
+        p.setFillColorRGB(0, 0, 0)
+        for watch in watches:
+            if y < 4*cm:
+                p.showPage()
+                y = HEIGHT - 2*cm
+            p.saveState()
+            p.translate(0, y - self.card_height)
+            p.doForm('wishlist_card')
+            p.restoreState()
+
+            p.setFont("Helvetica-Bold", 14)
+            p.drawString(2.5*cm, y - 0.7*cm, f"{watch.brand.name} • {watch.model_name}")
+            p.setFont("Helvetica", 10)
+            p.drawString(2.5*cm, y - 1.5*cm, f"Réf: {watch.reference_number}")
+            p.drawString(2.5*cm, y - 2.1*cm, f"Mouv: {watch.get_movement_type_display()}")
+            p.drawString(9*cm, y - 2.1*cm, f"Matériau: {watch.get_case_material_display()}")
+            p.setFont("Helvetica-Bold", 12)
+            p.drawRightString(WIDTH - 2.5*cm, y - 1.5*cm, f"{watch.price} €")
+            y -= 3.5*cm
+
+
+class ComparisonLayout:
+    """Tableau comparatif, une colonne par montre"""
+    # Lignes de la matrice (comparison.py) reprises dans le PDF
+    fields = ['price', 'movement_type', 'case_material', 'case_diameter', 'water_resistance']
+    table_style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#c5a059")),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (0, -1), colors.HexColor("#f9f9f9")),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ])
+
+    @property
+    def forms(self):
+        return {'comparison_header': self.draw_header}
+
+    def draw_header(self, p):
+        p.setFont("Helvetica-Bold", 20)
+        p.drawCentredString(WIDTH/2, HEIGHT - 2*cm, "COMPARATIF HAUTE HORLOGERIE")
+
+    def draw(self, p, matrix):
+        p.doForm('comparison_header')
+        watches = matrix['watches']
+        if not watches:
+            return
+        rows = {row['field']: row for row in matrix['rows']}
+        data = [['Caractéristique'] + [f"{w['brand_name']}\n{w['model_name']}" for w in watches]]
+        style = []
+        for field in self.fields:
+            row = rows[field]
+            data.append([row['label']] + row['display'])
+            for column, best in enumerate(row['best'], start=1):
+                if best:
+                    # Meilleure valeur de la ligne
+                    style.append(('FONTNAME', (column, len(data) - 1), (column, len(data) - 1), 'Helvetica-Bold'))
+                    style.append(('TEXTCOLOR', (column, len(data) - 1), (column, len(data) - 1), colors.HexColor("#c5a059")))
+        table = Table(data, colWidths=[3.5*cm] + [(WIDTH - 5.5*cm)/len(watches)] * len(watches))
+        table.setStyle(TableStyle(style, parent=self.table_style))
+        table.wrapOn(p, WIDTH, HEIGHT)
+        table.drawOn(p, 1*cm, HEIGHT - 10*cm)
+
+
+class CertificateLayout:
+    """Certificat d'authenticité d'une montre"""
+
+    @property
+    def forms(self):
+        return {'certificate_frame': self.draw_frame}
+
+    def draw_frame(self, p):
+        p.setFont("Helvetica-Bold", 28)
+        p.drawCentredString(WIDTH/2, HEIGHT - 3*cm, "CERTIFICAT D'AUTHENTICITÉ")
+        p.setFont("Helvetica-Oblique", 12)
+        p.drawCentredString(WIDTH/2, HEIGHT - 3.8*cm, "Garde-Temps de Prestige")
+        p.setStrokeColorRGB(*GOLD)
+        p.setLineWidth(2)
+        p.line(4*cm, HEIGHT - 4.5*cm, WIDTH - 4*cm, HEIGHT - 4.5*cm)
+        p.setLineWidth(1)
+        p.rect(3*cm, 2*cm, WIDTH - 6*cm, HEIGHT - 5*cm, stroke=1, fill=0)
+        p.setFont("Helvetica-Bold", 14)
+        p.drawString(4*cm, HEIGHT - 6.5*cm, "INFORMATIONS DU GARDE-TEMPS")
+        p.setFont("Helvetica-Oblique", 9)
+        p.setFillColorRGB(0.5, 0.5, 0.5)
+        p.drawCentredString(WIDTH/2, 1.5*cm, "Ce certificat atteste de l'authenticité du garde-temps décrit ci-dessus.")
+        p.drawCentredString(WIDTH/2, 1*cm, "Chrono-Collections • 2026")
+
+    def draw(self, p, watch):
+        p.doForm('certificate_frame')
+        y = HEIGHT - 7.7*cm
+        for label, value in [
+            ("Marque:", watch.brand.name),
+            ("Modèle:", watch.model_name),
+            ("Référence:", watch.reference_number),
+            ("Numéro de série:", watch.serial_number or 'N/A'),
+            ("", ""),
+            ("Mouvement:", watch.get_movement_type_display()),
+            ("Matériau:", watch.get_case_material_display()),
+            ("Diamètre du boîtier:", f"{watch.case_diameter} mm"),
+            ("Étanchéité:", f"{watch.water_resistance} mètres"),
+            ("", ""),
+            ("Prix catalogue:", f"{watch.price} €"),
+        ]:
+            if label:
+                p.setFont("Helvetica-Bold", 11)
+                p.drawString(4*cm, y, label)
+                p.setFont("Helvetica", 11)
+                p.drawString(9*cm, y, str(value))
+            y -= 0.7*cm
+
+        complications = watch.complications.all()
+        if complications:
+            y -= 0.5*cm
+            p.setFont("Helvetica-Bold", 11)
+            p.drawString(4*cm, y, "Complications:")
+            y -= 0.7*cm
+            p.setFont("Helvetica", 11)
+            for comp in complications:
+                p.drawString(5*cm, y, f"• {comp.name}")
+                y -= 0.6*cm
+
+
+FICHE = FicheLayout()
+FICHE_NUMBERED = FicheLayout(numbered=True)
+WISHLIST = WishlistLayout()
+COMPARISON = ComparisonLayout()
+CERTIFICATE = CertificateLayout()
+
+
+def stream_catalogue(watch_ids, layout=FICHE):
+    """Octets du catalogue « une fiche par montre », en flux (pages dessinées en parallèle)"""
+    watches = load_watches(watch_ids).iterator(chunk_size=PDF_CHUNK_SIZE)
+    return stream_pdf_parallel(watches, layout.draw_page, forms=layout.forms)
+
+
+def write_catalogue_pdf(output, watch_ids):
+    for chunk in stream_catalogue(watch_ids):
+        output.write(chunk)
+
+
+def write_admin_catalogue_pdf(output, watch_ids):
+    for chunk in stream_catalogue(watch_ids, FICHE_NUMBERED):
+        output.write(chunk)
+
+
+def write_wishlist_pdf(output, watch_ids):
+    p = reportlab_canvas(output, WISHLIST.forms)
+    WISHLIST.draw(p, list(load_watches(watch_ids)))
+    p.save()
+
+
+def write_comparison_pdf(output, watch_ids):
+    """Comparatif dessiné depuis la matrice en cache de ``/api/watches/compare/``"""
+    p = reportlab_canvas(output, COMPARISON.forms)
+    COMPARISON.draw(p, get_comparison([int(pk) for pk in watch_ids]))
+    p.save()
+
+
+def write_certificate_pdf(output, watch_ids):
+    render_certificate(output, load_watches(watch_ids[:1], complications=True).get())
+
+
+def render_certificate(output, watch):
+    """Certificat d'une montre déjà chargée (avec marque et complications)"""
+    p = reportlab_canvas(output, CERTIFICATE.forms)
+    CERTIFICATE.draw(p, watch)
+    p.showPage()
+    p.save()
+
+
+def render_fiche(output, watch):
+    """Fiche technique seule d'une montre déjà chargée"""
+    for chunk in stream_pdf([watch], FICHE.draw_page, forms=FICHE.forms):
+        output.write(chunk)
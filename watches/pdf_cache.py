@@ -0,0 +1,156 @@
+"""
+Cache disque des PDF d'une seule montre (certificat, fiche technique).
+
+Ces documents ne dépendent que de la ligne de la montre, de sa marque et de
+ses complications. Ils sont rangés sous
+``MEDIA_ROOT/<WATCHES_PDF_CACHE_DIR>/<type>-<id>-<empreinte>.pdf`` où
+l'empreinte est un SHA-256 de ces données et de ``pdf.LAYOUT_VERSION`` :
+une montre, une marque ou une complication modifiée donne une autre
+empreinte, donc un autre fichier. Un téléchargement répété est une lecture
+de fichier (``open_cached_pdf``), servie par ``FileResponse`` (``sendfile``
+côté serveur).
+
+Les signaux de ``watches.signals`` suppriment les fichiers d'une montre
+modifiée ; ceux devenus obsolètes par une marque ou une complication sont
+remplacés au rendu suivant. La taille totale est bornée par
+``WATCHES_PDF_CACHE_MAX_BYTES`` : les fichiers les moins récemment servis
+(date de modification, remise à jour à chaque lecture) sont supprimés en
+premier.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+
+from .rendering import pdf
+
+
+# Fonction ``render(output, watch)`` de watches.pdf, par document mis en cache
+RENDERERS = {
+    'certificate': 'render_certificate',
+    'fiche': 'render_fiche',
+}
+
+
+def get_pdf_cache_dir():
+    return Path(settings.MEDIA_ROOT) / getattr(settings, 'WATCHES_PDF_CACHE_DIR', 'pdf-cache')
+
+
+def get_pdf_cache_max_bytes():
+    return getattr(settings, 'WATCHES_PDF_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+
+
+def _row(instance):
+    return {field.attname: field.value_to_string(instance) for field in instance._meta.concrete_fields}
+
+
+def content_hash(kind, watch):
+    """Empreinte des données lues par le document ``kind`` de ``watch``"""
+    payload = {
+        'kind': kind,
+        'layout': pdf().LAYOUT_VERSION,
+        'watch': _row(watch),
+        'brand': _row(watch.brand),
+        'complications': [_row(c) for c in sorted(watch.complications.all(), key=lambda c: c.pk)],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _remove(paths):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def _lookup(kind, watch_id):
+    watch = pdf().load_watches([watch_id], complications=True).get()
+    return watch, get_pdf_cache_dir() / f'{kind}-{watch.pk}-{content_hash(kind, watch)}.pdf'
+
+
+def _render(kind, watch, path, keep_open=False):
+    """Rend le document dans ``path`` ; renvoie le fichier ouvert en lecture si ``keep_open``"""
+    directory = path.parent
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            getattr(pdf(), RENDERERS[kind])(output, watch)
+        # Ouvert avant le renommage : l'éviction qui suit ne peut plus le retirer au lecteur
+        file = open(temporary, 'rb') if keep_open else None
+        # Renommage atomique : un lecteur concurrent ne voit jamais de fichier partiel
+        os.replace(temporary, path)
+    except BaseException:
+        _remove([temporary])
+        raise
+    _remove(p for p in directory.glob(f'{kind}-{watch.pk}-*.pdf') if p != path)
+    evict()
+    return file if keep_open else path
+
+
+def cached_pdf(kind, watch_id):
+    """
+    Chemin du PDF ``kind`` de la montre, rendu seulement s'il n'est pas déjà
+    sur disque. Lève ``Watch.DoesNotExist``. Le fichier peut être supprimé
+    (éviction, montre modifiée) avant d'être lu : pour le servir, utiliser
+    ``open_cached_pdf``.
+    """
+    watch, path = _lookup(kind, watch_id)
+    try:
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        return _render(kind, watch, path)
+
+
+def open_cached_pdf(kind, watch_id):
+    """
+    PDF ``kind`` de la montre ouvert en lecture binaire, rendu s'il manque.
+    Une fois ouvert, sa suppression du cache n'interrompt pas la lecture.
+    Lève ``Watch.DoesNotExist``.
+    """
+    watch, path = _lookup(kind, watch_id)
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        return _render(kind, watch, path, keep_open=True)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    return file
+
+
+def invalidate_pdfs(pks):
+    """Supprime les PDF en cache des montres ``pks``"""
+    directory = get_pdf_cache_dir()
+    if directory.is_dir():
+        for pk in pks:
+            _remove(directory.glob(f'*-{pk}-*.pdf'))
+
+
+def evict(max_bytes=None):
+    """Supprime les fichiers les moins récemment servis jusqu'à repasser sous ``max_bytes``"""
+    max_bytes = get_pdf_cache_max_bytes() if max_bytes is None else max_bytes
+    entries = []
+    with os.scandir(get_pdf_cache_dir()) as it:
+        for entry in it:
+            if entry.name.endswith('.pdf'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        _remove([path])
+        total -= size
+        removed += 1
+    return removed
@@ -0,0 +1,370 @@
+"""
+Écriture incrémentale de PDF.
+
+ReportLab construit tout le document en mémoire et ne produit les octets
+qu'au ``save()``. Ce module écrit au contraire chaque page dès qu'elle est
+dessinée : le client reçoit le début du fichier immédiatement et la mémoire
+reste constante quel que soit le nombre de pages (seuls les offsets des
+objets sont conservés pour la table xref finale).
+
+``PageCanvas`` reprend le sous-ensemble de l'API ``reportlab.pdfgen.canvas``
+utilisé par nos fiches (setFont, drawString, line, beginText...), ce qui
+permet de partager le code de dessin entre les deux moteurs.
+
+``stream_pdf_parallel`` répartit le dessin des pages entre plusieurs
+processus : chaque processus rend un paquet de pages consécutives et renvoie
+leurs flux de contenu compressés, que le processus web assemble dans
+l'ordre. Le dessin (Python pur, lié au CPU) profite ainsi de plusieurs
+cœurs, l'écriture du fichier restant séquentielle et en flux.
+
+Le pool est créé une fois par processus web, au premier export parallèle :
+avec N workers web, ce sont N × ``WATCHES_PDF_WORKERS`` processus de rendu
+(chacun avec Django chargé). D'où une valeur par défaut petite (2) ; à
+augmenter seulement si les workers web sont peu nombreux par rapport aux
+cœurs. ``1`` (ou ``0``) rend les pages dans le processus web, sans pool.
+"""
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from multiprocessing import get_context
+from threading import Lock
+
+import django
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+
+# Polices standard PDF (aucune incorporation nécessaire)
+STANDARD_FONTS = ['Helvetica', 'Helvetica-Bold', 'Helvetica-Oblique']
+
+
+def _num(value):
+    """Formate un nombre pour un flux PDF (sans zéros inutiles)"""
+    text = ('%.3f' % value).rstrip('0').rstrip('.')
+    return text if text not in ('', '-0') else '0'
+
+
+def _pdf_string(text):
+    """Encode une chaîne littérale PDF (WinAnsiEncoding)"""
+    raw = str(text).encode('cp1252', errors='replace')
+    raw = raw.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+    return b'(' + raw + b')'
+
+
+def form_ref(name):
+    """Nom de ressource PDF d'une forme (XObject)"""
+    return b'Fm' + ''.join(c for c in name if c.isalnum()).encode()
+
+
+class _TextObject:
+    """Équivalent minimal de ``reportlab.pdfgen.textobject.PDFTextObject``"""
+
+    def __init__(self, page, x, y):
+        self._page = page
+        self._ops = [b'BT', ('1 0 0 1 %s %s Tm' % (_num(x), _num(y))).encode()]
+
+    def setTextOrigin(self, x, y):
+        self._ops.append(('1 0 0 1 %s %s Tm' % (_num(x), _num(y))).encode())
+
+    def setFont(self, name, size, leading=None):
+        leading = size * 1.2 if leading is None else leading
+        self._ops.append(b'/%s %s Tf %s TL' % (
+            self._page.font_ref(name), _num(size).encode(), _num(leading).encode()
+        ))
+
+    def textLine(self, text=''):
+        self._ops.append(_pdf_string(text) + b' Tj T*')
+
+    def getCode(self):
+        return b'\n'.join(self._ops + [b'ET'])
+
+
+class PageCanvas:
+    """Collecte les opérateurs de dessin d'une seule page"""
+
+    def __init__(self, pagesize=A4, fonts=None):
+        self._pagesize = pagesize
+        self._fonts = {name: i + 1 for i, name in enumerate(fonts or STANDARD_FONTS)}
+        self._ops = []
+        self._font = ('Helvetica', 12)
+        self._states = []
+
+    def font_ref(self, name):
+        return b'F%d' % self._fonts[name]
+
+    def setFont(self, name, size):
+        self._font = (name, size)
+
+    def saveState(self):
+        self._states.append(self._font)
+        self._ops.append(b'q')
+
+    def restoreState(self):
+        self._font = self._states.pop()
+        self._ops.append(b'Q')
+
+    def translate(self, dx, dy):
+        self._ops.append(('1 0 0 1 %s %s cm' % (_num(dx), _num(dy))).encode())
+
+    def doForm(self, name):
+        """Place la forme ``name`` déclarée auprès de ``StreamingPDFWriter``"""
+        self._ops.append(b'/%s Do' % form_ref(name))
+
+    def setStrokeColorRGB(self, r, g, b):
+        self._ops.append(('%s %s %s RG' % (_num(r), _num(g), _num(b))).encode())
+
+    def setFillColorRGB(self, r, g, b):
+        self._ops.append(('%s %s %s rg' % (_num(r), _num(g), _num(b))).encode())
+
+    def setLineWidth(self, width):
+        self._ops.append(('%s w' % _num(width)).encode())
+
+    def line(self, x1, y1, x2, y2):
+        self._ops.append(('%s %s m %s %s l S' % (_num(x1), _num(y1), _num(x2), _num(y2))).encode())
+
+    def rect(self, x, y, width, height, stroke=1, fill=0):
+        operator = {(1, 0): 'S', (0, 1): 'f', (1, 1): 'B'}.get((bool(stroke), bool(fill)), 'n')
+        self._ops.append(('%s %s %s %s re %s' % (
+            _num(x), _num(y), _num(width), _num(height), operator
+        )).encode())
+
+    def drawString(self, x, y, text):
+        name, size = self._font
+        self._ops.append(b'BT /%s %s Tf 1 0 0 1 %s %s Tm %s Tj ET' % (
+            self.font_ref(name), _num(size).encode(),
+            _num(x).encode(), _num(y).encode(), _pdf_string(text)
+        ))
+
+    def drawCentredString(self, x, y, text):
+        name, size = self._font
+        self.drawString(x - stringWidth(str(text), name, size) / 2, y, text)
+
+    def drawRightString(self, x, y, text):
+        name, size = self._font
+        self.drawString(x - stringWidth(str(text), name, size), y, text)
+
+    def beginText(self, x=0, y=0):
+        text_obj = _TextObject(self, x, y)
+        name, size = self._font
+        text_obj.setFont(name, size)
+        return text_obj
+
+    def drawText(self, text_obj):
+        self._ops.append(text_obj.getCode())
+
+    def getpdfdata(self):
+        """Flux de contenu (non compressé) de la page"""
+        return b'\n'.join(self._ops)
+
+
+class StreamingPDFWriter:
+    """
+    Sérialise un PDF objet par objet.
+
+    Usage : ``header()`` puis ``page(canvas)`` pour chaque page, puis
+    ``trailer()``. Chaque appel renvoie les octets à envoyer au client.
+
+    ``forms`` associe un nom à une fonction ``draw(canvas)`` : ces parties
+    fixes (titres, filets, cadres) sont écrites une seule fois, en XObject,
+    et chaque page les place avec ``canvas.doForm(nom)``.
+    """
+    CATALOG = 1
+    PAGES = 2
+
+    def __init__(self, pagesize=A4, fonts=None, forms=None):
+        self.pagesize = pagesize
+        self.fonts = list(fonts or STANDARD_FONTS)
+        self.forms = dict(forms or {})
+        self._form_objects = {}
+        self._offsets = {}
+        self._position = 0
+        self._next_object = self.PAGES + 1
+        self._font_objects = []
+        self._page_objects = []
+
+    def new_page(self):
+        return PageCanvas(self.pagesize, self.fonts)
+
+    def _allocate(self):
+        number = self._next_object
+        self._next_object += 1
+        return number
+
+    def _object(self, number, body):
+        self._offsets[number] = self._position
+        data = b'%d 0 obj\n' % number + body + b'\nendobj\n'
+        self._position += len(data)
+        return data
+
+    def _emit(self, data):
+        self._position += len(data)
+        return data
+
+    def header(self):
+        chunks = [self._emit(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')]
+        for name in self.fonts:
+            number = self._allocate()
+            self._font_objects.append(number)
+            chunks.append(self._object(number, (
+                '<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>' % name
+            ).encode()))
+        width, height = self.pagesize
+        for name, draw in self.forms.items():
+            canvas = self.new_page()
+            draw(canvas)
+            content = zlib.compress(canvas.getpdfdata())
+            number = self._allocate()
+            self._form_objects[name] = number
+            chunks.append(self._object(number, (
+                '<< /Type /XObject /Subtype /Form /BBox [0 0 %s %s] /Resources << /Font << %s >> >> '
+                '/Length %d /Filter /FlateDecode >>\nstream\n'
+                % (_num(width), _num(height), self._font_resources(), len(content))
+            ).encode() + content + b'\nendstream'))
+        return b''.join(chunks)
+
+    def _font_resources(self):
+        return ' '.join('/F%d %d 0 R' % (i + 1, n) for i, n in enumerate(self._font_objects))
+
+    def page(self, canvas):
+        return self.compressed_page(zlib.compress(canvas.getpdfdata()))
+
+    def compressed_page(self, content):
+        """Page dont le flux de contenu est déjà compressé (rendu dans un autre processus)"""
+        content_number = self._allocate()
+        page_number = self._allocate()
+        self._page_objects.append(page_number)
+        width, height = self.pagesize
+        return self._object(
+            content_number,
+            b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(content) + content + b'\nendstream'
+        ) + self._object(page_number, (
+            '<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %s %s] /Contents %d 0 R >>'
+            % (self.PAGES, _num(width), _num(height), content_number)
+        ).encode())
+
+    def trailer(self):
+        chunks = []
+        if not self._page_objects:
+            # Un PDF doit contenir au moins une page
+            chunks.append(self.page(self.new_page()))
+        kids = ' '.join('%d 0 R' % n for n in self._page_objects)
+        forms = ' '.join('/%s %d 0 R' % (form_ref(name).decode(), n) for name, n in self._form_objects.items())
+        chunks.append(self._object(self.PAGES, (
+            '<< /Type /Pages /Kids [%s] /Count %d /Resources << /Font << %s >> /XObject << %s >> >> >>'
+            % (kids, len(self._page_objects), self._font_resources(), forms)
+        ).encode()))
+        chunks.append(self._object(self.CATALOG, (
+            '<< /Type /Catalog /Pages %d 0 R >>' % self.PAGES
+        ).encode()))
+
+        xref_position = self._position
+        size = self._next_object
+        xref = [b'xref\n0 %d\n' % size, b'0000000000 65535 f \n']
+        for number in range(1, size):
+            xref.append(b'%010d 00000 n \n' % self._offsets[number])
+        xref.append((
+            'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+            % (size, self.CATALOG, xref_position)
+        ).encode())
+        chunks.append(self._emit(b''.join(xref)))
+        return b''.join(chunks)
+
+
+def stream_pdf(items, draw_page, pagesize=A4, forms=None):
+    """
+    Générateur d'octets PDF : une page par élément de ``items``.
+
+    ``draw_page(canvas, item, index)`` dessine la page sur un ``PageCanvas`` ;
+    ``forms`` : parties fixes partagées par les pages (voir ``StreamingPDFWriter``).
+    """
+    writer = StreamingPDFWriter(pagesize, forms=forms)
+    yield writer.header()
+    for index, item in enumerate(items):
+        canvas = writer.new_page()
+        draw_page(canvas, item, index)
+        yield writer.page(canvas)
+    yield writer.trailer()
+
+
+_pool = None
+_pool_lock = Lock()
+
+
+def get_pdf_workers():
+    return getattr(settings, 'WATCHES_PDF_WORKERS', 2) or 1
+
+
+def get_pdf_shard_size():
+    return getattr(settings, 'WATCHES_PDF_SHARD_SIZE', 100)
+
+
+def _get_pool():
+    """Pool de rendu partagé par les exports (créé au premier export parallèle)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # ``spawn`` : pas de fork d'un serveur multi-thread ni de connexion
+            # SQL héritée ; les processus ne font que dessiner.
+            _pool = ProcessPoolExecutor(
+                get_pdf_workers(), mp_context=get_context('spawn'), initializer=django.setup
+            )
+        return _pool
+
+
+def render_shard(draw_page, items, start, pagesize=A4):
+    """
+    Dessine ``items`` (pages ``start``, ``start + 1``...) et renvoie leurs flux
+    de contenu compressés. Exécuté dans un processus du pool : ``draw_page``
+    doit être une fonction de module et ``items`` des objets picklables.
+    """
+    contents = []
+    for offset, item in enumerate(items):
+        canvas = PageCanvas(pagesize)
+        draw_page(canvas, item, start + offset)
+        contents.append(zlib.compress(canvas.getpdfdata()))
+    return contents
+
+
+def stream_pdf_parallel(items, draw_page, pagesize=A4, forms=None, workers=None, shard_size=None, pool=None):
+    """
+    Comme ``stream_pdf``, le dessin étant réparti par paquets de ``shard_size``
+    pages entre les processus du pool. ``index`` reste le numéro global de la
+    page (pied de page). Au plus deux paquets par processus sont en cours :
+    la mémoire reste bornée quel que soit le nombre de pages.
+    """
+    workers = workers or get_pdf_workers()
+    shard_size = shard_size or get_pdf_shard_size()
+    items = iter(items)
+    first = list(islice(items, shard_size))
+    if workers <= 1 or len(first) < shard_size:
+        # Un seul paquet : le dessin en parallèle ne ferait que coûter des copies
+        yield from stream_pdf(chain(first, items), draw_page, pagesize, forms)
+        return
+
+    pool = pool or _get_pool()
+    writer = StreamingPDFWriter(pagesize, forms=forms)
+    yield writer.header()
+    pending = deque()
+    start = 0
+
+    def submit(shard):
+        nonlocal start
+        pending.append(pool.submit(render_shard, draw_page, shard, start, pagesize))
+        start += len(shard)
+
+    submit(first)
+    try:
+        while pending:
+            while len(pending) < workers * 2:
+                shard = list(islice(items, shard_size))
+                if not shard:
+                    break
+                submit(shard)
+            for content in pending.popleft().result():
+                yield writer.compressed_page(content)
+    finally:
+        for future in pending:
+            future.cancel()
+    yield writer.trailer()
@@ -0,0 +1,36 @@
+"""
+Bibliothèques de rendu (matplotlib, ReportLab), chargées à la première
+utilisation.
+
+Elles pèsent plusieurs dizaines de Mo et plusieurs centaines de millisecondes
+d'import : importées au niveau module par l'admin ou les vues, elles étaient
+chargées par chaque processus Django, y compris les workers qui ne servent
+que l'API JSON et les commandes de gestion. Les modules qui dessinent des
+graphiques ou des PDF passent par ici ; ``watches.pdf`` et
+``watches.pdf_stream`` (qui importent ReportLab) ne doivent être importés que
+par ``pdf()`` ou à l'intérieur d'une fonction.
+
+``watches.tests.ImportTimeTests`` vérifie qu'un ``manage.py check`` ne les
+charge pas ; ``manage.py benchmark startup`` mesure le coût évité.
+"""
+from functools import cache
+from importlib import import_module
+
+
+# Modules qu'un worker API ne doit pas charger au démarrage
+HEAVY_MODULES = ('matplotlib', 'reportlab', 'numpy')
+
+
+@cache
+def pyplot():
+    """``matplotlib.pyplot`` en mode sans affichage, avec le style de l'admin"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    plt.style.use('dark_background')  # Style de base de tous les graphiques
+    return plt
+
+
+def pdf():
+    """Le module ``watches.pdf`` (mises en page et écrivains PDF, ReportLab)"""
+    return import_module('watches.pdf')
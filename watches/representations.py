@@ -0,0 +1,176 @@
+"""
+Cache des représentations sérialisées des montres.
+
+Chaque montre est sérialisée une fois par serializer, puis sa représentation
+est rangée sous ``watches:repr:<serializer>:<id>`` avec son ``updated_at``.
+Les pages de liste sont ensuite assemblées à partir de ces fragments (un seul
+``get_many`` par page) et seules les montres absentes du cache sont
+sérialisées.
+
+Ne sont pas mis en cache les champs ``live_fields`` : ceux qui viennent de
+la marque, des complications ou d'une annotation de la requête. Ils sont
+relus sur la ligne à chaque réponse, si bien qu'une modification de marque
+ou de complication ne rend jamais un fragment obsolète. Les signaux de
+``watches.signals`` suppriment les fragments d'une montre modifiée ou
+supprimée, et l'horodatage stocké écarte un fragment plus ancien que la
+ligne (écriture reçue par un autre processus, cache non partagé).
+
+``update()`` et ``bulk_create`` n'émettent aucun signal, et ``update()`` ne
+touche pas ``updated_at`` (``auto_now``) : une écriture de ce type doit
+mettre ``updated_at`` à jour elle-même (voir complication_masks.py) ou
+appeler ``invalidate_representations``.
+
+Les URLs (``url_fields``, y compris les ``srcset``) sont stockées relatives à
+l'hôte de la requête et rendues absolues à l'assemblage : un même fragment
+sert tous les hôtes.
+
+Le backend est celui de l'alias ``WATCHES_REPRESENTATION_CACHE_ALIAS``
+(par défaut celui de ``WATCHES_CACHE_ALIAS``).
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import models
+from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+
+from .cache import get_cache, get_cache_timeout
+
+
+# Noms des serializers dont les fragments sont en cache (pour l'invalidation)
+_registry = set()
+
+
+def get_representation_cache():
+    alias = getattr(settings, 'WATCHES_REPRESENTATION_CACHE_ALIAS', None)
+    return caches[alias] if alias else get_cache()
+
+
+def representation_key(name, pk):
+    return f'watches:repr:{name}:{pk}'
+
+
+def invalidate_representations(pks):
+    """Supprime les fragments de toutes les montres ``pks``"""
+    keys = [representation_key(name, pk) for name in _registry for pk in pks]
+    if keys:
+        get_representation_cache().delete_many(keys)
+
+
+def _relative_urls(value, prefix):
+    """URL, ``srcset`` (URLs séparées par ``", "``) ou dictionnaire de ceux-ci"""
+    if isinstance(value, dict):
+        return {key: _relative_urls(item, prefix) for key, item in value.items()}
+    if isinstance(value, str):
+        return ', '.join(
+            part[len(prefix):] if part.startswith(prefix + '/') else part for part in value.split(', ')
+        )
+    return value
+
+
+def _absolute_urls(value, prefix):
+    if isinstance(value, dict):
+        return {key: _absolute_urls(item, prefix) for key, item in value.items()}
+    if isinstance(value, str):
+        return ', '.join(prefix + part if part.startswith('/') else part for part in value.split(', '))
+    return value
+
+
+class CachedListSerializer(serializers.ListSerializer):
+    """Sérialise une liste en une seule lecture du cache"""
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        return self.child.represent_many(list(iterable))
+
+
+class CachedRepresentationMixin:
+    """
+    À placer avant ``ModelSerializer`` ; le modèle doit avoir ``updated_at``.
+    ``Meta.list_serializer_class`` doit être ``CachedListSerializer``.
+    """
+    live_fields = ()
+    url_fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _registry.add(cls.__name__)
+
+    def to_representation(self, instance):
+        return self.represent_many([instance])[0]
+
+    def _url_prefix(self):
+        request = self.context.get('request')
+        return request.build_absolute_uri('/')[:-1] if request is not None else ''
+
+    def _live_representation(self, instance):
+        ret = {}
+        for field in self._readable_fields:
+            if field.field_name not in self.live_fields:
+                continue
+            try:
+                attribute = field.get_attribute(instance)
+            except SkipField:
+                continue
+            check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+            ret[field.field_name] = None if check_for_none is None else field.to_representation(attribute)
+        return ret
+
+    def _cacheable(self, data, prefix):
+        cached = {name: value for name, value in data.items() if name not in self.live_fields}
+        if prefix:
+            for name in self.url_fields:
+                if name in cached:
+                    cached[name] = _relative_urls(cached[name], prefix)
+        return cached
+
+    def _assemble(self, cached, live, prefix):
+        data = {}
+        for field in self._readable_fields:
+            name = field.field_name
+            if name in live:
+                data[name] = live[name]
+            elif name in cached:
+                value = cached[name]
+                if name in self.url_fields:
+                    value = _absolute_urls(value, prefix)
+                data[name] = value
+        return data
+
+    def _represent(self, instances, hits):
+        """Représentations de ``instances`` et fragments à mettre en cache"""
+        name = type(self).__name__
+        prefix = self._url_prefix()
+        results, misses = [], {}
+        for instance in instances:
+            key = representation_key(name, instance.pk)
+            stamp = instance.updated_at.isoformat()
+            entry = hits.get(key)
+            if entry is not None and entry[0] == stamp:
+                results.append(self._assemble(entry[1], self._live_representation(instance), prefix))
+            else:
+                data = super().to_representation(instance)
+                misses[key] = (stamp, self._cacheable(data, prefix))
+                results.append(data)
+        return results, misses
+
+    def _keys(self, instances):
+        return [representation_key(type(self).__name__, instance.pk) for instance in instances]
+
+    def represent_many(self, instances):
+        cache = get_representation_cache()
+        results, misses = self._represent(instances, cache.get_many(self._keys(instances)))
+        if misses:
+            cache.set_many(misses, get_cache_timeout())
+        return results
+
+    async def arepresent_many(self, instances):
+        """
+        ``represent_many`` pour les vues asynchrones, par l'API asynchrone du
+        cache ; les relations des ``instances`` doivent être préchargées.
+        """
+        cache = get_representation_cache()
+        results, misses = self._represent(instances, await cache.aget_many(self._keys(instances)))
+        if misses:
+            await cache.aset_many(misses, get_cache_timeout())
+        return results
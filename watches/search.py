@@ -0,0 +1,85 @@
+"""
+Recherche plein texte sur le catalogue.
+
+Sous SQLite, les montres sont indexées dans une table virtuelle FTS5
+(``watches_watch_fts``) créée par la migration 0002 et tenue à jour par des
+triggers sur ``watches_watch`` et ``watches_brand`` : les écritures en masse
+(``bulk_create``, suppressions en cascade...) restent donc synchronisées.
+Les autres moteurs, ou une base sans FTS5, retombent sur le ``SearchFilter``
+classique de DRF (``icontains``).
+"""
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+from rest_framework.settings import api_settings
+
+
+FTS_TABLE = 'watches_watch_fts'
+
+# Colonnes indexées et poids associés dans le classement bm25
+FTS_COLUMNS = [
+    ('model_name', 10.0),
+    ('reference_number', 8.0),
+    ('brand_name', 5.0),
+    ('description', 1.0),
+]
+
+_fts_available = {}
+
+
+def fts_available(alias='default'):
+    """Indique si l'index FTS5 existe sur la base ``alias`` (résultat mis en cache)"""
+    if alias not in _fts_available:
+        connection = connections[alias]
+        _fts_available[alias] = (
+            connection.vendor == 'sqlite'
+            and FTS_TABLE in connection.introspection.table_names()
+        )
+    return _fts_available[alias]
+
+
+def build_match_query(terms):
+    """
+    Traduit les termes de recherche en requête FTS5 : chaque terme devient
+    une phrase recherchée en préfixe, et tous les termes sont requis.
+    """
+    return ' AND '.join('"%s"*' % term.replace('"', '""') for term in terms)
+
+
+class WatchSearchFilter(filters.SearchFilter):
+    """
+    ``SearchFilter`` adossé à l'index FTS5.
+
+    Sans paramètre ``ordering`` explicite, les résultats sont classés par
+    pertinence (bm25). Ce filtre doit donc être placé après
+    ``OrderingFilter`` dans ``filter_backends``.
+
+    Le classement joint la table FTS à la requête principale : un jeu de
+    résultats destiné à servir de sous-requête (facettes) se demande avec
+    ``ranked=False``.
+    """
+
+    def __init__(self, ranked=True):
+        self.ranked = ranked
+
+    def filter_queryset(self, request, queryset, view):
+        terms = [term for term in self.get_search_terms(request) if term.strip('"')]
+        if not terms or not fts_available(queryset.db):
+            return super().filter_queryset(request, queryset, view)
+
+        match = build_match_query(terms)
+        if not self.ranked or request.query_params.get(api_settings.ORDERING_PARAM):
+            return queryset.filter(
+                id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+            )
+
+        # Jointure sur la table FTS : MATCH et bm25() évalués une fois par
+        # requête, et non dans une sous-requête corrélée à chaque ligne
+        weights = ', '.join(str(weight) for _, weight in FTS_COLUMNS)
+        table = queryset.model._meta.db_table
+        return queryset.extra(
+            select={'search_rank': f'bm25({FTS_TABLE}, {weights})'},
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE} MATCH %s', f'{FTS_TABLE}.rowid = "{table}"."id"'],
+            params=[match],
+        ).order_by('search_rank', *queryset.query.order_by)
@@ -1,42 +1,94 @@
+from django.urls import reverse
 from rest_framework import serializers
-from .models import Brand, Complication, Watch
+from .images import srcsets, thumbnail_url
+from .models import Brand, Complication, ExportJob, Watch
+from .representations import CachedListSerializer, CachedRepresentationMixin
 
 
-class BrandSerializer(serializers.ModelSerializer):
+def _annotated_count(obj, attr, manager):
+    """
+    Compteur annoté par le queryset de la vue (voir ``count_subquery``).
+    Sans annotation, on retombe sur un COUNT dédié.
+    """
+    count = getattr(obj, attr, None)
+    return manager.count() if count is None else count
+
+
+class ImageDerivativesMixin:
+    """``thumbnail_url`` / ``srcset`` de l'image ``image_field`` (voir images.py)"""
+    image_field = 'image'
+
+    def _media_url(self, storage):
+        request = self.context.get('request')
+        if request is None:
+            return storage.url
+        return lambda name: request.build_absolute_uri(storage.url(name))
+
+    def get_thumbnail_url(self, obj):
+        image = getattr(obj, self.image_field)
+        return thumbnail_url(image.name, self._media_url(image.storage)) if image else None
+
+    def get_srcset(self, obj):
+        image = getattr(obj, self.image_field)
+        return srcsets(image.name, self._media_url(image.storage)) if image else None
+
+
+class BrandSerializer(ImageDerivativesMixin, serializers.ModelSerializer):
     """Serializer pour les marques"""
-    watch_count = serializers.IntegerField(source='watches.count', read_only=True)
+    watch_count = serializers.SerializerMethodField()
+    logo_thumbnail_url = serializers.SerializerMethodField(method_name='get_thumbnail_url')
+    logo_srcset = serializers.SerializerMethodField(method_name='get_srcset')
+    image_field = 'logo'
     
     class Meta:
         model = Brand
-        fields = ['id', 'name', 'country', 'founded_year', 'logo', 'description', 'watch_count']
+        fields = [
+            'id', 'name', 'country', 'founded_year', 'logo', 'logo_thumbnail_url', 'logo_srcset',
+            'description', 'watch_count'
+        ]
+
+    def get_watch_count(self, obj):
+        return _annotated_count(obj, 'watch_count', obj.watches)
 
 
 class ComplicationSerializer(serializers.ModelSerializer):
     """Serializer pour les complications"""
-    watch_count = serializers.IntegerField(source='watches.count', read_only=True)
+    watch_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Complication
         fields = ['id', 'name', 'description', 'watch_count']
 
+    def get_watch_count(self, obj):
+        return _annotated_count(obj, 'watch_count', obj.watches)
 
-class WatchListSerializer(serializers.ModelSerializer):
-    """Serializer pour la liste des montres (vue catalogue)"""
+
+class WatchListSerializer(CachedRepresentationMixin, ImageDerivativesMixin, serializers.ModelSerializer):
+    """Serializer pour la liste des montres (vue catalogue), représentations en cache"""
     brand_name = serializers.CharField(source='brand.name', read_only=True)
     brand_country = serializers.CharField(source='brand.country', read_only=True)
     movement_display = serializers.CharField(source='get_movement_type_display', read_only=True)
     material_display = serializers.CharField(source='get_case_material_display', read_only=True)
-    complication_count = serializers.IntegerField(source='complications.count', read_only=True)
+    complication_count = serializers.SerializerMethodField()
     image_url = serializers.SerializerMethodField()
+    thumbnail_url = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
+    # Relus sur la ligne à chaque réponse (voir representations.py)
+    live_fields = ('brand_name', 'brand_country', 'complication_count')
+    url_fields = ('image', 'image_url', 'thumbnail_url', 'srcset')
     
     class Meta:
         model = Watch
         fields = [
             'id', 'model_name', 'reference_number', 'price', 'case_diameter',
             'movement_type', 'movement_display', 'case_material', 'material_display',
-            'water_resistance', 'image', 'image_url', 'brand_name', 'brand_country', 
-            'complication_count', 'created_at'
+            'water_resistance', 'image', 'image_url', 'thumbnail_url', 'srcset',
+            'brand_name', 'brand_country', 'complication_count', 'created_at'
         ]
+        list_serializer_class = CachedListSerializer
+
+    def get_complication_count(self, obj):
+        return _annotated_count(obj, 'complication_count', obj.complications)
 
     def get_image_url(self, obj):
         if obj.image:
@@ -47,8 +99,8 @@ class WatchListSerializer(serializers.ModelSerializer):
         return None
 
 
-class WatchDetailSerializer(serializers.ModelSerializer):
-    """Serializer détaillé pour une montre spécifique"""
+class WatchDetailSerializer(CachedRepresentationMixin, ImageDerivativesMixin, serializers.ModelSerializer):
+    """Serializer détaillé pour une montre spécifique, représentations en cache"""
     brand_obj = BrandSerializer(source='brand', read_only=True)
     brand_name = serializers.CharField(source='brand.name', read_only=True)
     brand_country = serializers.CharField(source='brand.country', read_only=True)
@@ -56,16 +108,22 @@ class WatchDetailSerializer(serializers.ModelSerializer):
     movement_display = serializers.CharField(source='get_movement_type_display', read_only=True)
     material_display = serializers.CharField(source='get_case_material_display', read_only=True)
     image_url = serializers.SerializerMethodField()
+    thumbnail_url = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
+    # Relus sur la ligne à chaque réponse (voir representations.py)
+    live_fields = ('brand_name', 'brand_country', 'brand_obj', 'complications')
+    url_fields = ('image', 'image_url', 'thumbnail_url', 'srcset')
     
     class Meta:
         model = Watch
         fields = [
             'id', 'model_name', 'reference_number', 'price', 'case_diameter',
             'movement_type', 'movement_display', 'case_material', 'material_display',
-            'water_resistance', 'description', 'image', 'image_url', 'serial_number',
-            'brand', 'brand_name', 'brand_country', 'brand_obj', 'complications', 
+            'water_resistance', 'description', 'image', 'image_url', 'thumbnail_url', 'srcset',
+            'serial_number', 'brand', 'brand_name', 'brand_country', 'brand_obj', 'complications', 
             'created_at', 'updated_at'
         ]
+        list_serializer_class = CachedListSerializer
 
     def get_image_url(self, obj):
         if obj.image:
@@ -74,3 +132,101 @@ class WatchDetailSerializer(serializers.ModelSerializer):
                 return request.build_absolute_uri(obj.image.url)
             return obj.image.url
         return None
+
+
+class WatchListValues:
+    """
+    Même JSON que ``WatchListSerializer``, produit à partir de ``.values()``.
+
+    Pas d'instance de modèle ni de champ DRF par ligne : les libellés viennent
+    de dictionnaires précalculés et seuls le prix et la date passent par le
+    champ DRF correspondant (même format). ``complication_count`` doit être
+    annoté par le queryset.
+    """
+    columns = [
+        'id', 'model_name', 'reference_number', 'price', 'case_diameter',
+        'movement_type', 'case_material', 'water_resistance', 'image',
+        'brand__name', 'brand__country', 'complication_count', 'created_at',
+    ]
+    movement_labels = {code: str(label) for code, label in Watch.MOVEMENT_CHOICES}
+    material_labels = {code: str(label) for code, label in Watch.MATERIAL_CHOICES}
+
+    def __init__(self, context=None):
+        self.request = (context or {}).get('request')
+        fields = WatchListSerializer().fields
+        self.price = fields['price'].to_representation
+        self.created_at = fields['created_at'].to_representation
+        self.storage = Watch._meta.get_field('image').storage
+
+    def values(self, queryset):
+        return queryset.values(*self.columns)
+
+    def media_url(self, name):
+        url = self.storage.url(name)
+        return self.request.build_absolute_uri(url) if self.request is not None else url
+
+    def image_url(self, name):
+        return self.media_url(name) if name else None
+
+    def to_representation(self, rows):
+        movement_labels, material_labels = self.movement_labels, self.material_labels
+        price, created_at, image_url, media_url = self.price, self.created_at, self.image_url, self.media_url
+        data = []
+        for row in rows:
+            url = image_url(row['image'])
+            movement, material = row['movement_type'], row['case_material']
+            data.append({
+                'id': row['id'],
+                'model_name': row['model_name'],
+                'reference_number': row['reference_number'],
+                'price': price(row['price']),
+                'case_diameter': row['case_diameter'],
+                'movement_type': movement,
+                'movement_display': movement_labels.get(movement, movement),
+                'case_material': material,
+                'material_display': material_labels.get(material, material),
+                'water_resistance': row['water_resistance'],
+                'image': url,
+                'image_url': url,
+                'thumbnail_url': thumbnail_url(row['image'], media_url),
+                'srcset': srcsets(row['image'], media_url),
+                'brand_name': row['brand__name'],
+                'brand_country': row['brand__country'],
+                'complication_count': row['complication_count'],
+                'created_at': created_at(row['created_at']) if row['created_at'] else None,
+            })
+        return data
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    """Export PDF en arrière-plan : soumission et suivi"""
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    status_url = serializers.SerializerMethodField()
+    download_url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = ExportJob
+        fields = [
+            'id', 'kind', 'watch_ids', 'status', 'status_display', 'error',
+            'created_at', 'started_at', 'finished_at', 'status_url', 'download_url'
+        ]
+        read_only_fields = ['status', 'error', 'created_at', 'started_at', 'finished_at']
+
+    def validate_watch_ids(self, value):
+        if not isinstance(value, list) or not value:
+            raise serializers.ValidationError("Aucun ID fourni")
+        try:
+            return list(dict.fromkeys(int(i) for i in value))
+        except (TypeError, ValueError):
+            raise serializers.ValidationError("Identifiants invalides")
+
+    def _url(self, name, obj):
+        url = reverse(name, args=[obj.pk])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_status_url(self, obj):
+        return self._url('export-job-detail', obj)
+
+    def get_download_url(self, obj):
+        return self._url('export-job-download', obj) if obj.status == 'DONE' else None
@@ -0,0 +1,242 @@
+"""
+Allocation des numéros de série.
+
+Un compteur est réservé en base par blocs (table ``watches_sequence``) puis
+chaque valeur est passée dans une permutation de Feistel à clé sur
+[0, 10^8[ : les numéros gardent le format ``SN-XXXXXXXX``, ne se suivent pas
+et sont uniques par construction, sans requête ``exists()`` par montre.
+
+Les anciens numéros tirés au hasard (ou une clé modifiée) peuvent encore
+provoquer une collision : ``with_serial_retry`` rattrape alors
+l'``IntegrityError``, abandonne le bloc en cours et réessaie avec un bloc
+neuf.
+
+Si la ligne du compteur manque (base restaurée sans elle), elle est créée à
+partir des numéros existants : la permutation s'inverse, ce qui redonne les
+compteurs déjà servis (``seed_value``).
+
+Un bloc réservé dans la transaction de l'appelant disparaît avec elle si
+elle est annulée : il n'est réutilisé que si la transaction est validée
+(``on_commit``) ou si les savepoints ouverts à la réservation le sont
+toujours (``_block_is_valid``). Réservé directement dans une transaction
+sans savepoint, rien ne le distinguerait d'une transaction suivante : seuls
+les numéros demandés sont alors réservés.
+"""
+import hashlib
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+
+SERIAL_PREFIX = 'SN-'
+SERIAL_DIGITS = 8
+SERIAL_SPACE = 10 ** SERIAL_DIGITS
+SERIAL_MAX_ATTEMPTS = 5
+
+_HALF = 10 ** (SERIAL_DIGITS // 2)
+_ROUNDS = 4
+
+
+def _round_function(key, round_index, value):
+    digest = hashlib.blake2b(
+        b'%d:%d' % (round_index, value), key=key, digest_size=8
+    ).digest()
+    return int.from_bytes(digest, 'big') % _HALF
+
+
+def permute(counter, key):
+    """Permutation de Feistel équilibrée (base 10^4) sur [0, 10^8["""
+    left, right = divmod(counter, _HALF)
+    for round_index in range(_ROUNDS):
+        left, right = right, (left + _round_function(key, round_index, right)) % _HALF
+    return left * _HALF + right
+
+
+def unpermute(value, key):
+    """Inverse de ``permute``"""
+    left, right = divmod(value, _HALF)
+    for round_index in reversed(range(_ROUNDS)):
+        left, right = (right - _round_function(key, round_index, left)) % _HALF, left
+    return left * _HALF + right
+
+
+def parse_serial(serial):
+    """Valeur permutée d'un numéro ``SN-XXXXXXXX`` ; ``None`` pour un autre format"""
+    digits = serial[len(SERIAL_PREFIX):] if serial and serial.startswith(SERIAL_PREFIX) else ''
+    return int(digits) if len(digits) == SERIAL_DIGITS and digits.isdigit() else None
+
+
+def format_serial(counter, key):
+    return f'{SERIAL_PREFIX}{permute(counter, key):0{SERIAL_DIGITS}d}'
+
+
+class SerialAllocator:
+    """
+    Distribue des numéros de série à partir de blocs de compteurs réservés en
+    base. Un bloc coûte une requête ``UPDATE`` pour ``block_size`` numéros ;
+    les blocs non consommés (arrêt du processus) sont simplement perdus.
+    """
+
+    # Écart maximal entre deux compteurs servis (blocs perdus aux arrêts de
+    # processus), en blocs, pour ``seed_value``
+    seed_gap_blocks = 10
+
+    def __init__(self, sequence='serial_number'):
+        self.sequence = sequence
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+        self._block = None
+
+    @property
+    def key(self):
+        return getattr(settings, 'WATCHES_SERIAL_KEY', 'garde-temps').encode()[:64]
+
+    @property
+    def block_size(self):
+        return getattr(settings, 'WATCHES_SERIAL_BLOCK_SIZE', 1000)
+
+    def seed_value(self):
+        """
+        Premier compteur libre d'après les numéros en base. Les compteurs
+        servis forment une suite depuis 0, avec des trous d'au plus quelques
+        blocs ; les anciens numéros aléatoires, épars, n'en font pas partie
+        (une collision avec l'un d'eux est rattrapée par ``with_serial_retry``).
+        """
+        Watch = apps.get_model('watches', 'Watch')
+        key = self.key
+        counters = sorted(
+            unpermute(value, key)
+            for value in map(parse_serial, Watch.objects.exclude(serial_number=None).values_list(
+                'serial_number', flat=True
+            ).iterator())
+            if value is not None
+        )
+        end, gap = 0, self.seed_gap_blocks * self.block_size
+        for counter in counters:
+            if counter > end + gap:
+                break
+            end = max(end, counter + 1)
+        return end
+
+    def _reserve(self, size):
+        """Réserve ``size`` compteurs et renvoie le premier"""
+        Sequence = apps.get_model('watches', 'Sequence')
+        with transaction.atomic():
+            # L'UPDATE prend le verrou d'écriture avant la lecture
+            if not Sequence.objects.filter(name=self.sequence).update(value=F('value') + size):
+                start = self.seed_value()
+                try:
+                    with transaction.atomic():
+                        Sequence.objects.create(name=self.sequence, value=start + size)
+                    return start
+                except IntegrityError:
+                    # Créée entre-temps par un autre processus
+                    Sequence.objects.filter(name=self.sequence).update(value=F('value') + size)
+            end = Sequence.objects.get(name=self.sequence).value
+        if end > SERIAL_SPACE:
+            raise RuntimeError("Espace des numéros de série épuisé")
+        return end - size
+
+    @staticmethod
+    def _savepoints():
+        """
+        Savepoints ouverts par ``atomic()`` sur la connexion courante (vide
+        hors transaction), ou ``None`` dans une transaction sans savepoint
+        identifiable. Leurs identifiants ne sont jamais réattribués par la
+        connexion : un bloc lié à l'un d'eux ne peut pas passer pour un bloc
+        d'une transaction suivante.
+        """
+        connection = transaction.get_connection()
+        if not connection.in_atomic_block:
+            return ()
+        savepoints = tuple(connection.savepoint_ids)
+        return savepoints if any(sid is not None for sid in savepoints) else None
+
+    def _track_block(self, savepoints):
+        """
+        Le bloc vient d'être réservé : il est valide une fois la transaction
+        de l'appelant validée (``on_commit``, immédiat hors transaction), et
+        d'ici là tant que les savepoints ``savepoints`` restent ouverts.
+        """
+        block = self._block = {'committed': False, 'savepoints': savepoints}
+
+        def committed():
+            block['committed'] = True
+        transaction.on_commit(committed)
+
+    def _block_is_valid(self):
+        block = self._block
+        if block is None or block['committed']:
+            return block is not None
+        # Transaction encore en cours : les savepoints de la réservation
+        # doivent être toujours ouverts (un savepoint relâché depuis fait
+        # abandonner le bloc, par prudence)
+        savepoints = block['savepoints']
+        return bool(savepoints) and self._savepoints()[:len(savepoints)] == savepoints
+
+    def allocate_many(self, count):
+        counters = []
+        with self._lock:
+            if self._next < self._end and not self._block_is_valid():
+                self._next = self._end = 0
+            while len(counters) < count:
+                if self._next >= self._end:
+                    savepoints = self._savepoints()
+                    size = count - len(counters)
+                    if savepoints is not None:
+                        size = max(self.block_size, size)
+                    self._next = self._reserve(size)
+                    self._end = self._next + size
+                    self._track_block(savepoints)
+                take = min(self._end - self._next, count - len(counters))
+                counters.extend(range(self._next, self._next + take))
+                self._next += take
+        key = self.key
+        return [format_serial(counter, key) for counter in counters]
+
+    def allocate(self):
+        return self.allocate_many(1)[0]
+
+    def reset(self):
+        """Oublie le bloc en cours (tests, changement de base, collision)"""
+        with self._lock:
+            self._next = self._end = 0
+            self._block = None
+
+
+serial_allocator = SerialAllocator()
+
+
+def assign_serial_numbers(watches):
+    """Attribue un nouveau numéro de série à chaque montre (utilisable avant ``bulk_create``)"""
+    for watch, serial in zip(watches, serial_allocator.allocate_many(len(watches))):
+        watch.serial_number = serial
+
+
+def _is_serial_collision(error, watches):
+    if 'serial_number' in str(error):
+        return True
+    # Message du moteur sans nom de colonne : on vérifie directement
+    Watch = apps.get_model('watches', 'Watch')
+    return Watch.objects.filter(serial_number__in=[w.serial_number for w in watches]).exists()
+
+
+def with_serial_retry(watches, write):
+    """
+    Attribue des numéros de série à ``watches`` puis exécute ``write()`` dans
+    un savepoint. En cas de collision sur ``serial_number``, les numéros sont
+    réattribués et l'écriture rejouée.
+    """
+    for attempt in range(1, SERIAL_MAX_ATTEMPTS + 1):
+        assign_serial_numbers(watches)
+        try:
+            with transaction.atomic():
+                return write()
+        except IntegrityError as error:
+            if attempt == SERIAL_MAX_ATTEMPTS or not _is_serial_collision(error, watches):
+                raise
+            # Bloc déjà servi (compteur remis à zéro, restauration...) : un neuf
+            serial_allocator.reset()
@@ -0,0 +1,100 @@
+"""Invalidation des caches du catalogue à chaque écriture, déclinaisons des images"""
+import logging
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import complication_masks, similar
+from .cache import bump_catalogue_version
+from .comparison import invalidate_comparisons
+from .images import generate_derivatives
+from .models import Brand, Complication, Watch
+from .pdf_cache import invalidate_pdfs
+from .representations import invalidate_representations
+
+
+logger = logging.getLogger(__name__)
+
+# Champ image décliné (images.py), par modèle
+IMAGE_FIELDS = {Watch: 'image', Brand: 'logo'}
+
+
+@receiver(post_save, sender=Watch)
+@receiver(post_delete, sender=Watch)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Complication)
+@receiver(post_delete, sender=Complication)
+def catalogue_changed(sender, **kwargs):
+    bump_catalogue_version()
+
+
+@receiver(post_save, sender=Watch)
+@receiver(post_delete, sender=Watch)
+def watch_changed(sender, instance, **kwargs):
+    invalidate_representations([instance.pk])
+    invalidate_pdfs([instance.pk])
+    similar.mark_changed([instance.pk])
+
+
+@receiver(m2m_changed, sender=Watch.complications.through)
+def watch_complications_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_catalogue_version()
+        invalidate_comparisons()
+        update_complication_masks(instance, action, reverse, pk_set)
+        if not reverse:
+            invalidate_pdfs([instance.pk])
+            similar.mark_changed([instance.pk])
+        elif pk_set:
+            invalidate_pdfs(pk_set)
+            similar.mark_changed(pk_set)
+        else:
+            # clear() depuis une complication : montres concernées inconnues
+            similar.reset()
+
+
+def update_complication_masks(instance, action, reverse, pk_set):
+    if not reverse:
+        # Montre gardée en mémoire à jour : un save() ultérieur n'écrase pas le masque
+        instance.complication_mask = complication_masks.refresh_masks([instance.pk])[instance.pk]
+    elif action == 'post_add':
+        complication_masks.set_bit(instance.bit, pk_set)
+    else:
+        complication_masks.clear_bit(instance.bit, pk_set)
+
+
+@receiver(post_delete, sender=Complication)
+def complication_deleted(sender, instance, **kwargs):
+    similar.reset()
+    # Liens supprimés en cascade, sans m2m_changed
+    complication_masks.clear_bit(instance.bit)
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Complication)
+@receiver(post_delete, sender=Complication)
+def comparison_data_changed(sender, **kwargs):
+    # Sans horodatage propre : les comparatifs ne le voient pas dans leur clé
+    invalidate_comparisons()
+
+
+@receiver(post_save, sender=Watch)
+@receiver(post_save, sender=Brand)
+def image_saved(sender, instance, update_fields=None, **kwargs):
+    field = IMAGE_FIELDS[sender]
+    if field in instance.get_deferred_fields() or (update_fields is not None and field not in update_fields):
+        return
+    image = getattr(instance, field)
+    loaded = getattr(instance, '_loaded_files', {})
+    # Image inchangée depuis la lecture (ou le dernier save()) : déjà déclinée
+    changed = field not in loaded or loaded[field] != (image.name or None)
+    loaded[field] = image.name or None
+    instance._loaded_files = loaded
+    if image and changed:
+        try:
+            generate_derivatives(image.name, image.storage)
+        except OSError:
+            # Rattrapé à la première demande ou par generate_derivatives
+            logger.exception("Déclinaisons impossibles pour %s", image.name)
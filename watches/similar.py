@@ -0,0 +1,326 @@
+"""
+Montres similaires (``/api/watches/<id>/similar/``), index en mémoire NumPy.
+
+Chaque montre est un point : prix (log), diamètre et étanchéité (log)
+centrés-réduits, plus mouvement, matériau et marque en one-hot et les
+complications en vecteur de bits. La distance est l'euclidienne pondérée
+(``FEATURE_WEIGHTS``) sur ces coordonnées.
+
+Les colonnes one-hot ne sont pas matérialisées : deux vecteurs one-hot
+diffèrent de 0 ou de 2 (au carré). Marque, mouvement et matériau sont
+réunis en un code entier par montre, et leur part de la distance est lue
+dans une table de pénalités calculée pour la montre demandée (une valeur par
+code) ; la distance entre deux vecteurs de bits est le nombre de bits de leur
+XOR. Par montre, l'index tient 3 flottants, un code et un mot de 64 bits par
+tranche de 64 complications, rangés en colonnes contiguës : une requête est
+une dizaine d'opérations vectorisées en place, puis un ``argpartition`` pour
+les k plus proches.
+
+L'index est construit au premier appel dans chaque processus. Les signaux
+de ``watches.signals`` y marquent les montres modifiées (champs,
+complications, suppression) ; elles sont relues avant la requête suivante.
+Les écritures faites par un autre processus sont détectées par la version du
+catalogue (``watches.cache``) : montres dont ``updated_at`` a changé depuis
+la dernière synchronisation, et reconstruction complète si le nombre de
+montres ne correspond plus. Sans cache partagé, cette synchronisation a lieu
+à chaque requête. NumPy n'est importé qu'à la construction.
+"""
+import math
+import threading
+
+from django.utils import timezone
+
+from .cache import catalogue_cache_is_shared, get_catalogue_version
+from .models import Watch
+
+
+# Poids de chaque groupe de coordonnées dans la distance
+FEATURE_WEIGHTS = {
+    'price': 2.0,
+    'case_diameter': 1.0,
+    'water_resistance': 0.5,
+    'movement_type': 1.0,
+    'case_material': 1.0,
+    'brand': 1.0,
+    'complications': 0.5,
+}
+
+NUMERIC_FIELDS = ['price', 'case_diameter', 'water_resistance']
+
+# Au-delà de cette part de montres relues une à une, reconstruction complète
+# (moyennes et écarts-types recalculés)
+REBUILD_RATIO = 0.2
+
+MOVEMENT_CODES = {code: i for i, (code, _) in enumerate(Watch.MOVEMENT_CHOICES)}
+MATERIAL_CODES = {code: i for i, (code, _) in enumerate(Watch.MATERIAL_CHOICES)}
+
+
+def _numeric(price, case_diameter, water_resistance):
+    return (math.log1p(float(price)), float(case_diameter), math.log1p(water_resistance))
+
+
+class SimilarityIndex:
+    """
+    Index construit à partir de lignes ``(pk, price, case_diameter,
+    water_resistance, movement_type, case_material, brand_id,
+    complication_ids)``. Non réentrant (tampons de calcul partagés) : les
+    appels sont sérialisés par ``_Engine``.
+    """
+
+    def __init__(self, rows):
+        import numpy as np
+        self.np = np
+        rows = list(rows)
+        n = len(rows)
+        pks, prices, diameters, water, movements, materials, brands, complications = (
+            zip(*rows) if rows else [()] * 8
+        )
+        self.brand_codes = {}
+        for brand_id in brands:
+            self.brand_codes.setdefault(brand_id, len(self.brand_codes))
+        self.complication_bits = {}
+        for ids in complications:
+            for complication in ids:
+                self.complication_bits.setdefault(complication, len(self.complication_bits))
+        self.words = max(1, math.ceil(len(self.complication_bits) / 64))
+
+        capacity = max(n, 16)
+        self.pks = np.zeros(capacity, dtype=np.int64)
+        self.numeric = np.zeros((3, capacity), dtype=np.float32)
+        self.category = np.zeros(capacity, dtype=np.int32)
+        self.bits = np.zeros((capacity, self.words), dtype=np.uint64)
+        self.valid = np.zeros(capacity, dtype=bool)
+        self.rows = {pk: row for row, pk in enumerate(pks)}
+        self.size = n
+
+        self.pks[:n] = pks
+        self.category[:n] = self._categories(
+            np.array([self.brand_codes[b] for b in brands], dtype=np.int32),
+            np.array([MOVEMENT_CODES.get(m, len(MOVEMENT_CODES)) for m in movements], dtype=np.int32),
+            np.array([MATERIAL_CODES.get(m, len(MATERIAL_CODES)) for m in materials], dtype=np.int32),
+        )
+        bit_rows = np.repeat(np.arange(n), [len(ids) for ids in complications])
+        bit_numbers = np.array(
+            [self.complication_bits[c] for ids in complications for c in ids], dtype=np.uint64
+        )
+        np.bitwise_or.at(
+            self.bits, (bit_rows, (bit_numbers // 64).astype(np.intp)), np.uint64(1) << (bit_numbers % 64)
+        )
+        self.valid[:n] = True
+
+        # Centrage-réduction des coordonnées numériques (écart-type nul : 1)
+        numeric = np.array([
+            np.log1p(np.asarray(prices, dtype=np.float64)),
+            np.asarray(diameters, dtype=np.float64),
+            np.log1p(np.asarray(water, dtype=np.float64)),
+        ]).reshape(3, n)
+        self.mean = numeric.mean(axis=1) if n else np.zeros(3)
+        std = numeric.std(axis=1) if n else np.ones(3)
+        self.scale = np.array([math.sqrt(FEATURE_WEIGHTS[field]) for field in NUMERIC_FIELDS]) / np.where(
+            std > 0, std, 1
+        )
+        self.numeric[:, :n] = (numeric - self.mean[:, None]) * self.scale[:, None]
+        self._allocate_buffers(capacity)
+        self.updates = 0
+
+    @staticmethod
+    def _categories(brand, movement, material):
+        """Code unique marque × mouvement × matériau (la marque en poids fort)"""
+        return (brand * (len(MOVEMENT_CODES) + 1) + movement) * (len(MATERIAL_CODES) + 1) + material
+
+    def _allocate_buffers(self, capacity):
+        np = self.np
+        self.distance_buffer = np.empty(capacity, dtype=np.float32)
+        self.scratch = np.empty(capacity, dtype=np.float32)
+        self.xor_buffer = np.empty((capacity, self.words), dtype=np.uint64)
+        self.count_buffer = np.empty((capacity, self.words), dtype=np.uint8)
+
+    def _row_for(self, pk):
+        row = self.rows.get(pk)
+        if row is not None:
+            return row
+        if self.size == len(self.pks):
+            self._grow()
+        row = self.rows[pk] = self.size
+        self.size += 1
+        return row
+
+    def _grow(self):
+        np = self.np
+        capacity = len(self.pks) * 2
+        for name in ['pks', 'category', 'bits', 'valid']:
+            array = getattr(self, name)
+            grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:len(array)] = array
+            setattr(self, name, grown)
+        numeric = np.zeros((3, capacity), dtype=np.float32)
+        numeric[:, :self.numeric.shape[1]] = self.numeric
+        self.numeric = numeric
+        self._allocate_buffers(capacity)
+
+    def _write(self, row, values):
+        pk, price, case_diameter, water_resistance, movement, material, brand_id, complications = values
+        numeric = self.np.array(_numeric(price, case_diameter, water_resistance))
+        self.pks[row] = pk
+        self.numeric[:, row] = (numeric - self.mean) * self.scale
+        self.category[row] = self._categories(
+            self.brand_codes.setdefault(brand_id, len(self.brand_codes)),
+            MOVEMENT_CODES.get(movement, len(MOVEMENT_CODES)),
+            MATERIAL_CODES.get(material, len(MATERIAL_CODES)),
+        )
+        self.bits[row] = 0
+        for complication in complications:
+            bit = self.complication_bits.get(complication)
+            if bit is None:
+                return False  # complication inconnue de l'index : reconstruction
+            self.bits[row, bit // 64] |= self.np.uint64(1 << (bit % 64))
+        self.valid[row] = True
+        return True
+
+    def update(self, values):
+        """Ajoute ou remplace une montre ; ``False`` si l'index doit être reconstruit"""
+        self.updates += 1
+        return self._write(self._row_for(values[0]), values)
+
+    def remove(self, pk):
+        row = self.rows.get(pk)
+        if row is not None:
+            self.valid[row] = False
+            self.updates += 1
+
+    def __contains__(self, pk):
+        row = self.rows.get(pk)
+        return row is not None and bool(self.valid[row])
+
+    def __len__(self):
+        return int(self.valid[:self.size].sum())
+
+    def _category_penalties(self, code):
+        """Part de la distance due à la marque, au mouvement et au matériau, par code de catégorie"""
+        np = self.np
+        movements, materials = len(MOVEMENT_CODES) + 1, len(MATERIAL_CODES) + 1
+        brand, rest = divmod(int(code), movements * materials)
+        movement, material = divmod(rest, materials)
+        # Deux one-hot différents : deux coordonnées à 1 d'écart
+        return (
+            (np.arange(len(self.brand_codes)) != brand)[:, None, None] * (2 * FEATURE_WEIGHTS['brand'])
+            + (np.arange(movements) != movement)[None, :, None] * (2 * FEATURE_WEIGHTS['movement_type'])
+            + (np.arange(materials) != material)[None, None, :] * (2 * FEATURE_WEIGHTS['case_material'])
+        ).astype(np.float32).ravel()
+
+    def distances(self, pk):
+        """Distances (au carré) de toutes les lignes à la montre ``pk``"""
+        np = self.np
+        n, q = self.size, self.rows[pk]
+        distance, scratch = self.distance_buffer[:n], self.scratch[:n]
+        # Opérations en place sur des colonnes contiguës : aucun tableau temporaire
+        for column in range(3):
+            np.subtract(self.numeric[column, :n], self.numeric[column, q], out=scratch)
+            np.multiply(scratch, scratch, out=scratch)
+            if column:
+                np.add(distance, scratch, out=distance)
+            else:
+                distance[:] = scratch
+        np.take(self._category_penalties(self.category[q]), self.category[:n], out=scratch)
+        np.add(distance, scratch, out=distance)
+
+        counts = np.bitwise_count(
+            np.bitwise_xor(self.bits[:n], self.bits[q], out=self.xor_buffer[:n]), out=self.count_buffer[:n]
+        )
+        counts = counts[:, 0] if self.words == 1 else counts.sum(axis=1)
+        weights = np.arange(64 * self.words + 1, dtype=np.float32) * np.float32(FEATURE_WEIGHTS['complications'])
+        np.take(weights, counts, out=scratch)
+        np.add(distance, scratch, out=distance)
+
+        distance[~self.valid[:n]] = np.inf
+        distance[q] = np.inf
+        return distance
+
+    def nearest(self, pk, k):
+        """Identifiants des ``k`` montres les plus proches de ``pk``, de la plus proche à la moins proche"""
+        np = self.np
+        distance = self.distances(pk)
+        k = min(k, len(self) - 1)
+        if k <= 0:
+            return []
+        candidates = np.argpartition(distance, k - 1)[:k]
+        candidates = candidates[np.argsort(distance[candidates], kind='stable')]
+        return [int(p) for p in self.pks[candidates]]
+
+
+def watch_rows(queryset):
+    """Lignes d'index des montres de ``queryset`` (deux requêtes)"""
+    complications = {}
+    through = Watch.complications.through.objects.filter(watch__in=queryset.values('pk'))
+    for watch_id, complication_id in through.values_list('watch_id', 'complication_id').iterator(chunk_size=10000):
+        complications.setdefault(watch_id, []).append(complication_id)
+    fields = ['pk', 'price', 'case_diameter', 'water_resistance', 'movement_type', 'case_material', 'brand_id']
+    for row in queryset.order_by().values_list(*fields).iterator(chunk_size=10000):
+        yield (*row, complications.get(row[0], ()))
+
+
+class _Engine:
+    """Index du processus, synchronisé avec la base avant chaque requête"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = None
+        self.version = None
+        self.synced_at = None
+        self.changed = set()
+
+    def mark_changed(self, pks):
+        with self.lock:
+            self.changed.update(pks)
+
+    def reset(self):
+        with self.lock:
+            self.index = None
+
+    def _rebuild(self):
+        self.synced_at = timezone.now()
+        self.index = SimilarityIndex(watch_rows(Watch.objects.all()))
+        self.changed.clear()
+
+    def nearest(self, pk, k):
+        # Sous le verrou : une synchronisation ne modifie pas l'index pendant une requête
+        with self.lock:
+            version = get_catalogue_version()
+            if self.index is None:
+                self.version = version
+                self._rebuild()
+            elif version != self.version or self.changed or not catalogue_cache_is_shared():
+                self.version = version
+                self._refresh()
+            return self.index.nearest(pk, k) if pk in self.index else None
+
+    def _refresh(self):
+        since, self.synced_at = self.synced_at, timezone.now()
+        changed = self.changed | set(Watch.objects.filter(updated_at__gte=since).values_list('pk', flat=True))
+        self.changed = set()
+        rows = {row[0]: row for row in watch_rows(Watch.objects.filter(pk__in=changed))}
+        for pk in changed:
+            if pk in rows:
+                if not self.index.update(rows[pk]):
+                    return self._rebuild()
+            else:
+                self.index.remove(pk)
+        if self.index.updates > REBUILD_RATIO * max(len(self.index), 1) or Watch.objects.count() != len(self.index):
+            self._rebuild()
+
+
+engine = _Engine()
+
+
+def mark_changed(pks):
+    engine.mark_changed(pks)
+
+
+def reset():
+    """Reconstruction complète au prochain appel (complication supprimée par exemple)"""
+    engine.reset()
+
+
+def similar_watch_ids(pk, k):
+    """Identifiants des ``k`` montres les plus proches de ``pk`` ; ``None`` si elle n'existe pas"""
+    return engine.nearest(pk, k)
@@ -0,0 +1,71 @@
+"""
+Statistiques agrégées du catalogue.
+
+Tout est calculé par la base (``GROUP BY`` et agrégats) ; les percentiles de
+prix sont lus par rang sur la colonne triée, sans charger les lignes en
+Python. Le résultat est mis en cache jusqu'à la prochaine écriture (voir
+``watches.cache``) et sert à la fois l'API ``/api/stats/`` et les
+graphiques de l'admin.
+"""
+import math
+
+from django.db.models import Avg, Count, Max, Min
+
+from .cache import cached_for_version
+from .models import Brand, Complication, Watch
+
+
+PRICE_PERCENTILES = [10, 25, 50, 75, 90]
+
+
+def _choice_counts(field, choices):
+    counts = dict(
+        Watch.objects.order_by().values_list(field).annotate(count=Count('id'))
+    )
+    return [
+        {'code': code, 'label': label, 'count': counts.get(code, 0)}
+        for code, label in choices
+    ]
+
+
+def _price_percentiles(total):
+    """Percentiles (méthode du rang le plus proche), une requête indexée chacun"""
+    prices = Watch.objects.order_by('price').values_list('price', flat=True)
+    return {
+        f'p{p}': prices[max(math.ceil(p / 100 * total) - 1, 0)]
+        for p in PRICE_PERCENTILES
+    } if total else {f'p{p}': None for p in PRICE_PERCENTILES}
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+def compute_catalogue_stats():
+    price = Watch.objects.order_by().aggregate(
+        count=Count('id'), min=Min('price'), avg=Avg('price'), max=Max('price')
+    )
+    brands = Brand.objects.order_by('name').annotate(
+        count=Count('watches'), avg_price=Avg('watches__price')
+    ).values('id', 'name', 'count', 'avg_price')
+    complications = Complication.objects.order_by('name').annotate(
+        count=Count('watches')
+    ).values('id', 'name', 'count')
+
+    return {
+        'total': price['count'],
+        'movements': _choice_counts('movement_type', Watch.MOVEMENT_CHOICES),
+        'materials': _choice_counts('case_material', Watch.MATERIAL_CHOICES),
+        'brands': [{**brand, 'avg_price': _round(brand['avg_price'])} for brand in brands],
+        'complications': list(complications),
+        'price': {
+            'min': price['min'],
+            'avg': _round(price['avg']),
+            'max': price['max'],
+            'percentiles': _price_percentiles(price['count']),
+        },
+    }
+
+
+def get_catalogue_stats():
+    return cached_for_version('stats', compute_catalogue_stats)
@@ -1,3 +1,1283 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from io import BytesIO, StringIO
+from itertools import product
+from multiprocessing import get_context
+from unittest import mock
 
-# Create your tests here.
+import django
+from PIL import Image
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.core.serializers import serialize
+from django.db import DatabaseError, transaction
+from django.http import StreamingHttpResponse
+from django.test import AsyncClient, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.utils.urls import remove_query_param
+
+from . import pdf_cache, similar
+from .admin import WatchAdmin
+from .cache import bump_catalogue_version, cached_for_version
+from .checks import check_catalogue_cache
+from .complication_masks import clear_bit, mask_of, refresh_masks, set_bit
+from .dump import dump_database
+from .filters import WatchFilter
+from .images import DERIVATIVE_WIDTHS, derivative_name
+from .models import Brand, Complication, ExportJob, Sequence, Watch
+from .rendering import HEAVY_MODULES
+from .pdf import FICHE_NUMBERED, render_fiche
+from .pdf_cache import cached_pdf, evict, get_pdf_cache_dir
+from .pdf_stream import stream_pdf, stream_pdf_parallel
+from .representations import get_representation_cache
+from .serials import SerialAllocator, format_serial, parse_serial, serial_allocator, unpermute
+from .serializers import WatchDetailSerializer, WatchListSerializer
+from .stats import PRICE_PERCENTILES
+from .views import WatchViewSet
+
+
+def create_catalogue(watch_count, brand_count=3, complication_count=4):
+    """Crée un petit catalogue de test"""
+    brands = [
+        Brand.objects.create(name=f"Marque {i}", country="Suisse", founded_year=1900 + i)
+        for i in range(brand_count)
+    ]
+    complications = [
+        Complication.objects.create(name=f"Complication {i}", description="Test")
+        for i in range(complication_count)
+    ]
+    watches = []
+    for i in range(watch_count):
+        watch = Watch.objects.create(
+            model_name=f"Modèle {i}",
+            reference_number=f"REF-{i:05d}",
+            price=1000 + i,
+            case_diameter=36 + i % 10,
+            movement_type=Watch.MOVEMENT_CHOICES[i % 4][0],
+            case_material=Watch.MATERIAL_CHOICES[i % 6][0],
+            water_resistance=[30, 50, 100, 300][i % 4],
+            description="Montre de test",
+            brand=brands[i % brand_count],
+        )
+        watch.complications.set(complications[:i % (complication_count + 1)])
+        watches.append(watch)
+    return brands, complications, watches
+
+
+class ListQueryCountTests(TestCase):
+    """Le nombre de requêtes d'une page de liste ne dépend pas du nombre de lignes"""
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def assertListQueries(self, url, expected):
+        with self.assertNumQueries(expected):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_watch_list(self):
+        create_catalogue(20)
+        data = self.assertListQueries('/api/watches/', 2)  # COUNT + page
+        self.assertEqual(len(data['results']), 12)
+        counts = {w['id']: w['complication_count'] for w in data['results']}
+        for watch in Watch.objects.filter(id__in=counts):
+            self.assertEqual(counts[watch.id], watch.complications.count())
+
+    def test_brand_list(self):
+        brands, _, _ = create_catalogue(20, brand_count=15)
+        data = self.assertListQueries('/api/brands/', 2)
+        self.assertEqual(len(data['results']), 12)
+        for item in data['results']:
+            self.assertEqual(item['watch_count'], Watch.objects.filter(brand_id=item['id']).count())
+
+    def test_complication_list(self):
+        create_catalogue(20, complication_count=14)
+        data = self.assertListQueries('/api/complications/', 2)
+        self.assertEqual(len(data['results']), 12)
+        for item in data['results']:
+            complication = Complication.objects.get(pk=item['id'])
+            self.assertEqual(item['watch_count'], complication.watches.count())
+
+    def test_watch_detail(self):
+        _, _, watches = create_catalogue(5)
+        with self.assertNumQueries(3):  # montre + complications + nombre de montres de la marque
+            response = self.client.get(f'/api/watches/{watches[3].id}/')
+        data = response.json()
+        self.assertEqual(len(data['complications']), 3)
+        self.assertEqual(data['brand_obj']['watch_count'], 2)
+
+
+class WatchSearchTests(TestCase):
+    """Recherche plein texte (index FTS5 tenu à jour par triggers)"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.brand = Brand.objects.create(name="Patek Philippe", country="Suisse", founded_year=1839)
+        self.other = Brand.objects.create(name="Seiko", country="Japon", founded_year=1881)
+        self.nautilus = Watch.objects.create(
+            model_name="Nautilus", reference_number="PP-5711-AA", price=30000,
+            case_diameter=40, movement_type='AUTO', case_material='STEEL',
+            water_resistance=120, description="Boîtier en céramique", brand=self.brand,
+        )
+        self.presage = Watch.objects.create(
+            model_name="Presage", reference_number="SK-0001-BB", price=500,
+            case_diameter=40, movement_type='AUTO', case_material='STEEL',
+            water_resistance=50, description="Inspirée du Nautilus", brand=self.other,
+        )
+
+    def search(self, term, **params):
+        response = self.client.get('/api/watches/', {'search': term, **params})
+        return [w['id'] for w in response.json()['results']]
+
+    def test_ranks_model_name_before_description(self):
+        self.assertEqual(self.search('nautil'), [self.nautilus.id, self.presage.id])
+
+    def test_matches_brand_reference_and_accents(self):
+        self.assertEqual(self.search('patek'), [self.nautilus.id])
+        self.assertEqual(self.search('PP-5711'), [self.nautilus.id])
+        self.assertEqual(self.search('ceramique'), [self.nautilus.id])
+
+    def test_index_follows_updates(self):
+        self.other.name = "Grand Seiko"
+        self.other.save()
+        self.assertEqual(self.search('grand'), [self.presage.id])
+        self.presage.delete()
+        self.assertEqual(self.search('nautilus'), [self.nautilus.id])
+
+    def test_explicit_ordering_wins(self):
+        self.assertEqual(self.search('nautilus', ordering='price'), [self.presage.id, self.nautilus.id])
+
+    def test_index_is_matched_once_per_query(self):
+        # Pas de sous-requête corrélée : MATCH et bm25() ne sont pas réévalués pour chaque montre
+        factory = APIRequestFactory()
+        for params in [{'search': 'nautil'}, {'search': 'nautil', 'ordering': 'price'}]:
+            with self.subTest(**params):
+                request = Request(factory.get('/api/watches/', params))
+                view = WatchViewSet(action='list', request=request, format_kwarg=None, kwargs={})
+                queryset = view.filter_queryset(view.get_queryset())
+                plan = queryset[:12].explain()
+                nodes = {node: (parent, detail) for node, parent, _, detail in
+                         (line.split(' ', 3) for line in plan.splitlines())}
+                fts = [parent for parent, detail in nodes.values() if 'watches_watch_fts' in detail]
+                self.assertEqual(len(fts), 1, plan)
+                self.assertNotIn('CORRELATED', nodes.get(fts[0], ('', ''))[1], plan)
+                with self.assertNumQueries(1):
+                    self.assertEqual(len(queryset[:12]), 2)
+
+
+class SerialNumberTests(TestCase):
+    """Numéros de série réservés par blocs et permutés"""
+
+    def setUp(self):
+        serial_allocator.reset()
+        self.brand = Brand.objects.create(name="Omega", country="Suisse", founded_year=1848)
+
+    def create_watch(self, ref, **fields):
+        return Watch.objects.create(
+            model_name="Speedmaster", reference_number=ref, price=5000, case_diameter=42,
+            movement_type='MANUAL', case_material='STEEL', water_resistance=50,
+            description="Moonwatch", brand=self.brand, **fields,
+        )
+
+    def test_permutation_is_a_bijection_on_a_sample(self):
+        serials = {format_serial(counter, b'key') for counter in range(20000)}
+        self.assertEqual(len(serials), 20000)
+        self.assertTrue(all(len(serial) == 11 for serial in serials))
+
+    def test_no_probe_query_per_insert(self):
+        self.create_watch("REF-0")  # réserve le premier bloc
+        with self.assertNumQueries(3):  # SAVEPOINT + INSERT + RELEASE
+            self.create_watch("REF-1")
+
+    def test_collision_with_legacy_serial_is_retried(self):
+        legacy = format_serial(0, serial_allocator.key)
+        self.create_watch("REF-LEGACY", serial_number=legacy)
+        Sequence.objects.create(name='serial_number', value=0)
+        watch = self.create_watch("REF-NEW")
+        self.assertNotEqual(watch.serial_number, legacy)
+        # Bloc abandonné à la collision : le suivant commence après lui
+        self.assertEqual(watch.serial_number, format_serial(serial_allocator.block_size, serial_allocator.key))
+
+    @override_settings(WATCHES_SERIAL_BLOCK_SIZE=5)
+    def test_restored_database_with_reset_sequence(self):
+        for i in range(12):
+            self.create_watch(f"REF-{i}")
+        # Base restaurée : compteur revenu à zéro, puis ligne absente
+        Sequence.objects.update(value=0)
+        serial_allocator.reset()
+        self.create_watch("REF-RESET")
+        Sequence.objects.all().delete()
+        serial_allocator.reset()
+        watch = self.create_watch("REF-SEEDED")
+        self.assertEqual(watch.serial_number, format_serial(16, serial_allocator.key))
+        self.assertEqual(Watch.objects.count(), 14)
+
+    def test_block_dropped_when_outer_transaction_rolls_back(self):
+        self.create_watch("REF-0")
+        Sequence.objects.all().delete()
+        serial_allocator.reset()
+        try:
+            with transaction.atomic():
+                self.create_watch("REF-1")
+                raise DatabaseError
+        except DatabaseError:
+            pass
+        # Réservation annulée avec la transaction : le bloc n'est plus servi
+        serial = serial_allocator.allocate()
+        counter = unpermute(parse_serial(serial), serial_allocator.key)
+        self.assertLess(counter, Sequence.objects.get(name='serial_number').value)
+
+    def test_no_spare_block_without_savepoint(self):
+        self.create_watch("REF-0")
+        start = Sequence.objects.get(name='serial_number').value
+        serial_allocator.reset()
+        # Transaction la plus externe, sans savepoint : rien ne distinguerait
+        # le bloc d'une transaction suivante, seuls les numéros demandés sont réservés
+        with mock.patch.object(SerialAllocator, '_savepoints', return_value=None):
+            serials = serial_allocator.allocate_many(3)
+        self.assertEqual(Sequence.objects.get(name='serial_number').value, start + 3)
+        self.assertEqual(serials, [format_serial(start + i, serial_allocator.key) for i in range(3)])
+
+
+class CursorPaginationTests(TestCase):
+    """Pagination par clé sur chaque champ de tri, avec départage sur l'id"""
+
+    def setUp(self):
+        self.client = APIClient()
+        create_catalogue(30)
+
+    def walk(self, url, key):
+        pages = []
+        while url:
+            with self.assertNumQueries(1):
+                data = self.client.get(url).json()
+            pages.append([w['id'] for w in data['results']])
+            url = data[key]
+        return pages
+
+    def test_every_ordering_walks_forward_and_back(self):
+        for ordering in ['price', '-price', 'case_diameter', '-case_diameter',
+                         'created_at', '-created_at', 'model_name', '-model_name']:
+            with self.subTest(ordering=ordering):
+                expected = list(
+                    Watch.objects.order_by(ordering, ('-' if ordering[0] == '-' else '') + 'id')
+                    .values_list('id', flat=True)
+                )
+                forward = self.walk(f'/api/watches/?pagination=cursor&page_size=7&ordering={ordering}', 'next')
+                self.assertEqual(sum(forward, []), expected)
+                self.assertEqual([len(page) for page in forward], [7, 7, 7, 7, 2])
+
+                last = self.client.get(
+                    f'/api/watches/?pagination=cursor&page_size=7&ordering={ordering}'
+                ).json()
+                while last['next']:
+                    last = self.client.get(last['next']).json()
+                backward = self.walk(last['previous'], 'previous')
+                self.assertEqual(sum(reversed(backward), []), expected[:28])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/watches/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_size_capped_in_both_modes(self):
+        watch = Watch.objects.first()
+        Watch.objects.bulk_create([
+            Watch(model_name=f"Copie {i}", reference_number=f"COPIE-{i}", price=watch.price,
+                  case_diameter=watch.case_diameter, movement_type=watch.movement_type,
+                  case_material=watch.case_material, water_resistance=watch.water_resistance,
+                  brand=watch.brand)
+            for i in range(80)
+        ])
+        for url in ['/api/watches/?page_size=1000', '/api/watches/?pagination=cursor&page_size=1000']:
+            with self.subTest(url=url):
+                self.assertEqual(len(self.client.get(url).json()['results']), 100)
+                self.assertEqual(len(self.client.get(url + '&fast=1').json()['results']), 100)
+
+
+class QueryPlanTests(TestCase):
+    """
+    Chaque combinaison courante filtre/tri de ``WatchViewSet`` doit passer par
+    un index : on refuse un parcours complet de la table suivi d'un tri en
+    B-tree temporaire.
+    """
+    FILTERS = [
+        {},
+        {'movement_type': 'AUTO'},
+        {'case_material': 'GOLD'},
+        {'brand': 1},
+        {'brand__country': 'Suisse'},
+        {'complications': 1},
+        {'price__gte': 1005},
+        {'price__lte': 1005},
+        {'case_diameter__gte': 40},
+        {'case_diameter__lte': 40},
+        {'water_resistance__gte': 100},
+        {'water_resistance__lte': 100},
+        {'movement_type': 'AUTO', 'price__lte': 1010},
+        {'case_material': 'STEEL', 'case_diameter__lte': 42},
+        {'brand': 1, 'water_resistance__gte': 100},
+    ]
+    ORDERINGS = [None, 'price', '-price', 'case_diameter', '-case_diameter',
+                 'created_at', '-created_at', 'model_name', '-model_name']
+    FULL_SCAN = re.compile(r'SCAN watches_watch(?!\w)(?! USING)')
+
+    def test_filter_and_ordering_paths_use_indexes(self):
+        create_catalogue(30)
+        factory = APIRequestFactory()
+        for filters, ordering in product(self.FILTERS, self.ORDERINGS):
+            params = dict(filters, **({'ordering': ordering} if ordering else {}))
+            with self.subTest(**params):
+                request = Request(factory.get('/api/watches/', params))
+                view = WatchViewSet(action='list', request=request, format_kwarg=None, kwargs={})
+                plan = view.filter_queryset(view.get_queryset())[:12].explain()
+                self.assertFalse(
+                    self.FULL_SCAN.search(plan) and 'USE TEMP B-TREE FOR ORDER BY' in plan,
+                    plan,
+                )
+
+
+class ConditionalGetTests(TestCase):
+    """304 tant que le catalogue n'a pas changé"""
+
+    def setUp(self):
+        self.client = APIClient()
+        _, _, self.watches = create_catalogue(3)
+
+    def test_not_modified_until_a_write(self):
+        for url in ['/api/watches/', f'/api/watches/{self.watches[0].id}/', '/api/brands/', '/api/complications/']:
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with self.assertNumQueries(0):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+
+                self.watches[1].price = 1
+                self.watches[1].save()
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_query(self):
+        first = self.client.get('/api/watches/?ordering=price')['ETag']
+        response = self.client.get('/api/watches/?ordering=-price', HTTP_IF_NONE_MATCH=first)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(WATCHES_SINGLE_PROCESS=False)
+    def test_process_local_cache_is_flagged_and_not_trusted(self):
+        self.assertEqual([error.id for error in check_catalogue_cache(None)], ['watches.W001'])
+        response = self.client.get('/api/watches/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        # Facettes et bits des complications relus à chaque appel
+        build = mock.Mock(return_value={})
+        self.assertEqual(cached_for_version('facets:test', build), {})
+        cached_for_version('facets:test', build)
+        self.assertEqual(build.call_count, 2)
+
+        shared = dict(settings.CACHES, default={
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tempfile.mkdtemp(),
+        })
+        with override_settings(CACHES=shared):
+            self.assertEqual(check_catalogue_cache(None), [])
+            etag = self.client.get('/api/watches/')['ETag']
+            self.assertEqual(self.client.get('/api/watches/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class RepresentationCacheTests(TestCase):
+    """Pages assemblées depuis les fragments en cache"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.brands, _, self.watches = create_catalogue(5)
+        Watch.objects.filter(pk=self.watches[3].pk).update(image='watches/test.jpg')
+        get_representation_cache().clear()
+
+    def test_cached_page_matches_fresh_serialization(self):
+        for url in ['/api/watches/', f'/api/watches/{self.watches[3].id}/']:
+            with self.subTest(url=url):
+                fresh = self.client.get(url).json()
+                with mock.patch.object(WatchListSerializer, 'get_image_url') as list_url, \
+                        mock.patch.object(WatchDetailSerializer, 'get_image_url') as detail_url:
+                    cached = self.client.get(url).json()
+                list_url.assert_not_called()
+                detail_url.assert_not_called()
+                self.assertEqual(cached, fresh)
+                self.assertIn('http://testserver/', str(cached))
+
+    def test_writes_reach_cached_pages(self):
+        self.client.get('/api/watches/')
+        self.brands[0].name = "Nouvelle marque"
+        self.brands[0].save()
+        watch = self.watches[-1]
+        watch.model_name = "Renommée"
+        watch.save()
+        item = self.client.get('/api/watches/').json()['results'][0]
+        self.assertEqual(item['id'], watch.id)
+        self.assertEqual(item['model_name'], "Renommée")
+        self.assertEqual(item['brand_name'], watch.brand.name)
+
+    def test_mask_updates_reach_cached_details(self):
+        # update() ne touche pas updated_at (auto_now) : les masques l'écrivent eux-mêmes
+        watch = self.watches[2]
+        url = f'/api/watches/{watch.id}/'
+        stamp = self.client.get(url).json()['updated_at']
+        for write in [lambda: set_bit(5, [watch.id]), lambda: clear_bit(5), lambda: refresh_masks([watch.id])]:
+            write()
+            fresh = self.client.get(url).json()['updated_at']
+            self.assertNotEqual(fresh, stamp)
+            stamp = fresh
+
+
+class FastListTests(TestCase):
+    """``?fast=1`` renvoie exactement le JSON du serializer"""
+
+    def setUp(self):
+        self.client = APIClient()
+        _, _, watches = create_catalogue(15)
+        Watch.objects.filter(pk=watches[2].pk).update(image='watches/test.jpg')
+
+    def test_same_json_as_serializer(self):
+        for params in [{}, {'page': 2}, {'ordering': 'price', 'page_size': 100},
+                       {'movement_type': 'AUTO'}, {'search': 'modèle'},
+                       {'pagination': 'cursor', 'ordering': '-case_diameter', 'page_size': 4}]:
+            with self.subTest(**params):
+                expected = self.client.get('/api/watches/', params).json()
+                with self.assertNumQueries(1 if 'pagination' in params else 2):
+                    fast = self.client.get('/api/watches/', dict(params, fast=1)).json()
+                for key in ('next', 'previous'):
+                    if fast.get(key):
+                        fast[key] = remove_query_param(fast[key], 'fast')
+                self.assertEqual(fast, expected)
+
+
+class BulkTests(TestCase):
+    """``/api/watches/bulk/`` : montres demandées, dans l'ordre demandé, en une requête"""
+
+    def setUp(self):
+        self.client = APIClient()
+        _, _, watches = create_catalogue(6)
+        self.ids = [watch.id for watch in watches]
+
+    def test_get_and_post_keep_requested_order(self):
+        ids = [self.ids[4], self.ids[0], self.ids[2]]
+        listed = {watch['id']: watch for watch in self.client.get('/api/watches/').json()['results']}
+        expected = [listed[pk] for pk in ids]
+        for method, data in [('get', {'ids': ','.join(map(str, ids))}), ('post', {'ids': ids})]:
+            with self.subTest(method=method):
+                with self.assertNumQueries(1):
+                    response = getattr(self.client, method)('/api/watches/bulk/', data, format='json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), {'results': expected, 'missing': []})
+
+    def test_missing_and_duplicate_ids(self):
+        response = self.client.get('/api/watches/bulk/', {'ids': f'999999,{self.ids[1]},{self.ids[1]},999998'})
+        data = response.json()
+        self.assertEqual([watch['id'] for watch in data['results']], [self.ids[1]])
+        self.assertEqual(data['missing'], [999999, 999998])
+
+    def test_cap_and_invalid_ids(self):
+        cap = WatchViewSet.bulk_max_ids
+        self.assertEqual(self.client.post('/api/watches/bulk/', {'ids': list(range(1, cap + 1))},
+                                          format='json').status_code, 200)
+        for data in [{'ids': list(range(1, cap + 2))}, {'ids': 'abc'}, {'ids': [1, None]},
+                     {'ids': [1, 'x']}, {'ids': []}, {}]:
+            with self.subTest(**data):
+                response = self.client.post('/api/watches/bulk/', data, format='json')
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/api/watches/bulk/?ids=1,deux').status_code, 400)
+
+
+class AsyncViewTests(TestCase):
+    """Les vues asynchrones renvoient le JSON des endpoints DRF"""
+
+    def setUp(self):
+        self.client = APIClient()
+        _, self.complications, self.watches = create_catalogue(15, brand_count=14)
+
+    async def test_same_json_as_sync_endpoints(self):
+        client = AsyncClient()
+        cases = [
+            ('watches/', {}), ('watches/', {'page': 2}), ('watches/', {'page': 9}),
+            ('watches/', {'ordering': 'price,model_name', 'page_size': 5, 'case_material': 'GOLD'}),
+            ('watches/', {'search': 'modèle', 'page': 2}), ('watches/', {'price__gte': 'abc'}),
+            ('watches/', {'search': 'modele 1'}), ('watches/', {'search': 'ref', 'ordering': '-price'}),
+            ('watches/', {'complications__all': f'{self.complications[0].id},{self.complications[1].id}'}),
+            ('watches/', {'complications__none': self.complications[0].id, 'page_size': 20}),
+            ('watches/', {'brand': 999999}), ('watches/', {'brand': self.watches[0].brand_id}),
+            ('watches/', {'brand__country__icontains': 'sui', 'price__lte': 1005}),
+            (f'watches/{self.watches[3].id}/', {}), ('watches/999999/', {}),
+            ('brands/', {}), ('brands/', {'search': 'marque 1', 'ordering': '-founded_year'}),
+            ('complications/', {}),
+        ]
+        for path, params in cases:
+            with self.subTest(path=path, **params):
+                expected = await sync_to_async(self.client.get)(f'/api/{path}', params)
+                response = await client.get(f'/api/async/{path}', params)
+                self.assertEqual(response.status_code, expected.status_code)
+                data = response.json()
+                for key in ('next', 'previous'):
+                    if isinstance(data, dict) and data.get(key):
+                        data[key] = data[key].replace('/api/async/', '/api/')
+                self.assertEqual(data, expected.json())
+
+    async def test_search_and_detail_served_asynchronously(self):
+        # Ni viewset synchrone pour la recherche, ni sérialisation synchrone du détail
+        client = AsyncClient()
+        with mock.patch('watches.async_views.sync_watch_list', side_effect=AssertionError), \
+                mock.patch.object(WatchDetailSerializer, 'represent_many', side_effect=AssertionError):
+            response = await client.get('/api/async/watches/', {'search': 'modele 1'})
+            self.assertEqual(response.json()['count'], 6)
+            for _ in range(2):
+                response = await client.get(f'/api/async/watches/{self.watches[3].id}/')
+                self.assertEqual(response.json()['model_name'], 'Modèle 3')
+
+    async def test_cache_read_through_async_api(self):
+        # API synchrone du cache interdite dans la boucle d'événements
+        with mock.patch('watches.conditional.get_catalogue_version', side_effect=AssertionError), \
+                mock.patch('watches.conditional.get_catalogue_last_modified', side_effect=AssertionError):
+            client = AsyncClient()
+            for path in ['watches/', f'watches/{self.watches[3].id}/', 'brands/']:
+                with self.subTest(path=path):
+                    response = await client.get(f'/api/async/{path}')
+                    self.assertEqual(response.status_code, 200)
+                    response = await client.get(f'/api/async/{path}', headers={'If-None-Match': response['ETag']})
+                    self.assertEqual(response.status_code, 304)
+
+
+@override_settings(WATCHES_EXPORT_WORKERS=0, WATCHES_EXPORT_QUEUE_THRESHOLD=3, MEDIA_ROOT=tempfile.mkdtemp())
+class ExportJobTests(TestCase):
+    """Exports volumineux rendus hors requête, puis téléchargés"""
+
+    def setUp(self):
+        self.client = APIClient()
+        _, _, watches = create_catalogue(5)
+        self.ids = [watch.id for watch in watches]
+
+    def test_small_export_stays_synchronous(self):
+        response = self.client.post('/api/watches/export-wishlist/', {'watch_ids': self.ids[:3]}, format='json')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+    def test_large_export_is_queued_then_downloaded(self):
+        for url in ['/api/watches/export-pdf/', '/api/watches/export-wishlist/', '/api/watches/export-comparison/']:
+            with self.subTest(url=url):
+                with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                    response = self.client.post(url, {'watch_ids': self.ids}, format='json')
+                self.assertEqual(response.status_code, 202)
+                job = response.json()
+                self.assertEqual(job['status'], 'PENDING')
+                self.assertEqual(self.client.get(f"/api/exports/{job['id']}/download/").status_code, 409)
+
+                for callback in callbacks:
+                    callback()
+                job = self.client.get(job['status_url']).json()
+                self.assertEqual(job['status'], 'DONE', job['error'])
+                response = self.client.get(job['download_url'])
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_ids_are_parsed_before_the_threshold(self):
+        url = '/api/watches/export-wishlist/'
+        with self.captureOnCommitCallbacks(execute=False):
+            response = self.client.post(url, {'watch_ids': ','.join(map(str, self.ids))}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(ExportJob.objects.get(pk=response.json()['id']).watch_ids, self.ids)
+        # Une chaîne longue mais un seul identifiant : pas de file
+        response = self.client.post(url, {'watch_ids': str(self.ids[0]).zfill(8)}, format='json')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        response = self.client.post('/api/watches/export-pdf/', {'watch_ids': self.ids[0]}, format='json')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        for watch_ids in ['1,abc', [1, None], {'id': 1}]:
+            with self.subTest(watch_ids=watch_ids):
+                response = self.client.post(url, {'watch_ids': watch_ids}, format='json')
+                self.assertEqual(response.status_code, 400)
+
+    def test_submit_endpoint_validates(self):
+        response = self.client.post('/api/exports/', {'kind': 'wishlist', 'watch_ids': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/exports/', {'kind': 'wishlist', 'watch_ids': self.ids[:1]}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(ExportJob.objects.get(pk=response.json()['id']).status, 'DONE')
+
+    def test_admin_kinds_require_staff(self):
+        for kind in ['admin_catalogue', 'certificate']:
+            with self.subTest(kind=kind):
+                response = self.client.post('/api/exports/', {'kind': kind, 'watch_ids': self.ids[:1]}, format='json')
+                self.assertEqual(response.status_code, 403)
+        self.assertFalse(ExportJob.objects.exists())
+
+        self.client.force_authenticate(User.objects.create_user('staff', is_staff=True))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/exports/', {'kind': 'certificate', 'watch_ids': self.ids[:1]}, format='json')
+        self.assertEqual(response.status_code, 202)
+
+    def test_process_exports_reaps_stale_jobs_and_purges_expired_files(self):
+        now = timezone.now()
+        stale = ExportJob.objects.create(kind='wishlist', watch_ids=self.ids[:1], filename='a.pdf',
+                                         status='RUNNING', started_at=now - timedelta(hours=2))
+        running = ExportJob.objects.create(kind='wishlist', watch_ids=self.ids[:1], filename='b.pdf',
+                                           status='RUNNING', started_at=now)
+        expired = ExportJob.objects.create(kind='wishlist', watch_ids=self.ids[:1], filename='c.pdf',
+                                           status='DONE', finished_at=now - timedelta(days=2))
+        expired.file.save('expired.pdf', ContentFile(b'%PDF'))
+        path = expired.file.path
+
+        call_command('process_exports', stdout=StringIO())
+        stale.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual(stale.status, 'DONE')
+        self.assertEqual(running.status, 'RUNNING')
+        self.assertFalse(ExportJob.objects.filter(pk=expired.pk).exists())
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(stale.file.path))
+
+
+class CatalogueExportTests(TestCase):
+    """Catalogue PDF envoyé en flux, fichier complet et valide"""
+
+    def test_streamed_catalogue_is_a_valid_pdf(self):
+        _, _, watches = create_catalogue(4)
+        response = APIClient().post(
+            '/api/watches/export-pdf/', {'watch_ids': [watch.id for watch in watches]}, format='json'
+        )
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="catalogue_garde_temps.pdf"')
+        data = b''.join(response.streaming_content)
+
+        self.assertTrue(data.startswith(b'%PDF-'))
+        startxref = int(re.search(rb'startxref\n(\d+)\n%%EOF\n$', data).group(1))
+        self.assertTrue(data[startxref:].startswith(b'xref\n0 '))
+        lines = data[startxref:].split(b'\ntrailer')[0].split(b'\n')
+        size = int(lines[1].split()[1])
+        self.assertEqual(len(lines), size + 2)
+        self.assertIn(f'/Size {size} '.encode(), data)
+        # Chaque entrée de la table xref pointe sur son objet
+        for number, entry in enumerate(lines[3:3 + size - 1], start=1):
+            self.assertTrue(data[int(entry[:10]):].startswith(f'{number} 0 obj'.encode()), number)
+        self.assertEqual(len(re.findall(rb'/Type\s*/Page(?![a-zA-Z])', data)), 4)
+        self.assertIn(b'/Count 4 ', data)
+
+
+class ParallelPDFTests(TestCase):
+    """Rendu des pages réparti entre processus, assemblé dans l'ordre"""
+
+    def test_parallel_output_matches_sequential(self):
+        _, _, watches = create_catalogue(7)
+        watches = list(Watch.objects.select_related('brand'))
+        with ProcessPoolExecutor(1, mp_context=get_context('spawn'), initializer=django.setup) as pool:
+            parallel = b''.join(stream_pdf_parallel(
+                watches, FICHE_NUMBERED.draw_page, forms=FICHE_NUMBERED.forms,
+                workers=2, shard_size=2, pool=pool,
+            ))
+        sequential = b''.join(stream_pdf(watches, FICHE_NUMBERED.draw_page, forms=FICHE_NUMBERED.forms))
+        self.assertEqual(parallel, sequential)
+        # Numérotation globale des pages dans le pied de page
+        last_page = zlib.decompressobj().decompress(parallel.split(b'\nstream\n')[-1])
+        self.assertIn(b'(Page 7 |', last_page)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class PDFCacheTests(TestCase):
+    """Certificats et fiches d'une montre rendus une fois, puis lus sur disque"""
+
+    def setUp(self):
+        _, _, watches = create_catalogue(2)
+        self.watch = watches[0]
+        self.client = APIClient()
+
+    def tearDown(self):
+        evict(max_bytes=0)
+
+    def download(self):
+        response = self.client.post('/api/watches/export-pdf/', {'watch_ids': [self.watch.pk]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_repeat_download_is_not_rendered_again(self):
+        with mock.patch('watches.pdf.render_fiche', wraps=render_fiche) as render:
+            first = self.download()
+            second = self.download()
+            self.assertEqual(render.call_count, 1)
+        self.assertTrue(first.startswith(b'%PDF'))
+        self.assertEqual(first, second)
+
+    def test_changes_invalidate_cached_file(self):
+        path = cached_pdf('certificate', self.watch.pk)
+        self.watch.model_name = "Nouveau nom"
+        self.watch.save()
+        self.assertFalse(path.exists())
+
+        path = cached_pdf('certificate', self.watch.pk)
+        self.watch.complications.clear()
+        self.assertFalse(path.exists())
+
+        # Une marque modifiée change l'empreinte ; l'ancien fichier est remplacé
+        path = cached_pdf('certificate', self.watch.pk)
+        Brand.objects.filter(pk=self.watch.brand_id).update(name="Autre marque")
+        new_path = cached_pdf('certificate', self.watch.pk)
+        self.assertNotEqual(new_path, path)
+        self.assertFalse(path.exists())
+
+    def test_least_recently_served_files_are_evicted(self):
+        old = cached_pdf('certificate', self.watch.pk)
+        os.utime(old, (0, 0))
+        recent = cached_pdf('fiche', self.watch.pk)
+        with override_settings(WATCHES_PDF_CACHE_MAX_BYTES=recent.stat().st_size):
+            self.assertEqual(evict(), 1)
+        self.assertEqual(list(get_pdf_cache_dir().iterdir()), [recent])
+
+    def test_file_removed_before_it_is_served(self):
+        # Évincé dès son rendu : la réponse garde le fichier ouvert
+        with override_settings(WATCHES_PDF_CACHE_MAX_BYTES=0):
+            self.assertTrue(self.download().startswith(b'%PDF'))
+            self.client.force_login(User.objects.create_superuser('admin'))
+            response = self.client.get(f'/admin/watches/watch/{self.watch.pk}/certificate/')
+            self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        self.assertEqual(list(get_pdf_cache_dir().glob('*.pdf')), [])
+
+        # Supprimé entre la recherche et l'ouverture : rendu à nouveau
+        cached_pdf('fiche', self.watch.pk)
+        lookup = pdf_cache._lookup
+
+        def lookup_then_invalidate(kind, watch_id):
+            result = lookup(kind, watch_id)
+            pdf_cache.invalidate_pdfs([watch_id])
+            return result
+
+        with mock.patch('watches.pdf_cache._lookup', lookup_then_invalidate):
+            self.assertTrue(self.download().startswith(b'%PDF'))
+
+
+class DatabaseDumpTests(TestCase):
+    """Export complet de la base en flux, par paquets"""
+
+    def setUp(self):
+        create_catalogue(7)
+
+    def test_json_matches_previous_export(self):
+        document = {
+            'brands': json.loads(serialize('json', Brand.objects.all())),
+            'complications': json.loads(serialize('json', Complication.objects.all())),
+            'watches': json.loads(serialize('json', Watch.objects.all())),
+            'sequences': json.loads(serialize('json', Sequence.objects.all())),
+        }
+        dumped = b''.join(dump_database('json')).decode()
+        self.assertEqual(dumped, json.dumps(document, indent=2))
+
+    def test_query_count_does_not_depend_on_row_count(self):
+        with mock.patch('watches.dump.DUMP_CHUNK_SIZE', 1000):
+            # Marques, complications, montres, complications préchargées et compteurs
+            with self.assertNumQueries(5):
+                b''.join(dump_database('ndjson'))
+
+    def test_command_writes_gzipped_ndjson_loadable_by_loaddata(self):
+        path = os.path.join(tempfile.mkdtemp(), 'backup.jsonl.gz')
+        call_command('dump_catalogue', '--gzip', '--output', path, stderr=StringIO())
+        with gzip.open(path, 'rt') as f:
+            objects = [json.loads(line) for line in f]
+        self.assertEqual(len(objects), 3 + 4 + 7 + 1)
+        self.assertEqual(objects[-1]['model'], 'watches.sequence')
+
+        Watch.objects.all().delete()
+        call_command('loaddata', path, verbosity=0)
+        self.assertEqual(Watch.objects.count(), 7)
+
+    def test_restored_dump_keeps_allocating_serials(self):
+        path = os.path.join(tempfile.mkdtemp(), 'backup.jsonl')
+        call_command('dump_catalogue', '--output', path, stderr=StringIO())
+        for model in [Watch, Complication, Brand, Sequence]:
+            model.objects.all().delete()
+        serial_allocator.reset()
+        call_command('loaddata', path, verbosity=0)
+
+        brand = Brand.objects.first()
+        watch = Watch.objects.create(
+            model_name="Nouvelle", reference_number="REF-NEW", price=1000, case_diameter=40,
+            movement_type='AUTO', case_material='STEEL', water_resistance=100,
+            description="Après restauration", brand=brand,
+        )
+        self.assertEqual(Watch.objects.filter(serial_number=watch.serial_number).count(), 1)
+        self.assertEqual(Watch.objects.count(), 8)
+
+
+class AdminChartTests(TestCase):
+    """Graphiques de la liste admin rendus une fois par version du catalogue"""
+
+    def setUp(self):
+        _, _, self.watches = create_catalogue(3)
+        self.client.force_login(User.objects.create_superuser('admin'))
+
+    def test_charts_come_from_cache_until_a_write(self):
+        charts = iter(['graphique-1', 'graphique-2'])
+        with mock.patch.object(WatchAdmin, '_render_movement_chart', autospec=True,
+                               side_effect=lambda admin: next(charts)) as movement, \
+                mock.patch.object(WatchAdmin, '_render_price_chart', autospec=True, return_value=None) as price:
+            for _ in range(2):
+                response = self.client.get('/admin/watches/watch/')
+                self.assertContains(response, 'data:image/png;base64,graphique-1')
+            self.assertEqual((movement.call_count, price.call_count), (1, 1))
+
+            self.watches[0].price = 1
+            self.watches[0].save()
+            response = self.client.get('/admin/watches/watch/')
+            self.assertContains(response, 'data:image/png;base64,graphique-2')
+            self.assertEqual((movement.call_count, price.call_count), (2, 2))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImageDerivativeTests(TestCase):
+    """Largeurs fixes en WebP et JPEG, générées à l'upload ou à la demande"""
+
+    def setUp(self):
+        _, _, watches = create_catalogue(1)
+        self.watch = watches[0]
+        self.client = APIClient()
+
+    def upload(self, size=(2000, 1000)):
+        output = BytesIO()
+        Image.new('RGBA', size, (200, 160, 90, 255)).save(output, 'PNG')
+        self.watch.image.save('photo.png', ContentFile(output.getvalue()))
+        return self.watch.image.name
+
+    def test_upload_generates_derivatives(self):
+        name = self.upload()
+        for width in DERIVATIVE_WIDTHS:
+            for ext, image_format in [('webp', 'WEBP'), ('jpg', 'JPEG')]:
+                with default_storage.open(derivative_name(name, width, ext)) as f:
+                    image = Image.open(f)
+                    self.assertEqual((image.format, image.size), (image_format, (width, width // 2)))
+
+    def test_saving_without_image_change_does_not_regenerate(self):
+        self.upload()
+        with mock.patch('watches.signals.generate_derivatives') as generate:
+            self.watch.price = 6000
+            self.watch.save()
+            watch = Watch.objects.get(pk=self.watch.pk)
+            watch.description = "Nouvelle description"
+            watch.save()
+            Watch.objects.only('id', 'brand').get(pk=self.watch.pk).save()
+            self.assertFalse(generate.called)
+            self.upload()
+            self.assertEqual(generate.call_count, 1)
+
+    def test_small_images_are_not_upscaled(self):
+        name = self.upload(size=(500, 400))
+        with default_storage.open(derivative_name(name, 1280, 'jpg')) as f:
+            self.assertEqual(Image.open(f).size, (500, 400))
+
+    def test_missing_derivative_is_generated_on_request(self):
+        name = self.upload()
+        default_storage.delete(derivative_name(name, 320, 'webp'))
+        response = self.client.get(f'/media/{derivative_name(name, 320, "webp")}')
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'image/webp'))
+        self.assertTrue(default_storage.exists(derivative_name(name, 320, 'webp')))
+        self.assertEqual(self.client.get(f'/media/{derivative_name(name, 321, "webp")}').status_code, 404)
+        self.assertEqual(self.client.get('/media/derivatives/exports/x.pdf.320w.webp').status_code, 404)
+
+    def test_serializers_expose_thumbnail_and_srcset(self):
+        name = self.upload()
+        base = 'http://testserver/media/'
+        expected_srcset = ', '.join(
+            f'{base}{derivative_name(name, width, "webp")} {width}w' for width in DERIVATIVE_WIDTHS
+        )
+        for url in ['/api/watches/', '/api/watches/?fast=1']:
+            with self.subTest(url=url):
+                row = self.client.get(url).json()['results'][0]
+                self.assertEqual(row['thumbnail_url'], base + derivative_name(name, 640, 'webp'))
+                self.assertEqual(row['srcset']['webp'], expected_srcset)
+        detail = self.client.get(f'/api/watches/{self.watch.pk}/').json()
+        self.assertEqual(detail['srcset']['webp'], expected_srcset)
+
+    def test_command_backfills_existing_images(self):
+        name = self.upload()
+        for width in DERIVATIVE_WIDTHS:
+            default_storage.delete(derivative_name(name, width, 'jpg'))
+        call_command('generate_derivatives', stdout=StringIO())
+        self.assertTrue(default_storage.exists(derivative_name(name, 320, 'jpg')))
+
+
+class ImportTimeTests(TestCase):
+    """Démarrage léger : matplotlib, ReportLab et NumPy ne sont chargés qu'au premier rendu"""
+    # Processus neuf : django.setup(), chargement des URLs (admin, vues) et vérifications
+    script = (
+        'import json, sys, time\n'
+        'start = time.perf_counter()\n'
+        'import django\n'
+        'django.setup()\n'
+        'from django.core.management import call_command\n'
+        'from django.urls import get_resolver\n'
+        'get_resolver().url_patterns\n'
+        'call_command("check", stdout=sys.stderr)\n'
+        'print(json.dumps([time.perf_counter() - start, sorted(sys.modules)]))\n'
+    )
+
+    def test_startup_does_not_import_rendering_libraries(self):
+        result = subprocess.run(
+            [sys.executable, '-c', self.script],
+            capture_output=True, text=True, check=True, cwd=settings.BASE_DIR,
+        )
+        elapsed, modules = json.loads(result.stdout)
+        self.assertEqual({name.split('.')[0] for name in modules} & set(HEAVY_MODULES), set())
+        # Durée de démarrage vérifiée seulement si un budget est donné (dépend de la machine)
+        budget_ms = os.environ.get('WATCHES_STARTUP_BUDGET_MS')
+        if budget_ms:
+            self.assertLess(elapsed * 1000, float(budget_ms))
+
+
+class CatalogueStatsTests(TestCase):
+    """``/api/stats/`` : agrégats et percentiles de prix calculés en base"""
+
+    def setUp(self):
+        self.client = APIClient()
+        bump_catalogue_version()  # statistiques d'un test précédent
+
+    def set_prices(self, prices):
+        _, _, watches = create_catalogue(len(prices))
+        for watch, price in zip(watches, prices):
+            Watch.objects.filter(pk=watch.pk).update(price=price)
+        bump_catalogue_version()
+
+    def percentiles(self):
+        data = self.client.get('/api/stats/').json()
+        return {key: value and float(value) for key, value in data['price']['percentiles'].items()}
+
+    def test_percentiles_by_nearest_rank(self):
+        self.set_prices([5000, 1000, 3000, 2000, 4000])
+        self.assertEqual(self.percentiles(), {'p10': 1000, 'p25': 2000, 'p50': 3000, 'p75': 4000, 'p90': 5000})
+        Watch.objects.filter(price=5000).delete()
+        self.assertEqual(self.percentiles(), {'p10': 1000, 'p25': 1000, 'p50': 2000, 'p75': 3000, 'p90': 4000})
+
+    def test_counts_and_query_count(self):
+        self.set_prices([1000, 2000, 3000, 4000])
+        with self.assertNumQueries(5 + len(PRICE_PERCENTILES)):
+            data = self.client.get('/api/stats/').json()
+        self.assertEqual(data['total'], 4)
+        self.assertEqual(sum(m['count'] for m in data['movements']), 4)
+        self.assertEqual(sum(m['count'] for m in data['materials']), 4)
+        self.assertEqual([b['count'] for b in data['brands']], [2, 1, 1])
+        self.assertEqual(float(data['brands'][0]['avg_price']), 2500)
+        self.assertEqual([c['count'] for c in data['complications']], [3, 2, 1, 0])
+        self.assertEqual((float(data['price']['min']), float(data['price']['max'])), (1000, 4000))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/stats/').json(), data)
+
+    def test_empty_catalogue(self):
+        with self.assertNumQueries(5):
+            data = self.client.get('/api/stats/').json()
+        self.assertEqual(data['total'], 0)
+        self.assertEqual(data['price'], {
+            'min': None, 'avg': None, 'max': None, 'percentiles': {f'p{p}': None for p in PRICE_PERCENTILES},
+        })
+        self.assertTrue(all(m['count'] == 0 for m in data['movements']))
+
+
+class FacetTests(TestCase):
+    """Compteurs des filtres : chaque facette ignore son propre filtre"""
+
+    def setUp(self):
+        create_catalogue(24)
+        self.client = APIClient()
+
+    def count(self, query):
+        return self.client.get(f'/api/watches/?{query}').json()['count']
+
+    def facets(self, query=''):
+        response = self.client.get(f'/api/watches/facets/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_counts_match_list_filters(self):
+        query = 'movement_type=AUTO&case_diameter__lte=41&search=Modèle'
+        facets = self.facets(query)
+        self.assertEqual(facets['total'], self.count(query))
+        # Facette disjonctive : le filtre de mouvement est ignoré pour compter les mouvements
+        for option in facets['movement_type']:
+            self.assertEqual(
+                option['count'],
+                self.count(f"movement_type={option['value']}&case_diameter__lte=41&search=Modèle"),
+            )
+        for facet in ['case_material', 'brand', 'complications']:
+            for option in facets[facet]:
+                self.assertEqual(option['count'], self.count(f"{query}&{facet}={option['value']}"), facet)
+        for bucket in facets['price']:
+            upper = f"&price__lte={bucket['max'] - 0.01}" if bucket['max'] else ''
+            self.assertEqual(bucket['count'], self.count(f"{query}&price__gte={bucket['min']}{upper}"))
+        self.assertEqual(sum(b['count'] for b in facets['case_diameter']), self.count('movement_type=AUTO'))
+
+    def test_few_queries_then_cached_per_normalized_filters(self):
+        with self.assertNumQueries(5):
+            self.facets('brand__country=Suisse')
+        with self.assertNumQueries(0):
+            self.facets('search=&brand__country=Suisse')
+
+    def test_invalid_filter(self):
+        self.assertEqual(self.client.get('/api/watches/facets/?price__gte=abc').status_code, 400)
+
+
+class SimilarWatchesTests(TestCase):
+    """Montres similaires : index NumPy tenu à jour par les signaux"""
+
+    def setUp(self):
+        similar.reset()
+        self.addCleanup(similar.reset)
+        self.brands, self.complications, self.watches = create_catalogue(12)
+        self.client = APIClient()
+
+    def similar(self, watch, query=''):
+        response = self.client.get(f'/api/watches/{watch.pk}/similar/{query}')
+        self.assertEqual(response.status_code, 200)
+        return [w['id'] for w in response.json()['results']]
+
+    def copy(self, watch, **fields):
+        clone = Watch.objects.get(pk=watch.pk)
+        clone.pk, clone.serial_number, clone.reference_number = None, None, f'{watch.reference_number}-B'
+        for name, value in fields.items():
+            setattr(clone, name, value)
+        clone.save()
+        clone.complications.set(watch.complications.all())
+        return clone
+
+    def test_nearest_first_without_itself(self):
+        watch = self.watches[5]
+        twin = self.copy(watch, price=watch.price + 1)
+        ids = self.similar(watch)
+        self.assertEqual(ids[0], twin.pk)
+        self.assertNotIn(watch.pk, ids)
+        self.assertEqual(len(ids), 6)
+        self.assertEqual(len(self.similar(watch, '?limit=3')), 3)
+        self.assertEqual(len(self.similar(watch, '?limit=500')), 12)
+
+    def test_index_follows_writes(self):
+        watch = self.watches[5]
+        self.similar(watch)
+        twin = self.copy(watch, brand=self.brands[0])
+        self.assertEqual(self.similar(watch)[0], twin.pk)
+        # Champs puis complications modifiés : la copie s'éloigne
+        twin.price, twin.case_diameter, twin.movement_type = 90000, 48, 'SOLAR'
+        twin.save()
+        self.assertNotEqual(self.similar(watch)[0], twin.pk)
+        twin.delete()
+        self.assertNotIn(twin.pk, self.similar(watch, '?limit=50'))
+
+        other = self.watches[6]
+        other.complications.set(self.complications)
+        new = Complication.objects.create(name='Tourbillon', description='Test')
+        watch.complications.add(new)
+        self.assertEqual(len(self.similar(watch, '?limit=50')), 11)
+        new.delete()
+        self.assertEqual(len(self.similar(watch, '?limit=50')), 11)
+
+    def test_unknown_watch_and_invalid_limit(self):
+        self.assertEqual(self.client.get('/api/watches/999999/similar/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/watches/{self.watches[0].pk}/similar/?limit=x').status_code, 400)
+
+
+class ComparisonTests(TestCase):
+    """Comparatif calculé côté serveur, en cache par montres et ``updated_at``"""
+
+    def setUp(self):
+        self.brands, self.complications, self.watches = create_catalogue(6)
+        self.client = APIClient()
+
+    def compare(self, *watches):
+        response = self.client.get(f"/api/watches/compare/?ids={','.join(str(w.pk) for w in watches)}")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def row(self, matrix, field):
+        return next(row for row in matrix['rows'] if row['field'] == field)
+
+    def test_matrix(self):
+        a, b, c = self.watches[3], self.watches[1], self.watches[2]
+        matrix = self.compare(a, b, c)
+        self.assertEqual([w['id'] for w in matrix['watches']], [a.pk, b.pk, c.pk])
+        price = self.row(matrix, 'price')
+        self.assertEqual(price['values'], ['1003.00', '1001.00', '1002.00'])
+        self.assertEqual(price['best'], [False, True, False])
+        self.assertTrue(price['differs'])
+        self.assertEqual(self.row(matrix, 'water_resistance')['best'], [True, False, False])
+        self.assertFalse(self.row(matrix, 'country')['differs'])
+        self.assertEqual(self.row(matrix, 'case_diameter')['best'], [False, False, False])
+        # Complications 0 à 2 pour a, 0 pour b, 0 et 1 pour c
+        complications = matrix['complications']
+        self.assertEqual([c['id'] for c in complications['common']], [self.complications[0].pk])
+        self.assertEqual([c['id'] for c in complications['only'][0]], [self.complications[2].pk])
+        self.assertEqual(complications['only'][1], [])
+        self.assertEqual(
+            [c['id'] for c in complications['lacks'][1]], [self.complications[1].pk, self.complications[2].pk]
+        )
+
+    def test_cached_by_ids_and_updated_at(self):
+        a, b = self.watches[2], self.watches[4]
+        with self.assertNumQueries(3):
+            self.compare(a, b)
+        with self.assertNumQueries(1):
+            reversed_matrix = self.compare(b, a)
+        self.assertEqual([w['id'] for w in reversed_matrix['watches']], [b.pk, a.pk])
+        self.assertEqual(self.row(reversed_matrix, 'price')['best'], [False, True])
+
+        # Écriture d'une autre montre : toujours en cache
+        self.watches[0].save()
+        with self.assertNumQueries(1):
+            self.compare(a, b)
+        b.price = 1
+        b.save()
+        self.assertEqual(self.row(self.compare(a, b), 'price')['best'], [False, True])
+        self.complications[1].name = 'Quantième'
+        self.complications[1].save()
+        self.assertIn('Quantième', [c['name'] for c in self.compare(a, b)['complications']['common']])
+        b.complications.clear()
+        self.assertEqual(self.compare(a, b)['complications']['common'], [])
+
+    def test_missing_and_invalid_ids(self):
+        matrix = self.compare(self.watches[0], Watch(pk=999999))
+        self.assertEqual(matrix['missing'], [999999])
+        self.assertEqual(len(matrix['watches']), 1)
+        self.assertEqual(self.client.get('/api/watches/compare/?ids=a').status_code, 400)
+        self.assertEqual(self.client.get('/api/watches/compare/').status_code, 400)
+        ids = ','.join(str(i) for i in range(1, WatchViewSet.compare_max_ids + 2))
+        self.assertEqual(self.client.get(f'/api/watches/compare/?ids={ids}').status_code, 400)
+
+    def test_pdf_export_uses_cached_matrix(self):
+        ids = [self.watches[1].pk, self.watches[2].pk]
+        self.compare(*self.watches[1:3])
+        with self.assertNumQueries(1):
+            response = self.client.post('/api/watches/export-comparison/', {'watch_ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content.startswith(b'%PDF'))
+
+
+class ComplicationMaskTests(TestCase):
+    """Masque des complications tenu à jour et filtres complications__all/any/none"""
+
+    def setUp(self):
+        self.brands, self.complications, self.watches = create_catalogue(10)
+        self.client = APIClient()
+
+    def assertMasksConsistent(self):
+        for watch in Watch.objects.prefetch_related('complications'):
+            expected = mask_of(c.bit for c in watch.complications.all())
+            self.assertEqual(watch.complication_mask, expected, watch)
+
+    def ids(self, query):
+        response = self.client.get(f'/api/watches/?page_size=100&{query}')
+        self.assertEqual(response.status_code, 200)
+        return {w['id'] for w in response.json()['results']}
+
+    def test_bits_assigned_and_reused(self):
+        self.assertEqual(sorted(c.bit for c in self.complications), [0, 1, 2, 3])
+        self.complications[1].delete()
+        self.assertEqual(Complication.objects.create(name='GMT', description='Test').bit, 1)
+        self.assertMasksConsistent()
+
+    def test_mask_follows_m2m_changes(self):
+        watch, complication = self.watches[3], self.complications[3]
+        watch.complications.add(complication)
+        self.assertEqual(watch.complication_mask, mask_of([0, 1, 2, 3]))
+        watch.complications.remove(self.complications[0])
+        complication.watches.add(self.watches[0], self.watches[1])
+        complication.watches.remove(self.watches[1])
+        self.assertMasksConsistent()
+        complication.watches.clear()
+        self.assertMasksConsistent()
+        self.complications[2].delete()
+        self.assertMasksConsistent()
+        # L'instance en mémoire reste à jour : save() n'écrase pas le masque
+        watch.complications.set([self.complications[0]])
+        watch.save()
+        self.assertMasksConsistent()
+
+    def test_filters_match_joins(self):
+        a, b, c = [str(complication.pk) for complication in self.complications[:3]]
+        watches = Watch.objects.all()
+        self.assertEqual(
+            self.ids(f'complications__all={a},{c}'),
+            set(watches.filter(complications=a).filter(complications=c).values_list('pk', flat=True)),
+        )
+        self.assertEqual(
+            self.ids(f'complications__any={b},{c}'),
+            set(watches.filter(complications__in=[b, c]).values_list('pk', flat=True)),
+        )
+        self.assertEqual(
+            self.ids(f'complications__none={a}'),
+            set(watches.exclude(complications=a).values_list('pk', flat=True)),
+        )
+        self.assertEqual(self.ids(f'complications__all={a},999999'), set())
+        self.assertEqual(self.ids('complications__none=999999'), set(watches.values_list('pk', flat=True)))
+        self.assertEqual(self.client.get('/api/watches/?complications__all=x').status_code, 400)
+
+    def test_single_predicate_without_join(self):
+        a, b, c = [str(complication.pk) for complication in self.complications[:3]]
+        queryset = WatchFilter(
+            {'complications__all': f'{a},{b}', 'complications__none': c}, queryset=Watch.objects.all()
+        ).qs
+        sql = str(queryset.query)
+        self.assertNotIn('JOIN', sql)
+        self.assertIn('complication_mask', sql)
+
+    def test_bulk_generator_sets_masks(self):
+        call_command('generate_watches', 30, bulk=True, seed=1, stdout=StringIO())
+        self.assertMasksConsistent()
+
+
+class GenerateWatchesTests(TestCase):
+    """``generate_watches`` : jeu de données reproductible avec ``--seed``"""
+
+    def generate(self, count, **options):
+        """Montres générées (hors numéros de série), dans l'ordre de création"""
+        call_command('generate_watches', count, clear=True, stdout=StringIO(), **options)
+        watches = Watch.objects.select_related('brand').prefetch_related('complications').order_by('id')
+        return [
+            (watch.reference_number, watch.model_name, watch.price, watch.case_diameter,
+             watch.movement_type, watch.case_material, watch.water_resistance, watch.description,
+             watch.brand.name, sorted(c.name for c in watch.complications.all()))
+            for watch in watches
+        ]
+
+    def assertSerialsAndMasks(self):
+        serials = list(Watch.objects.values_list('serial_number', flat=True))
+        self.assertEqual(len(set(serials)), len(serials))
+        self.assertTrue(all(parse_serial(serial) is not None for serial in serials))
+        for watch in Watch.objects.prefetch_related('complications'):
+            self.assertEqual(watch.complication_mask, mask_of(c.bit for c in watch.complications.all()))
+
+    def test_same_seed_same_watches(self):
+        first = self.generate(12, seed=3)
+        self.assertEqual(len(first), 12)
+        self.assertEqual(self.generate(12, seed=3), first)
+        self.assertNotEqual(self.generate(12, seed=4), first)
+
+    def test_bulk_is_reproducible_and_independent_of_workers(self):
+        first = self.generate(25, seed=5, bulk=True, batch_size=10)
+        self.assertEqual(len(first), 25)
+        self.assertSerialsAndMasks()
+        self.assertEqual(self.generate(25, seed=5, bulk=True, batch_size=10), first)
+        self.assertEqual(self.generate(25, seed=5, bulk=True, batch_size=10, workers=2), first)
+        self.assertSerialsAndMasks()
+
+    def test_bulk_drops_cached_representations(self):
+        with mock.patch('watches.management.commands.generate_watches.invalidate_representations') as invalidate:
+            self.generate(12, seed=2, bulk=True, batch_size=5)
+        invalidated = [pk for call in invalidate.call_args_list for pk in call.args[0]]
+        self.assertCountEqual(invalidated, Watch.objects.values_list('pk', flat=True))
+
+    def test_invalid_options(self):
+        for options in [{'workers': 2}, {'workers': 0, 'bulk': True}, {'batch_size': 0, 'bulk': True}]:
+            with self.subTest(**options), self.assertRaises(CommandError):
+                call_command('generate_watches', 5, stdout=StringIO(), **options)
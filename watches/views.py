@@ -1,29 +1,98 @@
-from rest_framework import viewsets, filters
+from rest_framework import mixins, viewsets, filters
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.response import Response
-from django.http import HttpResponse
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+from django.db.models import Count, IntegerField, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from django.http import FileResponse, Http404, HttpResponse, QueryDict, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Brand, Complication, Watch
+from django_filters.utils import translate_validation
+from .models import Brand, Complication, ExportJob, Watch
 from .serializers import (
     BrandSerializer, 
     ComplicationSerializer, 
     WatchListSerializer, 
-    WatchDetailSerializer
+    WatchDetailSerializer,
+    WatchListValues,
+    ExportJobSerializer,
 )
+from .comparison import get_comparison
+from .conditional import ConditionalGetMixin
+from .exports import ADMIN_KINDS, get_export_queue_threshold, submit_export
+from .facets import get_facets, normalized_params
+from .filters import WatchFilter
+from .pagination import WatchPagination
+from .rendering import pdf
+from .pdf_cache import open_cached_pdf
+from .search import WatchSearchFilter
+from .similar import similar_watch_ids
+from .stats import get_catalogue_stats
 from io import BytesIO
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import cm
-from reportlab.lib import colors
-from reportlab.platypus import Table, TableStyle
 
 
-class BrandViewSet(viewsets.ReadOnlyModelViewSet):
+def count_subquery(queryset, field):
+    """
+    COUNT corrélé sur ``queryset`` groupé par ``field`` (qui doit être filtré
+    sur ``OuterRef('pk')``). Contrairement à ``manager.count()``, la valeur
+    est calculée dans la requête de la page : le nombre de requêtes d'une
+    liste ne dépend plus du nombre de lignes.
+    """
+    counts = queryset.order_by().values(field).annotate(total=Count('*')).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def parse_ids(values):
+    """
+    Liste d'identifiants dédoublonnée (ordre conservé) à partir d'une liste
+    ou de chaînes séparées par des virgules. ``ValueError`` si invalide.
+    """
+    if isinstance(values, (str, int)):
+        values = [values]
+    ids = []
+    for value in values:
+        for part in str(value).split(','):
+            if part.strip():
+                ids.append(int(part))
+    return list(dict.fromkeys(ids))
+
+
+def brands_with_counts():
+    return Brand.objects.annotate(
+        watch_count=count_subquery(Watch.objects.filter(brand=OuterRef('pk')), 'brand')
+    )
+
+
+def complications_with_counts():
+    through = Watch.complications.through
+    return Complication.objects.annotate(
+        watch_count=count_subquery(through.objects.filter(complication=OuterRef('pk')), 'complication')
+    )
+
+
+def watches_with_counts(queryset=None):
+    through = Watch.complications.through
+    queryset = Watch.objects.select_related('brand') if queryset is None else queryset
+    return queryset.annotate(
+        complication_count=count_subquery(through.objects.filter(watch=OuterRef('pk')), 'watch')
+    )
+
+
+def pdf_response(write, watch_ids):
+    buffer = BytesIO()
+    write(buffer, watch_ids)
+    buffer.seek(0)
+    return HttpResponse(buffer, content_type='application/pdf')
+
+
+class BrandViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """
     API en lecture seule pour les marques
     Filtres: recherche par nom et pays
+    GET conditionnel (ETag / Last-Modified) sur la version du catalogue
     """
-    queryset = Brand.objects.all()
+    queryset = brands_with_counts()
     serializer_class = BrandSerializer
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'country']
@@ -31,190 +100,285 @@ class BrandViewSet(viewsets.ReadOnlyModelViewSet):
     ordering = ['name']
 
 
-class ComplicationViewSet(viewsets.ReadOnlyModelViewSet):
+class ComplicationViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """
     API en lecture seule pour les complications
     Filtres: recherche par nom
+    GET conditionnel (ETag / Last-Modified) sur la version du catalogue
     """
-    queryset = Complication.objects.all()
+    queryset = complications_with_counts()
     serializer_class = ComplicationSerializer
     filter_backends = [filters.SearchFilter]
     search_fields = ['name']
 
 
-class WatchViewSet(viewsets.ReadOnlyModelViewSet):
+class CatalogueStatsView(APIView):
+    """
+    Statistiques du catalogue : répartition par mouvement, matériau, marque et
+    complication, et distribution des prix (calculées en base, mises en cache)
+    """
+
+    def get(self, request):
+        return Response(get_catalogue_stats())
+
+
+class ExportJobViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    Exports PDF en arrière-plan (voir exports.py)
+    POST {"kind": "catalogue", "watch_ids": [...]} -> 202 + id du job,
+    GET /api/exports/<id>/ pour le statut, /download/ une fois terminé.
+    Pas de liste : l'identifiant (UUID) fait office de jeton d'accès.
+    Catalogue d'administration et certificat réservés au staff.
+    """
+    queryset = ExportJob.objects.all()
+    serializer_class = ExportJobSerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if serializer.validated_data['kind'] in ADMIN_KINDS and not request.user.is_staff:
+            raise PermissionDenied("Export réservé à l'administration")
+        job = submit_export(serializer.validated_data['kind'], serializer.validated_data['watch_ids'])
+        return Response(self.get_serializer(job).data, status=202)
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != 'DONE':
+            return Response(
+                {"error": "Export pas encore disponible", "status": job.status}, status=409
+            )
+        return FileResponse(job.file.open('rb'), as_attachment=True, filename=job.filename,
+                            content_type='application/pdf')
+
+
+class WatchViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """
     API en lecture seule pour les montres
+    GET conditionnel (ETag / Last-Modified) sur la version du catalogue
     """
-    queryset = Watch.objects.select_related('brand').prefetch_related('complications')
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    queryset = Watch.objects.select_related('brand')
+    # La recherche passe après le tri : sans ``ordering`` explicite, elle classe par pertinence
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, WatchSearchFilter]
     search_fields = ['model_name', 'reference_number', 'brand__name', 'description']
-    filterset_fields = {
-        'movement_type': ['exact'],
-        'case_material': ['exact'],
-        'brand': ['exact'],
-        'brand__country': ['exact', 'icontains'],
-        'complications': ['exact'],
-        'case_diameter': ['exact', 'lte', 'gte'],
-        'price': ['exact', 'lte', 'gte'],
-        'water_resistance': ['exact', 'lte', 'gte'],
-    }
+    filterset_class = WatchFilter
+    # Filtres de champ (la vue asynchrone les applique elle-même)
+    filterset_fields = WatchFilter.Meta.fields
     ordering_fields = ['price', 'case_diameter', 'created_at', 'model_name']
     ordering = ['-created_at']
+    # ?pagination=cursor : pagination par clé sur ces mêmes champs (voir pagination.py)
+    pagination_class = WatchPagination
+    # Nombre maximal de montres par appel à /api/watches/bulk/
+    bulk_max_ids = 100
+    # Nombre maximal de montres par appel à /api/watches/compare/
+    compare_max_ids = 10
+    # Nombre maximal de montres renvoyées par /api/watches/<id>/similar/
+    similar_max_limit = 50
+    # ?fast=1 : liste construite depuis ``.values()`` (même JSON, voir WatchListValues)
+    fast_query_param = 'fast'
     
+    def get_queryset(self):
+        """Annote les compteurs affichés par les serializers (pas de COUNT par ligne)"""
+        queryset = super().get_queryset()
+        if self.action == 'retrieve':
+            return queryset.prefetch_related(
+                Prefetch('complications', queryset=complications_with_counts())
+            )
+        return watches_with_counts(queryset)
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get(self.fast_query_param) in ('1', 'true'):
+            return self.conditional_response(request, self.fast_list)
+        return super().list(request, *args, **kwargs)
+
+    def fast_list(self, request):
+        """Liste sans instance de modèle ni serializer DRF par ligne"""
+        values = WatchListValues(self.get_serializer_context())
+        queryset = values.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(values.to_representation(page))
+        return Response(values.to_representation(queryset))
+
     def get_serializer_class(self):
         """Utilise le serializer détaillé pour la vue de détail"""
         if self.action == 'retrieve':
             return WatchDetailSerializer
         return WatchListSerializer
 
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """
+        Montres les plus proches de celle-ci (prix, dimensions, mouvement,
+        matériau, marque, complications), de la plus proche à la moins
+        proche. ``?limit=`` (défaut 6, maximum ``similar_max_limit``).
+        """
+        return self.conditional_response(request, self.similar_watches, pk)
+
+    def similar_watches(self, request, pk):
+        try:
+            pk = int(pk)
+            limit = min(max(int(request.query_params.get('limit', 6)), 1), self.similar_max_limit)
+        except ValueError:
+            return Response({"error": "Paramètre invalide"}, status=400)
+        ids = similar_watch_ids(pk, limit)
+        if ids is None:
+            raise Http404('No %s matches the given query.' % Watch._meta.object_name)
+        values = WatchListValues(self.get_serializer_context())
+        rows = {row['id']: row for row in values.values(watches_with_counts().filter(id__in=ids))}
+        return Response({'results': values.to_representation([rows[i] for i in ids if i in rows])})
+
+    @action(detail=False, methods=['get'])
+    def compare(self, request):
+        """
+        Matrice comparative de ``?ids=1,2,3`` (colonnes dans cet ordre) :
+        valeurs par caractéristique, lignes qui diffèrent, meilleures valeurs
+        et différences de complications (voir comparison.py). GET conditionnel.
+        """
+        return self.conditional_response(request, self.comparison)
+
+    def comparison(self, request):
+        try:
+            ids = parse_ids(request.query_params.getlist('ids'))
+        except ValueError:
+            return Response({"error": "Identifiants invalides"}, status=400)
+        if not ids:
+            return Response({"error": "Aucun ID fourni"}, status=400)
+        if len(ids) > self.compare_max_ids:
+            return Response(
+                {"error": f"{self.compare_max_ids} montres maximum par comparatif"}, status=400
+            )
+        matrix = get_comparison(ids)
+        found = {watch['id'] for watch in matrix['watches']}
+        return Response({**matrix, 'missing': [i for i in ids if i not in found]})
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """
+        Nombre de montres par valeur de chaque filtre, avec les autres filtres
+        et la recherche appliqués (voir facets.py). GET conditionnel.
+        """
+        return self.conditional_response(request, self.facet_counts)
+
+    def facet_counts(self, request):
+        queryset = Watch.objects.all()
+        filterset = DjangoFilterBackend().get_filterset_class(self, queryset)(
+            data=request.query_params, queryset=queryset, request=request
+        )
+
+        def make_filtered():
+            # Validé une fois (requêtes des choix de modèle) puis appliqué par sous-ensembles
+            if not filterset.is_valid():
+                raise translate_validation(filterset.errors)
+            cleaned = filterset.form.cleaned_data
+            search = WatchSearchFilter(ranked=False)
+
+            def filtered(params):
+                names = {name for name, _ in params}
+                result = queryset
+                for name, value in cleaned.items():
+                    if name in names:
+                        result = filterset.filters[name].filter(result, value)
+                return search.filter_queryset(request, result, self)
+            return filtered
+
+        names = [*filterset.filters, api_settings.SEARCH_PARAM]
+        return Response(get_facets(normalized_params(request.query_params, names), make_filtered))
+
+    @action(detail=False, methods=['get', 'post'], url_path='bulk')
+    def bulk(self, request):
+        """
+        Montres demandées par identifiant, dans l'ordre demandé, en une requête.
+        GET ?ids=3,1,2 ou POST {"ids": [3, 1, 2]}. Les ids inconnus sont
+        renvoyés dans ``missing``.
+        """
+        if request.method == 'POST':
+            raw_ids = request.data.get('ids', [])
+        else:
+            raw_ids = request.query_params.getlist('ids')
+        try:
+            ids = parse_ids(raw_ids)
+        except (TypeError, ValueError):
+            return Response({"error": "Identifiants invalides"}, status=400)
+        if not ids:
+            return Response({"error": "Aucun ID fourni"}, status=400)
+        if len(ids) > self.bulk_max_ids:
+            return Response(
+                {"error": f"{self.bulk_max_ids} montres maximum par appel"}, status=400
+            )
+
+        watches = {watch.id: watch for watch in self.get_queryset().filter(id__in=ids)}
+        serializer = self.get_serializer([watches[i] for i in ids if i in watches], many=True)
+        return Response({
+            'results': serializer.data,
+            'missing': [i for i in ids if i not in watches],
+        })
+
+    def queued_export(self, request, kind, ids):
+        """
+        Au-delà de ``WATCHES_EXPORT_QUEUE_THRESHOLD`` montres, l'export passe
+        par la file : 202 et job à suivre sur /api/exports/<id>/.
+        """
+        if len(ids) <= get_export_queue_threshold():
+            return None
+        job = submit_export(kind, ids)
+        return Response(ExportJobSerializer(job, context=self.get_serializer_context()).data, status=202)
+
     @action(detail=False, methods=['post'], url_path='export-pdf')
     def export_pdf(self, request):
-        """Génère un catalogue PDF standard (une page par montre)"""
-        watch_ids = request.data.get('watch_ids', [])
-        if not watch_ids:
+        """
+        Génère un catalogue PDF standard (une page par montre).
+
+        Le PDF est envoyé en flux au fur et à mesure que les pages sont
+        dessinées, et les montres sont lues par paquets : la mémoire reste
+        constante quel que soit le nombre de références demandées. Les pages
+        sont dessinées en parallèle par le pool de processus (voir pdf.py).
+        """
+        try:
+            ids = parse_ids(request.data.get('watch_ids', []))
+        except (TypeError, ValueError):
+            return Response({"error": "Identifiants invalides"}, status=400)
+        if not ids:
             return Response({"error": "Aucun ID fourni"}, status=400)
+        if len(ids) == 1:
+            # Fiche d'une seule montre (page détail) : servie depuis le cache disque
+            try:
+                file = open_cached_pdf('fiche', ids[0])
+            except Watch.DoesNotExist:
+                return Response({"error": "Montre introuvable"}, status=404)
+            return FileResponse(
+                file, as_attachment=True,
+                filename='catalogue_garde_temps.pdf', content_type='application/pdf',
+            )
+        queued = self.queued_export(request, 'catalogue', ids)
+        if queued is not None:
+            return queued
         
-        queryset = Watch.objects.filter(id__in=watch_ids).select_related('brand')
-        buffer = BytesIO()
-        p = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-        
-        for i, watch in enumerate(queryset):
-            if i > 0: p.showPage()
-            p.setFont("Helvetica-Bold", 20)
-            p.drawCentredString(width/2, height - 2*cm, "FICHE TECHNIQUE")
-            p.setFont("Helvetica-Bold", 16)
-            p.drawCentredString(width/2, height - 3.5*cm, f"{watch.brand.name} - {watch.model_name}")
-            p.setStrokeColorRGB(0.77, 0.63, 0.35) # Gold
-            p.line(2*cm, height - 4*cm, width - 2*cm, height - 4*cm)
-            y = height - 5.5*cm
-            data = [
-                ("Référence", watch.reference_number),
-                ("Prix", f"{watch.price} €"),
-                ("Mouvement", watch.get_movement_type_display()),
-                ("Matériau", watch.get_case_material_display()),
-                ("Diamètre", f"{watch.case_diameter} mm"),
-                ("Étanchéité", f"{watch.water_resistance} m"),
-                ("Description", watch.description[:800] + "..."),
-            ]
-            for label, value in data:
-                p.setFont("Helvetica-Bold", 11)
-                p.drawString(2*cm, y, label)
-                p.setFont("Helvetica", 11)
-                if label == "Description":
-                    y -= 0.6*cm
-                    text_obj = p.beginText(2*cm, y)
-                    text_obj.setFont("Helvetica", 10)
-                    words = value.split()
-                    line = ""
-                    for word in words:
-                        if len(line + word) < 90: line += word + " "
-                        else:
-                            text_obj.textLine(line)
-                            line = word + " "
-                            y -= 0.4*cm
-                    text_obj.textLine(line)
-                    p.drawText(text_obj)
-                else:
-                    p.drawString(6*cm, y, str(value))
-                    y -= 0.8*cm
-        p.save()
-        buffer.seek(0)
-        return HttpResponse(buffer, content_type='application/pdf')
+        response = StreamingHttpResponse(pdf().stream_catalogue(ids), content_type='application/pdf')
+        response['Content-Disposition'] = 'attachment; filename="catalogue_garde_temps.pdf"'
+        return response
 
     @action(detail=False, methods=['post'], url_path='export-wishlist')
     def export_wishlist(self, request):
         """Génère une liste condensée pour la wishlist"""
-        watch_ids = request.data.get('watch_ids', [])
-        queryset = list(Watch.objects.filter(id__in=watch_ids).select_related('brand'))
-        total_price = sum(w.price for w in queryset)
-        
-        buffer = BytesIO()
-        p = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-        
-        p.setFont("Helvetica-Bold", 22)
-        p.drawCentredString(width/2, height - 2*cm, "MA SÉLECTION EXCLUSIVE")
-        
-        p.setFont("Helvetica", 10)
-        p.drawCentredString(width/2, height - 3*cm, "Catalogue personnalisé de garde-temps de prestige")
-        
-        # Summary bar
-        p.setStrokeColorRGB(0.77, 0.63, 0.35)
-        p.setFillColorRGB(0.98, 0.96, 0.92)
-        p.rect(2*cm, height - 4.5*cm, width - 4*cm, 1*cm, fill=1)
-        
-        p.setFillColorRGB(0.2, 0.2, 0.2)
-        p.setFont("Helvetica-Bold", 11)
-        p.drawString(2.5*cm, height - 4*cm, f"COLLECTION : {len(queryset)} pièces")
-        p.drawRightString(width - 2.5*cm, height - 4*cm, f"VALEUR TOTALE : {total_price} €")
-        
-        y = height - 6*cm
-        for i, watch in enumerate(queryset):
-            if y < 4*cm:
-                p.showPage()
-                y = height - 2*cm
-            
-            p.setStrokeColorRGB(0.77, 0.63, 0.35)
-            p.setFillColorRGB(1, 1, 1) # Reset fill for next pages/items
-            p.rect(2*cm, y - 3*cm, width - 4*cm, 3*cm)
-            
-            p.setFillColorRGB(0, 0, 0)
-            p.setFont("Helvetica-Bold", 14)
-            p.drawString(2.5*cm, y - 0.7*cm, f"{watch.brand.name} • {watch.model_name}")
-            
-            p.setFont("Helvetica", 10)
-            p.drawString(2.5*cm, y - 1.5*cm, f"Réf: {watch.reference_number}")
-            p.drawString(2.5*cm, y - 2.1*cm, f"Mouv: {watch.get_movement_type_display()}")
-            p.drawString(9*cm, y - 2.1*cm, f"Matériau: {watch.get_case_material_display()}")
-            
-            p.setFont("Helvetica-Bold", 12)
-            p.drawRightString(width - 2.5*cm, y - 1.5*cm, f"{watch.price} €")
-            
-            y -= 3.5*cm
-            
-        p.save()
-        buffer.seek(0)
-        return HttpResponse(buffer, content_type='application/pdf')
+        try:
+            ids = parse_ids(request.data.get('watch_ids', []))
+        except (TypeError, ValueError):
+            return Response({"error": "Identifiants invalides"}, status=400)
+        queued = self.queued_export(request, 'wishlist', ids)
+        if queued is not None:
+            return queued
+        return pdf_response(pdf().write_wishlist_pdf, ids)
 
     @action(detail=False, methods=['post'], url_path='export-comparison')
     def export_comparison(self, request):
         """Génère un tableau comparatif"""
-        watch_ids = request.data.get('watch_ids', [])
-        queryset = list(Watch.objects.filter(id__in=watch_ids).select_related('brand'))
-        buffer = BytesIO()
-        p = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-        
-        p.setFont("Helvetica-Bold", 20)
-        p.drawCentredString(width/2, height - 2*cm, "COMPARATIF HAUTE HORLOGERIE")
-        
-        data = [
-            ['Caractéristique'] + [f"{w.brand.name}\n{w.model_name}" for w in queryset],
-            ['Prix'] + [f"{w.price} €" for w in queryset],
-            ['Mouvement'] + [w.get_movement_type_display() for w in queryset],
-            ['Boîtier'] + [w.get_case_material_display() for w in queryset],
-            ['Diamètre'] + [f"{w.case_diameter} mm" for w in queryset],
-            ['Étanchéité'] + [f"{w.water_resistance} m" for w in queryset],
-        ]
-        
-        table = Table(data, colWidths=[3.5*cm] + [(width - 5.5*cm)/len(queryset)] * len(queryset))
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#c5a059")),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (0, -1), colors.HexColor("#f9f9f9")),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ]))
-        
-        table.wrapOn(p, width, height)
-        table.drawOn(p, 1*cm, height - 10*cm)
-        
-        p.save()
-        buffer.seek(0)
-        return HttpResponse(buffer, content_type='application/pdf')
+        try:
+            ids = parse_ids(request.data.get('watch_ids', []))
+        except (TypeError, ValueError):
+            return Response({"error": "Identifiants invalides"}, status=400)
+        queued = self.queued_export(request, 'comparison', ids)
+        if queued is not None:
+            return queued
+        # Même matrice (en cache) que /api/watches/compare/
+        return pdf_response(pdf().write_comparison_pdf, ids)